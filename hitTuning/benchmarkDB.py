@@ -0,0 +1,55 @@
+import os
+import time
+import argparse
+import tempfile
+from hitTuning import HitTuningDB, createGrid
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark HitTuningDB insert and update throughput")
+    parser.add_argument('-n', '--nRuns', type=int, default=100000, help='Number of runs to insert and update')
+    parser.add_argument('-b', '--batchSize', type=int, default=1000, help='Batch size for the buffered write mode')
+    parser.add_argument('-d', '--dir', type=str, default=None, help='Directory for the benchmark databases (default: temporary directory)')
+    return parser.parse_args()
+
+def benchmark(db_path, nRuns, paramGrid, buffered, batchSize):
+    """Insert nRuns runs and update each with results, returning (insert rate, update rate) in runs/s."""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    results = [[0.5, 0.5, 0.5, 0.5]] * 6
+
+    db = HitTuningDB(db_path, buffered=buffered, wal=buffered, batch_size=batchSize)
+    start = time.time()
+    if buffered:
+        ids = []
+        for first in range(0, nRuns, batchSize):
+            batch = range(first, min(first + batchSize, nRuns))
+            ids += db.add_runs([dict(params=paramGrid[i % len(paramGrid)], jobNum=i, fcl_filename=f'hitTuning_bench_{i}.fcl')
+                                for i in batch])
+        db.flush()
+    else:
+        ids = [db.add_run(paramGrid[i % len(paramGrid)], i, f'hitTuning_bench_{i}.fcl') for i in range(nRuns)]
+    insertTime = time.time() - start
+
+    start = time.time()
+    for run_id in ids:
+        db.update_output_filename(run_id, f'output_bench_{run_id}.root')
+        db.update_results(run_id, results)
+    db.flush()
+    updateTime = time.time() - start
+
+    assert db.count_runs() == nRuns
+    db.close()
+    return nRuns / insertTime, nRuns / updateTime
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    benchDir = args.dir if args.dir is not None else tempfile.mkdtemp(prefix='hitTuningBench')
+    paramGrid = createGrid()
+
+    print(f"Benchmarking {args.nRuns} runs in {benchDir}")
+    before = benchmark(os.path.join(benchDir, 'bench_autocommit.db'), args.nRuns, paramGrid, False, args.batchSize)
+    print(f"Per-statement commits:   insert {before[0]:10.0f} runs/s, update {before[1]:10.0f} runs/s")
+    after = benchmark(os.path.join(benchDir, 'bench_buffered.db'), args.nRuns, paramGrid, True, args.batchSize)
+    print(f"Buffered WAL executemany: insert {after[0]:10.0f} runs/s, update {after[1]:10.0f} runs/s")
+    print(f"Speedup: insert x{after[0] / before[0]:.1f}, update x{after[1] / before[1]:.1f}")
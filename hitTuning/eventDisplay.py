@@ -1,6 +1,8 @@
-import os, sys
+import os, sys, time
 import ROOT as r
 import argparse
+import numpy as np
+from eventIndex import EventIndex, buildIndex, inputFiles, fileIdentity
 
 def parse_args():
 	parser = argparse.ArgumentParser(description="Hit Tuning Parameter Scan")
@@ -8,8 +10,11 @@ def parse_args():
 	parser.add_argument('--tag', type=str, default='test', help='Tag for output files')
 	parser.add_argument('-d', '--debug', action='store_true', help='Enable debug mode')
 	parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
-	parser.add_argument('-i', '--inputFile', type=str, default='', help='Input file to process')
+	parser.add_argument('-i', '--inputFile', type=str, default='', help='Input ROOT file or file list to process')
 	parser.add_argument('-e', '--eventNumber', type=int, default=0, help='Event number to display')
+	parser.add_argument('-r', '--run', type=int, default=None, help='Run number of the event to display (any run if not given)')
+	parser.add_argument('-s', '--subrun', type=int, default=None, help='Subrun number of the event to display (any subrun if not given)')
+	parser.add_argument('--index', type=str, default=None, help='Event index database (see eventIndex.py) used to jump to the event; the input is added to it first')
 	parser.add_argument('-p', '--plane', type=int, default=0, help='Plane number to display (0, 1, or 2)')
 	parser.add_argument('-t', '--timeRange', type=int, nargs=2, default=[0, 5000], help='Time range to display (min max)')
 	parser.add_argument('-w', '--wireRange', type=int, nargs=2, default=[0, 0], help='Wire range to display (min max)')
@@ -54,17 +59,88 @@ def getBounds(plane, det):
 		elif det == 'WW': return [49536, 55295]
 	return [0, 0]
 
+def fillWireImage(h_wire2d, wires, r_wires, r_time, verbose=False):
+	"""Fill a wire display histogram with the signal of every wire in the channel range.
+
+	Each wire's dense signal is expanded once and copied into a NumPy image
+	in the bin layout of the TH2 (including under/overflow bins), which is
+	then loaded with a single SetContent call. Time runs downwards: tick
+	r_time[0] is drawn in the top bin and tick r_time[1] - 1 in the bottom bin.
+
+	Returns the number of wires filled.
+	"""
+	nx = h_wire2d.GetNbinsX()
+	ny = h_wire2d.GetNbinsY()
+	image = np.zeros((ny + 2, nx + 2))
+	nWires = 0
+	nFilled = 0
+	for w in wires:
+		channel = w.Channel()
+		if verbose: print(f"processing wire {channel}")
+		if channel < r_wires[0] or channel > r_wires[1]: continue
+
+		# Keep the expanded vector alive while NumPy views its buffer
+		signal = w.Signal()
+		values = np.asarray(signal)
+		nTicks = min(r_time[1], len(values)) - r_time[0]
+		if nTicks <= 0: continue
+		# The last channel of the range falls into the overflow bin, as with FindBin
+		image[ny:ny - nTicks:-1, channel - r_wires[0] + 1] = values[r_time[0]:r_time[0] + nTicks]
+		nWires += 1
+		nFilled += nTicks
+
+	h_wire2d.SetContent(image.ravel())
+	h_wire2d.SetEntries(nFilled)
+	return nWires
+
+def locateEvent(indexPath, inputs, eventNumber, run=None, subrun=None):
+	"""Look up the file and entry of an event in the event index.
+
+	The inputs, if any, are added to the index first (only new or changed
+	files are read) and the lookup is restricted to them. Exits if several
+	runs or subruns have an event with this number.
+
+	Returns the index match (path, entry, run, subrun, event), or None if the
+	event is not indexed.
+	"""
+	index = EventIndex(indexPath)
+	paths = None
+	if inputs:
+		buildIndex(index, inputs)
+		paths = [fileIdentity(path)[0] for path in inputFiles(inputs)]
+	matches = index.lookup(eventNumber, run, subrun, paths)
+	index.close()
+
+	if len({(m['run'], m['subrun']) for m in matches}) > 1:
+		print(f"Event {eventNumber} is ambiguous, select it with --run/--subrun:")
+		for m in matches: print(f"  run {m['run']} subrun {m['subrun']}: {m['path']} entry {m['entry']}")
+		sys.exit(1)
+	return matches[0] if matches else None
+
 if __name__ == "__main__":
 	
 	args = parse_args()
 
 	tag = args.tag
 	plane = args.plane
-	filenames = r.vector(r.string)(1, args.inputFile)
 	eventNumber = int(args.eventNumber)
 	r_time = args.timeRange
 	wire_bounds = args.wireRange
 
+	inputs = [args.inputFile] if args.inputFile else []
+	entry = None
+	if args.index:
+		match = locateEvent(args.index, inputs, eventNumber, args.run, args.subrun)
+		if match is None:
+			print(f"Error: event {eventNumber} not found in index {args.index}")
+			sys.exit(1)
+		entry = match['entry']
+		print(f"Run {match['run']} subrun {match['subrun']} event {eventNumber} is entry {entry} of {match['path']}")
+		filenames = r.vector(r.string)(1, match['path'])
+	else:
+		filenames = r.vector(r.string)()
+		for path in inputFiles(inputs): filenames.push_back(path)
+
 	initialize()
 
 	histfile = r.TFile(f"{args.outputDir}/display_{tag}_evt{eventNumber}_plane{plane}.root", "RECREATE")
@@ -82,6 +158,7 @@ if __name__ == "__main__":
 
 	print("Creating event object ...")
 	ev = r.gallery.Event(filenames)
+	if entry is not None: ev.goToEntry(entry)
 
 	GetVH_Hits = r.gallery.Event.getValidHandle['std::vector<recob::Hit>']
 	GetVH_Wire = r.gallery.Event.getValidHandle['std::vector<recob::Wire>']
@@ -94,9 +171,10 @@ if __name__ == "__main__":
 
 		event = ev.eventAuxiliary().event()
 		run = ev.eventAuxiliary().run()
+		subrun = ev.eventAuxiliary().subRun()
 		print(f"Run {run}, event {event}")
 
-		if event != eventNumber: 
+		if event != eventNumber or (args.run is not None and run != args.run) or (args.subrun is not None and subrun != args.subrun):
 			ev.next()
 			continue
 
@@ -138,20 +216,9 @@ if __name__ == "__main__":
 				print(f"There are {nWires} wires with {nTicks} clock ticks")
 				
 
-				for iw, w in enumerate(wire):
-					if (args.verbose): print(f"processing {det} wire {w.Channel()}")
-					if w.Channel() < r_wires[0]: continue
-					if w.Channel() > r_wires[1]: continue
-
-					totalTicks = w.NSignal()
-					for it, t in enumerate(w.Signal()):
-						if it < r_time[0] or it > r_time[1]: continue
-						binX_ = h_wire2d.GetXaxis().FindBin(w.Channel())
-						binY_ = h_wire2d.GetYaxis().FindBin(it)
-						binY_ = h_wire2d.GetNbinsY() - binY_
-
-						h_wire2d.SetBinContent(binX_, binY_, w.Signal()[it])
-
+				start = time.time()
+				nFilled = fillWireImage(h_wire2d, wire, r_wires, r_time, args.verbose)
+				print(f"Filled {nFilled} wires of {det} in {time.time() - start:.2f} s")
 				
 				c1.cd()
 				if h_wire2d.GetMinimum() >= 0: h_wire2d.GetZaxis().SetRangeUser(-1, h_wire2d.GetMaximum()*1.2)
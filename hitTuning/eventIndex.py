@@ -0,0 +1,240 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Tuple
+
+def inputFiles(inputs: List[str]) -> List[str]:
+    """Expand ROOT files and text file lists (one path per line, '#' comments) into ROOT file paths.
+
+    Args:
+        inputs: ROOT files, local or remote, and file lists such as those written by getStage0Files.sh
+
+    Returns:
+        ROOT file paths in input order
+    """
+    paths = []
+    for inputFile in inputs:
+        if inputFile.endswith('.root'):
+            paths.append(inputFile)
+            continue
+        with open(inputFile) as f:
+            paths += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return paths
+
+def fileIdentity(path: str) -> Tuple[str, int, int]:
+    """Return the (path, size, mtime) identity used to detect changed input files.
+
+    Remote URLs and files that cannot be stat'ed get a size and mtime of -1,
+    so they are only indexed once unless a rescan is requested.
+
+    Args:
+        path: ROOT file path or URL
+
+    Returns:
+        Tuple of (absolute path or URL, size in bytes, modification time in nanoseconds)
+    """
+    if '://' in path or not os.path.exists(path):
+        return path, -1, -1
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_size, st.st_mtime_ns
+
+def loadGallery() -> Any:
+    """Load the gallery headers and library into PyROOT, once per process, and return the ROOT module."""
+    import ROOT as r
+    if not hasattr(loadGallery, 'loaded'):
+        r.gROOT.ProcessLine('#include "gallery/Event.h"')
+        r.gSystem.Load("libgallery")
+        loadGallery.loaded = True
+    return r
+
+def readEventIds(path: str) -> List[Tuple[int, int, int, int]]:
+    """Read the ID and entry number of every event of a file with gallery.
+
+    Only the event auxiliary branch is read; no data product is requested.
+
+    Args:
+        path: ROOT file path or URL
+
+    Returns:
+        List of (run, subrun, event, entry), entry being the event's entry in the file
+    """
+    r = loadGallery()
+    ev = r.gallery.Event(r.vector(r.string)(1, path))
+    rows = []
+    while not ev.atEnd():
+        aux = ev.eventAuxiliary()
+        rows.append((aux.run(), aux.subRun(), aux.event(), ev.eventEntry()))
+        ev.next()
+    return rows
+
+class EventIndex:
+    """On-disk index from (run, subrun, event) to the file and entry holding the event.
+
+    The index is a small SQLite database with one row per indexed file and per
+    event. Files are re-read only when added or changed, so an index of a large
+    file list is cheap to keep up to date.
+    """
+
+    def __init__(self, dbPath: str = 'eventIndex.db') -> None:
+        self.dbPath = dbPath
+        self.conn = sqlite3.connect(dbPath)
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                size INTEGER,
+                mtime INTEGER,
+                n_events INTEGER,
+                indexed TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS events (
+                run INTEGER NOT NULL,
+                subrun INTEGER NOT NULL,
+                event INTEGER NOT NULL,
+                file_id INTEGER NOT NULL,
+                entry INTEGER NOT NULL,
+                PRIMARY KEY (run, subrun, event, file_id)
+            ) WITHOUT ROWID
+        ''')
+        # Lookups without a run number, and removal of the events of a changed file
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_event ON events (event)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_file ON events (file_id)')
+        self.conn.commit()
+
+    def is_current(self, path: str, size: int, mtime: int) -> bool:
+        """Return whether a file is indexed with this size and modification time."""
+        cursor = self.conn.execute('SELECT 1 FROM files WHERE path = ? AND size = ? AND mtime = ?',
+                                   (path, size, mtime))
+        return cursor.fetchone() is not None
+
+    def set_file(self, path: str, size: int, mtime: int, rows: List[Tuple[int, int, int, int]]) -> None:
+        """Replace the indexed events of a file.
+
+        Args:
+            path: Absolute path or URL of the file
+            size: Size of the indexed file in bytes
+            mtime: Modification time of the indexed file in nanoseconds
+            rows: One (run, subrun, event, entry) row per event, from readEventIds
+        """
+        cursor = self.conn.cursor()
+        indexed = datetime.now().isoformat()
+        row = cursor.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            cursor.execute('INSERT INTO files (path, size, mtime, n_events, indexed) VALUES (?, ?, ?, ?, ?)',
+                           (path, size, mtime, len(rows), indexed))
+            fileId = cursor.lastrowid
+        else:
+            # Keep the file ID so the events of other files are untouched
+            fileId = row[0]
+            cursor.execute('UPDATE files SET size = ?, mtime = ?, n_events = ?, indexed = ? WHERE id = ?',
+                           (size, mtime, len(rows), indexed, fileId))
+            cursor.execute('DELETE FROM events WHERE file_id = ?', (fileId,))
+        # A file holds each event once; keep the first entry if it does not
+        cursor.executemany('INSERT OR IGNORE INTO events (run, subrun, event, file_id, entry) VALUES (?, ?, ?, ?, ?)',
+                           [(run, subrun, event, fileId, entry) for run, subrun, event, entry in rows])
+        self.conn.commit()
+
+    def lookup(self, event: int, run: Optional[int] = None, subrun: Optional[int] = None,
+               paths: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Find the files and entries holding an event.
+
+        Args:
+            event: Event number
+            run: Run number, or None to match any run
+            subrun: Subrun number, or None to match any subrun
+            paths: Only return matches in these files (as stored, see fileIdentity)
+
+        Returns:
+            List of dictionaries with path, entry, run, subrun and event, ordered by run, subrun and path
+        """
+        query = ('SELECT f.path, e.entry, e.run, e.subrun, e.event FROM events e JOIN files f ON f.id = e.file_id '
+                 'WHERE e.event = ?')
+        params: List[Any] = [event]
+        if run is not None:
+            query += ' AND e.run = ?'
+            params.append(run)
+        if subrun is not None:
+            query += ' AND e.subrun = ?'
+            params.append(subrun)
+        matches = [dict(path=row[0], entry=row[1], run=row[2], subrun=row[3], event=row[4])
+                   for row in self.conn.execute(query + ' ORDER BY e.run, e.subrun, f.path', params)]
+        if paths is not None:
+            wanted = set(paths)
+            matches = [match for match in matches if match['path'] in wanted]
+        return matches
+
+    def close(self) -> None:
+        self.conn.close()
+
+def buildIndex(index: EventIndex, inputs: List[str], rescan: bool = False) -> Dict[str, int]:
+    """Add the events of new or changed input files to the index.
+
+    Files whose size and modification time are unchanged since they were
+    indexed are skipped, as are already indexed remote files unless rescan is
+    set. A file that cannot be read is reported and left out.
+
+    Args:
+        index: Index to update
+        inputs: ROOT files and file lists, see inputFiles
+        rescan: Re-read every file
+
+    Returns:
+        Dictionary of indexed, skipped and failed file counts and the number of events indexed
+    """
+    counts = dict(indexed=0, skipped=0, failed=0, events=0)
+    for path in inputFiles(inputs):
+        identity = fileIdentity(path)
+        if not rescan and index.is_current(*identity):
+            counts['skipped'] += 1
+            continue
+        start = time.time()
+        try:
+            rows = readEventIds(path)
+        except Exception as e:
+            print(f"Error: could not index {path}: {e}")
+            counts['failed'] += 1
+            continue
+        index.set_file(*identity, rows)
+        print(f"Indexed {len(rows)} events of {path} in {time.time() - start:.1f} s")
+        counts['indexed'] += 1
+        counts['events'] += len(rows)
+    return counts
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Index the (run, subrun, event) IDs of art ROOT files "
+                                                 "and look up the file and entry of an event")
+    parser.add_argument('-d', '--db', type=str, default='eventIndex.db', help='Event index database')
+    parser.add_argument('-i', '--inputFiles', type=str, nargs='*', default=[],
+                        help='ROOT files or file lists to add to the index')
+    parser.add_argument('--rescan', action='store_true', help='Re-read files that are already indexed')
+    parser.add_argument('-e', '--event', type=int, default=None, help='Event number to look up')
+    parser.add_argument('-r', '--run', type=int, default=None, help='Run number of the event to look up')
+    parser.add_argument('-s', '--subrun', type=int, default=None, help='Subrun number of the event to look up')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    index = EventIndex(args.db)
+    if args.inputFiles:
+        counts = buildIndex(index, args.inputFiles, args.rescan)
+        print(f"Indexed {counts['events']} events of {counts['indexed']} files "
+              f"({counts['skipped']} unchanged, {counts['failed']} failed) into {args.db}")
+    if args.event is not None:
+        matches = index.lookup(args.event, args.run, args.subrun)
+        if not matches:
+            print(f"Event {args.event} not found in {args.db}")
+            index.close()
+            sys.exit(1)
+        for match in matches:
+            print(f"Run {match['run']} subrun {match['subrun']} event {match['event']}: "
+                  f"{match['path']} entry {match['entry']}")
+    index.close()
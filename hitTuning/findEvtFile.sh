@@ -2,23 +2,26 @@
 
 # Script: findEvtFile.sh
 # Description: Searches for specific event files in the ICARUS data catalog
-# This script uses SAMWeb to find and locate files matching event criteria
+# This script uses SAMWeb to find the candidate files and the event index (eventIndex.py) to locate the event
+
+# Event to find and the index database, which keeps the files already read for later searches
+run=9746
+event=166767
+indexDB="eventIndex.db"
+fileList="evtFiles_run${run}.txt"
 
 # Define dataset query for specific run and event range
-files=$(samweb -e icarus list-files "defname: run2_compression_production_v09_82_02_01_numimajority_compressed_data and run_number 9746 and first_event > 164000 and last_event < 172000")
+files=$(samweb -e icarus list-files "defname: run2_compression_production_v09_82_02_01_numimajority_compressed_data and run_number ${run} and first_event > 164000 and last_event < 172000")
 
-# Loop through each file found and locate it, then search for specific event
+# Locate each file in dcache storage and write the full paths to the file list
+> "$fileList"
 for f in $files; do
-    echo "------------------------------"
-    echo "File: $f"
-    
-    # Locate file in dcache storage
     path=$(samweb -e icarus locate-file "$f" | head -n 1)
     path=${path#dcache:}  # Remove dcache: prefix
-    filePath="${path}/${f}"
-    
-    echo "Full Path: $filePath"
-    
-    # Search for event 166767 in the file
-    file_info_dumper --event-list $filePath | grep 166767
-done
\ No newline at end of file
+    echo "${path}/${f}" >> "$fileList"
+done
+
+echo "Located $(wc -l < "$fileList") files, written to $fileList"
+
+# Add the files not yet in the index, then print the file and entry holding the event
+python "$(dirname "$0")/eventIndex.py" -d "$indexDB" -i "$fileList" -r "$run" -e "$event"
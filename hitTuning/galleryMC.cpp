@@ -25,7 +25,9 @@
 #include "TStyle.h"
 #include "TROOT.h"
 #include "TLegend.h"
+#include "TTree.h"
 #include <numeric>
+#include <array>
 
 const auto safeDivide = [](float a, float b) -> float {
     return b != 0.0f ? a / b : 0.0f;
@@ -123,7 +125,23 @@ int getPlane(int channelID){
     return -1; // invalid channel
 }
 
-std::vector<std::vector<float>> galleryMC(std::string const& inputFile = "nominalTest.root", std::string const& outputFile = "histnominalTest.root") {
+// Sum the IDE energy deposited on each plane
+void sumIdeEnergy(const std::vector<sim::SimChannel>& simChannels, float ideEnergy[3]) {
+    for (auto const& sc : simChannels) {
+        int plane = getPlane(sc.Channel());
+        if (plane < 0) continue;
+        for (auto const& kv : sc.TDCIDEMap()) {
+            for (auto const& ide : kv.second) {
+                ideEnergy[plane] += ide.energy;
+            }
+        }
+    }
+}
+
+// If dumpFile is given, the hit-truth matches and per-plane IDE energies of every event
+// are also written to flat trees (hitTruth, ideTruth) so the ratios can be recomputed
+// with different cuts without another gallery pass
+std::vector<std::vector<float>> galleryMC(std::string const& inputFile = "nominalTest.root", std::string const& outputFile = "histnominalTest.root", std::string const& dumpFile = "") {
     gStyle->SetOptStat(0);
     gROOT->SetBatch(kTRUE);
 
@@ -290,6 +308,29 @@ std::vector<std::vector<float>> galleryMC(std::string const& inputFile = "nomina
     float totalHitEnergyPi[3] = {0.0, 0.0, 0.0};
     float totalIdeEnergyPi[3] = {0.0, 0.0, 0.0};
 
+    TFile* dumpOut = nullptr;
+    TTree* hitTree = nullptr;
+    TTree* ideTree = nullptr;
+    int dEvent = 0, dRun = 0, dSubRun = 0, dEvt = 0, dPlane = 0, dPdg = 0;
+    float dEnergy = 0.0, dIdeFraction = 0.0;
+    if (!dumpFile.empty()) {
+        dumpOut = TFile::Open(dumpFile.c_str(), "RECREATE");
+        hitTree = new TTree("hitTruth", "Hit to MCParticle matches");
+        hitTree->Branch("event", &dEvent);
+        hitTree->Branch("run", &dRun);
+        hitTree->Branch("subrun", &dSubRun);
+        hitTree->Branch("evt", &dEvt);
+        hitTree->Branch("plane", &dPlane);
+        hitTree->Branch("pdg", &dPdg);
+        hitTree->Branch("energy", &dEnergy);
+        hitTree->Branch("ideFraction", &dIdeFraction);
+        ideTree = new TTree("ideTruth", "IDE energy per event and plane");
+        ideTree->Branch("event", &dEvent);
+        ideTree->Branch("plane", &dPlane);
+        ideTree->Branch("energy", &dEnergy);
+        outFile->cd();
+    }
+
     int evtCounter = 0;
     // Loop over events
     while (!ev.atEnd()) {
@@ -400,6 +441,18 @@ std::vector<std::vector<float>> galleryMC(std::string const& inputFile = "nomina
 
             eventHitEnergy[plane] += matchdata.energy * matchdata.ideFraction;
 
+            if (hitTree) {
+                dEvent = evtCounter;
+                dRun = ev.eventAuxiliary().run();
+                dSubRun = ev.eventAuxiliary().subRun();
+                dEvt = ev.eventAuxiliary().event();
+                dPlane = plane;
+                dPdg = mcpart->PdgCode();
+                dEnergy = matchdata.energy;
+                dIdeFraction = matchdata.ideFraction;
+                hitTree->Fill();
+            }
+
             /*if ( showerMatched ) {
                 std::cout << "Event " << evtCounter << ": Matched hit on channel " << hit->Channel() << " start time " << hit->StartTick()
                           << " to MCParticle PDG " << mcpart->PdgCode() << " Track ID " << mcpart->TrackId()
@@ -411,6 +464,15 @@ std::vector<std::vector<float>> galleryMC(std::string const& inputFile = "nomina
         }
 
         if (!foundElectron && !foundPhoton && !foundMuon && !foundPion && !foundProton) {
+            if (ideTree) {
+                sumIdeEnergy(simHandle, eventIdeEnergy);
+                for (int plane = 0; plane < planes; ++plane) {
+                    dEvent = evtCounter;
+                    dPlane = plane;
+                    dEnergy = eventIdeEnergy[plane];
+                    ideTree->Fill();
+                }
+            }
             ev.next();
             evtCounter++;
             continue;
@@ -423,6 +485,7 @@ std::vector<std::vector<float>> galleryMC(std::string const& inputFile = "nomina
         int maxTrackId = -1;
         for (auto const& sc : simHandle) {
             int plane = getPlane(sc.Channel());
+            if (plane < 0) continue;
             auto const& tdcide_map = sc.TDCIDEMap();
             for (auto const& kv : tdcide_map) {
                 unsigned int tick = kv.first;
@@ -464,6 +527,15 @@ std::vector<std::vector<float>> galleryMC(std::string const& inputFile = "nomina
             else h_maxEParticleCount->Fill(5);
         }
 
+        if (ideTree) {
+            for (int plane = 0; plane < planes; ++plane) {
+                dEvent = evtCounter;
+                dPlane = plane;
+                dEnergy = eventIdeEnergy[plane];
+                ideTree->Fill();
+            }
+        }
+
         float totalEnergyRatio = 0.0;
         for (size_t i = 0; i < planes; ++i) {
             if (eventIdeEnergy[i] > 0) {
@@ -688,37 +760,197 @@ std::vector<std::vector<float>> galleryMC(std::string const& inputFile = "nomina
 
     outFile->Close();
 
+    if (dumpOut) {
+        dumpOut->cd();
+        hitTree->Write();
+        ideTree->Write();
+        dumpOut->Close();
+    }
+
     std::vector<std::vector<float>> results;
     results.push_back(std::vector<float>{
-                                        safeDivide(std::accumulate(totalHitEnergy, totalHitEnergy+3, 0), std::accumulate(totalIdeEnergy, totalIdeEnergy+3, 0.0)),
+                                        safeDivide(std::accumulate(totalHitEnergy, totalHitEnergy+3, 0.0f), std::accumulate(totalIdeEnergy, totalIdeEnergy+3, 0.0f)),
                                         safeDivide(totalHitEnergy[0], totalIdeEnergy[0]),
                                         safeDivide(totalHitEnergy[1], totalIdeEnergy[1]),
                                         safeDivide(totalHitEnergy[2], totalIdeEnergy[2])});
     results.push_back(std::vector<float>{
-                                        safeDivide(std::accumulate(totalHitEnergyEle, totalHitEnergyEle+3, 0), std::accumulate(totalIdeEnergyEle, totalIdeEnergyEle+3, 0.0)),
+                                        safeDivide(std::accumulate(totalHitEnergyEle, totalHitEnergyEle+3, 0.0f), std::accumulate(totalIdeEnergyEle, totalIdeEnergyEle+3, 0.0f)),
                                         safeDivide(totalHitEnergyEle[0], totalIdeEnergyEle[0]),
                                         safeDivide(totalHitEnergyEle[1], totalIdeEnergyEle[1]),
                                         safeDivide(totalHitEnergyEle[2], totalIdeEnergyEle[2])});
     results.push_back(std::vector<float>{
-                                        safeDivide(std::accumulate(totalHitEnergyGamma, totalHitEnergyGamma+3, 0), std::accumulate(totalIdeEnergyGamma, totalIdeEnergyGamma+3, 0.0)),
+                                        safeDivide(std::accumulate(totalHitEnergyGamma, totalHitEnergyGamma+3, 0.0f), std::accumulate(totalIdeEnergyGamma, totalIdeEnergyGamma+3, 0.0f)),
                                         safeDivide(totalHitEnergyGamma[0], totalIdeEnergyGamma[0]),
                                         safeDivide(totalHitEnergyGamma[1], totalIdeEnergyGamma[1]),
                                         safeDivide(totalHitEnergyGamma[2], totalIdeEnergyGamma[2])});
     results.push_back(std::vector<float>{
-                                        safeDivide(std::accumulate(totalHitEnergyMu, totalHitEnergyMu+3, 0), std::accumulate(totalIdeEnergyMu, totalIdeEnergyMu+3, 0.0)),
+                                        safeDivide(std::accumulate(totalHitEnergyMu, totalHitEnergyMu+3, 0.0f), std::accumulate(totalIdeEnergyMu, totalIdeEnergyMu+3, 0.0f)),
                                         safeDivide(totalHitEnergyMu[0], totalIdeEnergyMu[0]),
                                         safeDivide(totalHitEnergyMu[1], totalIdeEnergyMu[1]),
                                         safeDivide(totalHitEnergyMu[2], totalIdeEnergyMu[2])});
     results.push_back(std::vector<float>{
-                                        safeDivide(std::accumulate(totalHitEnergyP, totalHitEnergyP+3, 0), std::accumulate(totalIdeEnergyP, totalIdeEnergyP+3, 0.0)),
+                                        safeDivide(std::accumulate(totalHitEnergyP, totalHitEnergyP+3, 0.0f), std::accumulate(totalIdeEnergyP, totalIdeEnergyP+3, 0.0f)),
                                         safeDivide(totalHitEnergyP[0], totalIdeEnergyP[0]),
                                         safeDivide(totalHitEnergyP[1], totalIdeEnergyP[1]),
                                         safeDivide(totalHitEnergyP[2], totalIdeEnergyP[2])});
     results.push_back(std::vector<float>{
-                                        safeDivide(std::accumulate(totalHitEnergyPi, totalHitEnergyPi+3, 0), std::accumulate(totalIdeEnergyPi, totalIdeEnergyPi+3, 0.0)),
+                                        safeDivide(std::accumulate(totalHitEnergyPi, totalHitEnergyPi+3, 0.0f), std::accumulate(totalIdeEnergyPi, totalIdeEnergyPi+3, 0.0f)),
                                         safeDivide(totalHitEnergyPi[0], totalIdeEnergyPi[0]),
                                         safeDivide(totalHitEnergyPi[1], totalIdeEnergyPi[1]),
                                         safeDivide(totalHitEnergyPi[2], totalIdeEnergyPi[2])});
     
     return results;
-}
\ No newline at end of file
+}
+
+// Results row of the MC particle class of a PDG code (1 ele, 2 gamma, 3 mu, 4 p, 5 pi), 0 for others
+int particleClass(int pdg) {
+    switch (abs(pdg)) {
+        case 11: return 1;
+        case 22: return 2;
+        case 13: return 3;
+        case 2212: return 4;
+        case 211:
+        case 111: return 5;
+        default: return 0;
+    }
+}
+
+// Evaluate several hit finder configurations packed into one lar job in a single event loop.
+// Configuration k reads the hits associated by "mcassociationsGausCryoE" + labelSuffixes[k]
+// and gets the same results matrix as galleryMC; the SimChannel IDE energy is summed once per event.
+// Only the per-plane energy histograms of configuration k are written, to directory labelSuffixes[k] of outputFile;
+// the per-particle, hit integral/ADC/fit histograms and the hit-truth dump of galleryMC are not produced.
+std::vector<std::vector<std::vector<float>>> galleryMCPacked(std::string const& inputFile, std::string const& outputFile, std::vector<std::string> const& labelSuffixes) {
+    gROOT->SetBatch(kTRUE);
+
+    int planes = 3;
+    size_t nConfigs = labelSuffixes.size();
+
+    std::vector<std::string> filenames;
+    filenames.push_back(inputFile);
+
+    // Create gallery event loop
+    gallery::Event ev(filenames);
+
+    TFile* outFile = TFile::Open(outputFile.c_str(), "RECREATE");
+
+    std::vector<std::vector<TH1F*>> h_hitEnergy(nConfigs);
+    std::vector<std::vector<TH1F*>> h_ideEnergy(nConfigs);
+    std::vector<std::vector<TH1F*>> h_energyRatio(nConfigs);
+    for (size_t k = 0; k < nConfigs; ++k) {
+        outFile->mkdir(labelSuffixes[k].c_str())->cd();
+        for (int i = 0; i < planes; ++i) {
+            h_hitEnergy[k].push_back(new TH1F(Form("h_hitEnergy_plane%d", i), Form("Hit Energy from BackTrackerHitMatchingData Plane %d;Energy (MeV);Counts", i), 100, 0, 1e4));
+            h_ideEnergy[k].push_back(new TH1F(Form("h_ideEnergy_plane%d", i), Form("IDE Energy from SimChannel Plane %d;Energy (MeV);Counts", i), 100, 0, 1e4));
+            h_energyRatio[k].push_back(new TH1F(Form("h_energyRatio_plane%d", i), Form("Ratio of Hit Energy to IDE Energy Plane %d;Hit Energy / IDE Energy;Counts", i), 256, -2, 1.2));
+        }
+    }
+
+    // Hit and IDE energy sums per configuration, results row (total, ele, gamma, mu, p, pi) and plane
+    std::vector<std::array<std::array<float, 3>, 6>> totalHitEnergy(nConfigs);
+    std::vector<std::array<std::array<float, 3>, 6>> totalIdeEnergy(nConfigs);
+    for (size_t k = 0; k < nConfigs; ++k) {
+        for (auto& row : totalHitEnergy[k]) row.fill(0.0f);
+        for (auto& row : totalIdeEnergy[k]) row.fill(0.0f);
+    }
+
+    int evtCounter = 0;
+    // Loop over events
+    while (!ev.atEnd()) {
+        auto const& simHandle = *ev.getValidHandle<std::vector<sim::SimChannel>>("merge");
+        float eventIdeEnergy[3] = {0.0, 0.0, 0.0};
+        sumIdeEnergy(simHandle, eventIdeEnergy);
+
+        for (size_t k = 0; k < nConfigs; ++k) {
+            auto const& hitTruthAssns = *ev.getValidHandle<art::Assns<recob::Hit, simb::MCParticle, anab::BackTrackerHitMatchingData>>("mcassociationsGausCryoE" + labelSuffixes[k]);
+
+            float eventHitEnergy[3] = {0.0, 0.0, 0.0};
+            bool found[6] = {false, false, false, false, false, false};
+            for (auto it = hitTruthAssns.begin(); it != hitTruthAssns.end(); ++it) {
+                auto const& [hit, mcpart, _unused] = *it;
+                auto const& matchdata = hitTruthAssns.data(it);
+                int plane = hit->WireID().getIndex<2>();
+                int particle = particleClass(mcpart->PdgCode());
+                if (particle > 0 && matchdata.energy > 0) found[particle] = true;
+                eventHitEnergy[plane] += matchdata.energy * matchdata.ideFraction;
+            }
+            found[0] = found[1] || found[2] || found[3] || found[4] || found[5];
+            if (!found[0]) continue;
+
+            for (int plane = 0; plane < planes; ++plane) {
+                h_hitEnergy[k][plane]->Fill(eventHitEnergy[plane]);
+                h_ideEnergy[k][plane]->Fill(eventIdeEnergy[plane]);
+                h_energyRatio[k][plane]->Fill(getFillValue(eventHitEnergy[plane], eventIdeEnergy[plane]));
+                for (int row = 0; row < 6; ++row) {
+                    if (!found[row]) continue;
+                    totalHitEnergy[k][row][plane] += eventHitEnergy[plane];
+                    totalIdeEnergy[k][row][plane] += eventIdeEnergy[plane];
+                }
+            }
+        }
+
+        ev.next();
+        evtCounter++;
+    }
+    std::cout << "Processed " << evtCounter << " events for " << nConfigs << " packed configurations" << std::endl;
+
+    outFile->Write();
+    outFile->Close();
+
+    std::vector<std::vector<std::vector<float>>> results(nConfigs);
+    for (size_t k = 0; k < nConfigs; ++k) {
+        for (int row = 0; row < 6; ++row) {
+            auto const& hitE = totalHitEnergy[k][row];
+            auto const& ideE = totalIdeEnergy[k][row];
+            results[k].push_back(std::vector<float>{
+                                        safeDivide(hitE[0] + hitE[1] + hitE[2], ideE[0] + ideE[1] + ideE[2]),
+                                        safeDivide(hitE[0], ideE[0]),
+                                        safeDivide(hitE[1], ideE[1]),
+                                        safeDivide(hitE[2], ideE[2])});
+        }
+    }
+
+    return results;
+}
+
+
+// Summarise the truth content of every event for the event pre-selection index.
+// Returns one row {run, subrun, event, total, ele, gamma, mu, p, pi} per event, where each energy is
+// the collection plane IDE energy (MeV) deposited by tracks of that particle class (dropped
+// shower daughters, with negative track IDs, count towards their saved ancestor)
+std::vector<std::vector<double>> eventTruthSummary(std::string const& inputFile) {
+    std::vector<std::string> filenames;
+    filenames.push_back(inputFile);
+
+    // Create gallery event loop
+    gallery::Event ev(filenames);
+
+    std::vector<std::vector<double>> rows;
+    while (!ev.atEnd()) {
+        auto const& mcHandle = *ev.getValidHandle<std::vector<simb::MCParticle>>("largeant");
+        auto const& simHandle = *ev.getValidHandle<std::vector<sim::SimChannel>>("merge");
+
+        std::unordered_map<int, int> trackIdToClass;
+        for (auto const& p : mcHandle) {
+            trackIdToClass[p.TrackId()] = particleClass(p.PdgCode());
+        }
+
+        auto const& aux = ev.eventAuxiliary();
+        std::vector<double> row = {double(aux.run()), double(aux.subRun()), double(aux.event()), 0, 0, 0, 0, 0, 0};
+        for (auto const& sc : simHandle) {
+            if (getPlane(sc.Channel()) != 2) continue;
+            for (auto const& kv : sc.TDCIDEMap()) {
+                for (auto const& ide : kv.second) {
+                    row[3] += ide.energy;
+                    auto it = trackIdToClass.find(std::abs(ide.trackID));
+                    if (it != trackIdToClass.end() && it->second > 0) row[3 + it->second] += ide.energy;
+                }
+            }
+        }
+        rows.push_back(row);
+        ev.next();
+    }
+    std::cout << "Indexed " << rows.size() << " events in " << inputFile << std::endl;
+
+    return rows;
+}
@@ -3,10 +3,24 @@ import sqlite3
 from datetime import datetime
 from typing import List, Optional, Dict, Any, Union, Tuple
 import ROOT as r
-from itertools import product
+from itertools import product, groupby
 import argparse
 import sys
 import re
+import multiprocessing
+import hashlib
+import json
+import time
+import math
+import random
+import shutil
+import tempfile
+import subprocess
+import shlex
+import ast
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
 
 class fclParams:
     """Class to hold FCL (FHiCL) configuration parameters for hit finding."""
@@ -118,67 +132,224 @@ def get_all_values(key: str, text: str) -> List[Union[List, bool, int, float, st
     matches = re.findall(pattern, text)
     return [_parse_value(m.strip()) for m in matches]
 
+# One "key: value" assignment per line; the value runs to the end of the line or a trailing comment
+_FCL_ASSIGNMENT = re.compile(r'^[ \t]*([A-Za-z_][\w.]*)[ \t]*:[ \t]*([^\n#]+)', re.MULTILINE)
+
+def _fcl_assignments(text: str) -> Dict[str, str]:
+    """Collect the raw value string of every key: value assignment in a single pass.
+    
+    The result is ordered by the last occurrence of each key, and a key
+    assigned several times keeps its last value.
+    """
+    assignments = {}
+    for key, value in _FCL_ASSIGNMENT.findall(text):
+        assignments.pop(key, None)
+        assignments[key] = value
+    return assignments
+
+def parse_fcl_text(text: str) -> Dict[str, Any]:
+    """Extract every key: value assignment of a FCL text.
+    
+    Args:
+        text: FCL file contents
+        
+    Returns:
+        Dictionary of key to parsed value, ordered by the last occurrence of
+        each key; a key assigned several times keeps its last value
+    """
+    return {key: _parse_value(value) for key, value in _fcl_assignments(text).items()}
+
+@lru_cache(maxsize=4096)
+def _parse_fcl_cached(fcl_path: str, mtime_ns: int, size: int) -> Dict[str, str]:
+    """Read the raw assignments of a FCL file; cached on the file path, modification time and size."""
+    with open(fcl_path, 'r') as f:
+        return _fcl_assignments(f.read())
+
+def _fcl_raw(fcl_path: str) -> Dict[str, str]:
+    """Return the cached raw assignments of a FCL file."""
+    fcl_path = os.path.abspath(fcl_path)
+    st = os.stat(fcl_path)
+    return _parse_fcl_cached(fcl_path, st.st_mtime_ns, st.st_size)
+
+def parse_fcl(fcl_path: str) -> Dict[str, Any]:
+    """Read a FCL file and return its key: value assignments (see parse_fcl_text).
+    
+    Repeated calls for an unchanged file do not re-read it.
+    
+    Args:
+        fcl_path: Path to the FCL file
+        
+    Returns:
+        Dictionary of key to parsed value
+    """
+    return {key: _parse_value(value) for key, value in _fcl_raw(fcl_path).items()}
+
+def _last_value(assignments: Dict[str, str], key: str, default: Any) -> Any:
+    """Parse the last assigned value of any key equal to or ending in '.key'."""
+    suffix = '.' + key
+    for name in reversed(assignments):
+        if name == key or name.endswith(suffix):
+            return _parse_value(assignments[name])
+    return default
+
 def parse_fcl_to_params(fcl_path: str) -> 'fclParams':
     """Read a FCL file and reconstruct an fclParams object."""
-    with open(fcl_path, 'r') as f:
-        text = f.read()
-
-    # Per-plane thresholds appear multiple times; take the last occurrence of each
-    rt0 = get_all_values('HitFinderToolVec.CandidateHitsPlane0.RoiThreshold', text)
-    rt1 = get_all_values('HitFinderToolVec.CandidateHitsPlane1.RoiThreshold', text)
-    rt2 = get_all_values('HitFinderToolVec.CandidateHitsPlane2.RoiThreshold', text)
-
-    mph = get_all_values('HitFilterAlg.MinPulseHeight', text)
-    mps = get_all_values('HitFilterAlg.MinPulseSigma', text)
-    lmh = get_all_values('LongMaxHits', text)
-    lpw = get_all_values('LongPulseWidth', text)
-    phc = get_all_values('PulseHeightCuts', text)
-    pwc = get_all_values('PulseWidthCuts', text)
-    prc = get_all_values('PulseRatioCuts', text)
-    mmh = get_all_values('MaxMultiHit', text)
-    chi = get_all_values('Chi2NDF', text)
+    assignments = _fcl_raw(fcl_path)
 
+    # Per-plane thresholds appear once per TPC; take the last occurrence of each
     roiThreshold = _ensure_list3([
-        (rt0[-1] if rt0 else 5.0),
-        (rt1[-1] if rt1 else 5.0),
-        (rt2[-1] if rt2 else 5.0),
+        _last_value(assignments, 'HitFinderToolVec.CandidateHitsPlane0.RoiThreshold', 5.0),
+        _last_value(assignments, 'HitFinderToolVec.CandidateHitsPlane1.RoiThreshold', 5.0),
+        _last_value(assignments, 'HitFinderToolVec.CandidateHitsPlane2.RoiThreshold', 5.0),
     ])
 
-    minPulseHeight = _ensure_list3(mph[-1] if mph else 2.0)
-    minPulseSigma  = _ensure_list3(mps[-1] if mps else 1.0)
-    LongMaxHits    = _ensure_list3(lmh[-1] if lmh else 1)
-    LongPulseWidth = _ensure_list3(lpw[-1] if lpw else 10.0)
-    PulseHeightCuts= _ensure_list3(phc[-1] if phc else 3)
-    PulseWidthCuts = _ensure_list3(pwc[-1] if pwc else 2)
-    PulseRatioCuts = _ensure_list3(prc[-1] if prc else 0.35)
-    MaxMultiHit    = mmh[-1] if mmh else 5
-    Chi2NDF        = chi[-1] if chi else 500.0
-
     return fclParams(
         roiThreshold=roiThreshold,
-        minPulseHeight=minPulseHeight,
-        minPulseSigma=minPulseSigma,
-        LongMaxHits=LongMaxHits,
-        LongPulseWidth=LongPulseWidth,
-        PulseHeightCuts=PulseHeightCuts,
-        PulseWidthCuts=PulseWidthCuts,
-        PulseRatioCuts=PulseRatioCuts,
-        MaxMultiHit=MaxMultiHit,
-        Chi2NDF=Chi2NDF,
+        minPulseHeight=_ensure_list3(_last_value(assignments, 'HitFilterAlg.MinPulseHeight', 2.0)),
+        minPulseSigma=_ensure_list3(_last_value(assignments, 'HitFilterAlg.MinPulseSigma', 1.0)),
+        LongMaxHits=_ensure_list3(_last_value(assignments, 'LongMaxHits', 1)),
+        LongPulseWidth=_ensure_list3(_last_value(assignments, 'LongPulseWidth', 10.0)),
+        PulseHeightCuts=_ensure_list3(_last_value(assignments, 'PulseHeightCuts', 3)),
+        PulseWidthCuts=_ensure_list3(_last_value(assignments, 'PulseWidthCuts', 2)),
+        PulseRatioCuts=_ensure_list3(_last_value(assignments, 'PulseRatioCuts', 0.35)),
+        MaxMultiHit=_last_value(assignments, 'MaxMultiHit', 5),
+        Chi2NDF=_last_value(assignments, 'Chi2NDF', 500.0),
     )
 
+def _fclJobNum(fcl_path: str) -> Optional[int]:
+    """Return the grid index encoded in a generated FCL name like hitTuning_<tag>_<index>.fcl."""
+    match = re.search(r'_(\d+)\.fcl$', fcl_path)
+    return int(match.group(1)) if match else None
+
+def _ingestWorker(fcl_path: str) -> Tuple[str, 'fclParams']:
+    """Parse one FCL file in an ingest worker process."""
+    return fcl_path, parse_fcl_to_params(fcl_path)
+
+def ingest_fcl_dir(db: 'HitTuningDB', fclDir: str, jobs: Optional[int] = None) -> int:
+    """Parse all generated FCL files of a directory in parallel and add them as runs.
+    
+    The job number of each run is taken from the grid index in the file name.
+    Files that are already recorded in the database are skipped, and the new
+    runs are inserted in a single transaction.
+    
+    Args:
+        db: Database to add the runs to
+        fclDir: Directory of FCL files written by --createGrid
+        jobs: Number of parser processes (default: number of CPUs)
+        
+    Returns:
+        Number of runs added
+    """
+    start = time.time()
+    fclFiles = sorted(os.path.join(fclDir, f) for f in os.listdir(fclDir)
+                      if f.endswith('.fcl') and _fclJobNum(f) is not None)
+
+    db.flush()
+    cursor = db.conn.cursor()
+    cursor.execute('SELECT fcl_filename FROM runs')
+    known = {row[0] for row in cursor.fetchall()}
+    fclFiles = [f for f in fclFiles if f not in known]
+    if not fclFiles:
+        print(f"No new FCL files to ingest in {fclDir}")
+        return 0
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(fclFiles) > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            parsed = pool.map(_ingestWorker, fclFiles, chunksize=max(1, len(fclFiles) // (4 * jobs)))
+    else:
+        parsed = [_ingestWorker(f) for f in fclFiles]
+
+    db.add_runs([dict(params=params, jobNum=_fclJobNum(path), fcl_filename=path) for path, params in parsed])
+    db.flush()
+
+    elapsed = time.time() - start
+    print(f"Ingested {len(parsed)} FCL files from {fclDir} in {elapsed:.1f} s "
+          f"({len(parsed) / max(elapsed, 1e-9):.0f} files/s)")
+    return len(parsed)
+
+# Quantiles stored for each histogram in the hist_summary table, and their columns
+HIST_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+HIST_QUANTILE_COLUMNS = [f'q{int(round(100 * q)):02d}' for q in HIST_QUANTILES]
+HIST_SUMMARY_COLUMNS = ['entries', 'sum_weights', 'mean', 'rms'] + HIST_QUANTILE_COLUMNS + ['underflow', 'overflow']
+
+# Result columns in the order of the galleryMC results matrix
+RESULT_COLUMNS = [f'ratio_{particle}{plane}' for particle in ['total', 'ele', 'gamma', 'mu', 'p', 'pi']
+                  for plane in ['', '0', '1', '2']]
+
+# Note recorded with runs of a packed lar job, whose gallery pass writes less than galleryMC
+PACKED_NOTE = 'packed: energy histograms only, no hit-truth dump'
+
+# SET clause giving an updated run the next revision, see HitTuningDB.export_columnar
+_NEXT_REVISION = 'revision = (SELECT IFNULL(MAX(revision), 0) + 1 FROM runs)'
+
 class HitTuningDB:
     """Database manager for hit tuning parameter scans and results."""
     
-    def __init__(self, db_path: str = "hitTuning.db") -> None:
+    def __init__(self, db_path: str = "hitTuning.db", buffered: bool = False, wal: bool = False,
+                 batch_size: int = 1000, timeout: float = 60.0) -> None:
         """Initialize database connection and create tables if needed.
         
+        By default every mutator commits immediately. In buffered mode, updates
+        are queued and written with executemany, and all writes are committed
+        together once batch_size operations are pending, on flush() or on close().
+        
         Args:
             db_path: Path to SQLite database file
+            buffered: Batch writes into transactions instead of committing each one
+            wal: Use write-ahead logging so several local processes can share the database
+            batch_size: Number of pending write operations that triggers a commit in buffered mode
+            timeout: Seconds to wait for a lock held by another connection
         """
         self.db_path: str = db_path
-        self.conn: sqlite3.Connection = sqlite3.connect(db_path)
+        self.buffered: bool = buffered
+        self.batch_size: int = batch_size
+        self.conn: sqlite3.Connection = sqlite3.connect(db_path, timeout=timeout)
+        if wal:
+            # WAL needs shared memory, so only use it for databases on local disk
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._pending: List[Tuple[str, Tuple]] = []
+        self._nPending: int = 0
         self.create_tables()
+
+    def __enter__(self) -> 'HitTuningDB':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _write(self, sql: str, params: Tuple) -> None:
+        """Execute a write statement, or queue it in buffered mode."""
+        if self.buffered:
+            self._pending.append((sql, params))
+            self._nPending += 1
+            if self._nPending >= self.batch_size:
+                self.flush()
+        else:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def _commit(self, nOperations: int) -> None:
+        """Commit after an immediate write, or count it towards the batch in buffered mode."""
+        if self.buffered:
+            self._nPending += nOperations
+            if self._nPending >= self.batch_size:
+                self.flush()
+        else:
+            self.conn.commit()
+
+    def flush(self) -> None:
+        """Write all queued statements in call order and commit the current transaction."""
+        if not self.buffered:
+            return
+        cursor = self.conn.cursor()
+        # Only consecutive statements share an executemany, so an update never runs before its insert
+        for sql, group in groupby(self._pending, key=lambda statement: statement[0]):
+            cursor.executemany(sql, [params for _, params in group])
+        self._pending = []
+        self._nPending = 0
+        self.conn.commit()
     
     def create_tables(self) -> None:
         """Create database tables for storing run parameters and results."""
@@ -243,15 +414,129 @@ class HitTuningDB:
                 ratio_pi REAL,
                 ratio_pi0 REAL,
                 ratio_pi1 REAL,
-                ratio_pi2 REAL
+                ratio_pi2 REAL,
+                cache_key TEXT,
+                nEvents INTEGER,
+                dump_filename TEXT,
+                wall_time REAL,
+                cpu_time REAL,
+                max_rss_mb REAL,
+                revision INTEGER
+            )
+        ''')
+
+        # Databases created before a column was added are migrated in place
+        self._add_missing_columns('runs', {'cache_key': 'TEXT', 'nEvents': 'INTEGER', 'dump_filename': 'TEXT',
+                                           'wall_time': 'REAL', 'cpu_time': 'REAL', 'max_rss_mb': 'REAL',
+                                           'revision': 'INTEGER'})
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_runs_cache_key ON runs (cache_key)')
+        # Every update of a run takes the next revision, so exports can find the rows changed since
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_runs_revision ON runs (revision)')
+
+        # Journal of the processing state of each locally run parameter set
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS manifest (
+                run_id INTEGER PRIMARY KEY,
+                tag TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                params TEXT NOT NULL,
+                options TEXT,
+                fcl_filename TEXT NOT NULL,
+                output_filename TEXT NOT NULL,
+                hist_filename TEXT NOT NULL,
+                dump_filename TEXT,
+                hits_only INTEGER,
+                selection TEXT,
+                event_ids TEXT,
+                results TEXT,
+                error TEXT,
+                updated TEXT NOT NULL,
+                UNIQUE (tag, version)
+            )
+        ''')
+        self._add_missing_columns('manifest', {'dump_filename': 'TEXT', 'hits_only': 'INTEGER',
+                                               'selection': 'TEXT', 'event_ids': 'TEXT'})
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_manifest_tag_state ON manifest (tag, state)')
+
+        # Event pre-selection index: truth content of every event of the indexed input files
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS event_index_files (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                n_events INTEGER,
+                indexed TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS event_selection (
+                path TEXT NOT NULL,
+                run INTEGER NOT NULL,
+                subrun INTEGER NOT NULL,
+                event INTEGER NOT NULL,
+                e_total REAL,
+                e_ele REAL,
+                e_gamma REAL,
+                e_mu REAL,
+                e_p REAL,
+                e_pi REAL,
+                PRIMARY KEY (path, run, subrun, event)
+            )
+        ''')
+
+        # Per-module lar costs from art's TimeTracker and MemoryTracker
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS module_costs (
+                run_id INTEGER NOT NULL,
+                module_label TEXT NOT NULL,
+                module_type TEXT,
+                n_events INTEGER,
+                total_time REAL,
+                mean_time REAL,
+                max_time REAL,
+                peak_rss_mb REAL,
+                PRIMARY KEY (run_id, module_label)
             )
         ''')
+
+        # Summary statistics of every 1D histogram in the histogram file of each run
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS hist_summary (
+                run_id INTEGER NOT NULL,
+                hist_name TEXT NOT NULL,
+                entries REAL,
+                sum_weights REAL,
+                mean REAL,
+                rms REAL,
+                {", ".join(f"{column} REAL" for column in HIST_QUANTILE_COLUMNS)},
+                underflow REAL,
+                overflow REAL,
+                PRIMARY KEY (run_id, hist_name)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_hist_summary_name ON hist_summary (hist_name)')
         
         self.conn.commit()
+
+    def _add_missing_columns(self, table: str, columns: Dict[str, str]) -> None:
+        """Add columns that are missing from an existing table.
+        
+        Args:
+            table: Table name
+            columns: Mapping of column name to SQL type
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f"PRAGMA table_info('{table}')")
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, sqlType in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {sqlType}')
     
     def add_run(self, params: fclParams, jobNum: int, fcl_filename: str, 
                 output_filename: Optional[str] = None, hist_filename: Optional[str] = None, 
-                notes: Optional[str] = None) -> int:
+                notes: Optional[str] = None, cache_key: Optional[str] = None,
+                nEvents: Optional[int] = None) -> int:
         """Add a new run to the database.
         
         Args:
@@ -261,15 +546,38 @@ class HitTuningDB:
             output_filename: Path to output ROOT file (optional)
             hist_filename: Path to histogram ROOT file (optional)
             notes: Additional notes about this run (optional)
+            cache_key: Run cache key from runCacheKey (optional)
+            nEvents: Number of events lar was asked to process, -1 for all (optional)
             
         Returns:
             Database ID of the inserted run
         """
         cursor = self.conn.cursor()
+        cursor.execute(self._INSERT_RUN_SQL, self._run_row(params, jobNum, fcl_filename, output_filename,
+                                                           hist_filename, notes, cache_key, nEvents))
+        self._commit(1)
+        return cursor.lastrowid
+
+    def add_runs(self, runs: List[Dict[str, Any]]) -> List[int]:
+        """Add many runs to the database in a single transaction.
         
-        timestamp = datetime.now().isoformat()
-        
-        cursor.execute('''
+        Args:
+            runs: One dictionary of add_run keyword arguments per run
+            
+        Returns:
+            Database IDs of the inserted runs, in input order
+        """
+        if not runs:
+            return []
+        cursor = self.conn.cursor()
+        cursor.executemany(self._INSERT_RUN_SQL, [self._run_row(**run) for run in runs])
+        # Rows inserted by one statement inside one write transaction get consecutive IDs
+        cursor.execute('SELECT last_insert_rowid()')
+        last_id = cursor.fetchone()[0]
+        self._commit(len(runs))
+        return list(range(last_id - len(runs) + 1, last_id + 1))
+
+    _INSERT_RUN_SQL = '''
             INSERT INTO runs (
                 jobNum, timestamp, fcl_filename, output_filename, hist_filename,
                 roiThreshold_0, roiThreshold_1, roiThreshold_2,
@@ -286,10 +594,19 @@ class HitTuningDB:
                 ratio_gamma, ratio_gamma0, ratio_gamma1, ratio_gamma2, 
                 ratio_mu, ratio_mu0, ratio_mu1, ratio_mu2, 
                 ratio_p, ratio_p0, ratio_p1, ratio_p2, 
-                ratio_pi, ratio_pi0, ratio_pi1, ratio_pi2
+                ratio_pi, ratio_pi0, ratio_pi1, ratio_pi2, cache_key, nEvents
             ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
-            ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+            ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        '''
+
+    @staticmethod
+    def _run_row(params: fclParams, jobNum: int, fcl_filename: str,
+                 output_filename: Optional[str] = None, hist_filename: Optional[str] = None,
+                 notes: Optional[str] = None, cache_key: Optional[str] = None,
+                 nEvents: Optional[int] = None) -> Tuple:
+        """Build the parameter tuple for _INSERT_RUN_SQL."""
+        timestamp = datetime.now().isoformat()
+        return (
             jobNum, timestamp, fcl_filename, output_filename, hist_filename,
             params.roiThreshold[0], params.roiThreshold[1], params.roiThreshold[2],
             params.minPulseHeight[0], params.minPulseHeight[1], params.minPulseHeight[2],
@@ -300,11 +617,19 @@ class HitTuningDB:
             params.PulseWidthCuts[0], params.PulseWidthCuts[1], params.PulseWidthCuts[2],
             params.PulseRatioCuts[0], params.PulseRatioCuts[1], params.PulseRatioCuts[2],
             params.MaxMultiHit, params.Chi2NDF, notes, -1, -1, -1, -1, -1, -1, -1, -1, -1, 
-            -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1
-        ))
+            -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, -1, cache_key, nEvents
+        )
+
+    def count_runs(self) -> int:
+        """Return the number of runs in the database.
         
-        self.conn.commit()
-        return cursor.lastrowid
+        Returns:
+            Number of rows in the runs table
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM runs')
+        return cursor.fetchone()[0]
     
     def get_run(self, run_id: int) -> Optional[Tuple]:
         """Retrieve a single run by ID.
@@ -315,6 +640,7 @@ class HitTuningDB:
         Returns:
             Tuple containing run data, or None if not found
         """
+        self.flush()
         cursor = self.conn.cursor()
         cursor.execute('SELECT * FROM runs WHERE id = ?', (run_id,))
         return cursor.fetchone()
@@ -325,6 +651,7 @@ class HitTuningDB:
         Returns:
             List of tuples containing run data
         """
+        self.flush()
         cursor = self.conn.cursor()
         cursor.execute('SELECT * FROM runs ORDER BY timestamp DESC')
         return cursor.fetchall()
@@ -338,17 +665,138 @@ class HitTuningDB:
         Returns:
             List of tuples containing matching run data
         """
+        return self.query_runs(filters=[(key, '=', value) for key, value in kwargs.items()],
+                               create_indexes=False)
+
+    _QUERY_OPERATORS = {'=': '=', '==': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>=',
+                        'in': 'IN', 'not in': 'NOT IN', 'between': 'BETWEEN'}
+
+    def get_columns(self, table: str = 'runs') -> List[str]:
+        """Return the column names of a table.
+        
+        Args:
+            table: Table name
+            
+        Returns:
+            Column names in table order
+        """
         cursor = self.conn.cursor()
+        cursor.execute(f"PRAGMA table_info('{table}')")
+        return [row[1] for row in cursor.fetchall()]
+
+    def _check_columns(self, columns: List[str]) -> None:
+        """Raise ValueError for names that are not columns of the runs table."""
+        known = set(self.get_columns())
+        unknown = [c for c in columns if c not in known]
+        if unknown:
+            raise ValueError(f"Unknown runs column(s): {', '.join(unknown)}")
+
+    def ensure_index(self, columns: List[str]) -> bool:
+        """Create an index on the runs table over the given columns if it does not exist.
         
-        query = 'SELECT * FROM runs WHERE 1=1'
-        params = []
+        Args:
+            columns: Indexed columns, in index order
+            
+        Returns:
+            True if a new index was created
+        """
+        self._check_columns(columns)
+        name = 'idx_runs_' + '_'.join(columns)
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name=?", (name,))
+        if cursor.fetchone() is not None:
+            return False
+        print(f"Creating index {name}")
+        cursor.execute(f'CREATE INDEX {name} ON runs ({", ".join(columns)})')
+        self.conn.commit()
+        return True
+
+    def query_runs(self, filters: Optional[List[Tuple[str, str, Any]]] = None, order_by: Optional[str] = None,
+                   descending: bool = True, limit: Optional[int] = None, columns: Optional[List[str]] = None,
+                   create_indexes: bool = True) -> List[Tuple]:
+        """Query runs with range/IN predicates, ordering and top-k pushed down into SQLite.
         
-        for key, value in kwargs.items():
-            query += f' AND {key} = ?'
-            params.append(value)
+        Example: the 10 best ratio_ele2 with roiThreshold_2 <= 3 and Chi2NDF >= 1500:
+            db.query_runs([('roiThreshold_2', '<=', 3), ('Chi2NDF', '>=', 1500)],
+                          order_by='ratio_ele2', limit=10)
         
+        Args:
+            filters: List of (column, operator, value) predicates combined with AND. Operators are
+                     =, !=, <, <=, >, >=, in, not in (value is a list) and between (value is a pair)
+            order_by: Column to sort by
+            descending: Sort in descending order
+            limit: Maximum number of rows to return
+            columns: Columns to return (default: all)
+            create_indexes: Create indexes on the filtered and ordered columns if they are missing
+            
+        Returns:
+            List of tuples containing matching run data
+        """
+        self.flush()
+        filters = filters or []
+        self._check_columns([f[0] for f in filters] + ([order_by] if order_by else []) + (columns or []))
+
+        clauses = []
+        params = []
+        for column, op, value in filters:
+            sqlOp = self._QUERY_OPERATORS.get(op.lower())
+            if sqlOp is None:
+                raise ValueError(f"Unsupported operator '{op}'")
+            if sqlOp in ('IN', 'NOT IN'):
+                value = list(value)
+                clauses.append(f"{column} {sqlOp} ({', '.join('?' * len(value))})")
+                params.extend(value)
+            elif sqlOp == 'BETWEEN':
+                clauses.append(f"{column} BETWEEN ? AND ?")
+                params.extend(value)
+            else:
+                clauses.append(f"{column} {sqlOp} ?")
+                params.append(value)
+
+        if create_indexes:
+            created = False
+            filterColumns = list(dict.fromkeys(f[0] for f in filters))
+            for column in filterColumns:
+                if column != order_by:
+                    created |= self.ensure_index([column])
+            if order_by:
+                # Ordered scan that can evaluate the filters and stop after `limit` rows without table lookups
+                created |= self.ensure_index([order_by] + [c for c in filterColumns if c != order_by])
+            if created:
+                self.conn.execute('ANALYZE')
+                self.conn.commit()
+
+        query = f"SELECT {', '.join(columns) if columns else '*'} FROM runs"
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        if order_by:
+            query += f" ORDER BY {order_by} {'DESC' if descending else 'ASC'}"
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(int(limit))
+
+        cursor = self.conn.cursor()
         cursor.execute(query, params)
         return cursor.fetchall()
+
+    def top_runs(self, objective: str = 'ratio_total', k: int = 10,
+                 filters: Optional[List[Tuple[str, str, Any]]] = None, descending: bool = True,
+                 columns: Optional[List[str]] = None) -> List[Tuple]:
+        """Return the k best runs by a result column, ignoring runs without results.
+        
+        Args:
+            objective: Result column to rank by, e.g. 'ratio_ele2'
+            k: Number of runs to return
+            filters: Additional predicates as for query_runs
+            descending: Rank larger values first
+            columns: Columns to return (default: all)
+            
+        Returns:
+            List of tuples containing the best runs
+        """
+        filters = list(filters or []) + [(objective, '!=', -1)]
+        return self.query_runs(filters=filters, order_by=objective, descending=descending,
+                               limit=k, columns=columns)
     
     def update_output_filename(self, run_id: int, output_filename: str) -> None:
         """Update the output filename for a run.
@@ -357,11 +805,85 @@ class HitTuningDB:
             run_id: Database ID of the run
             output_filename: Path to output ROOT file
         """
-        cursor = self.conn.cursor()
-        cursor.execute('UPDATE runs SET output_filename = ? WHERE id = ?', 
-                      (output_filename, run_id))
-        self.conn.commit()
+        self._write(f'UPDATE runs SET output_filename = ?, {_NEXT_REVISION} WHERE id = ?', 
+                    (output_filename, run_id))
     
+    def update_notes(self, run_id: int, notes: str) -> None:
+        """Replace the notes of a run.
+        
+        Args:
+            run_id: Database ID of the run
+            notes: New notes
+        """
+        self._write(f'UPDATE runs SET notes = ?, {_NEXT_REVISION} WHERE id = ?', (notes, run_id))
+
+    def update_costs(self, run_id: int, costs: Dict[str, Any]) -> None:
+        """Record the resource usage of the lar job of a run.
+        
+        Args:
+            run_id: Database ID of the run
+            costs: Costs measured by run(): wall_time and cpu_time in seconds,
+                   max_rss_mb, and optionally per-module costs under 'modules'
+                   (see parseTrackerDBs)
+        """
+        self._write(f'UPDATE runs SET wall_time = ?, cpu_time = ?, max_rss_mb = ?, {_NEXT_REVISION} WHERE id = ?',
+                    (costs.get('wall_time'), costs.get('cpu_time'), costs.get('max_rss_mb'), run_id))
+        for label, module in costs.get('modules', {}).items():
+            self._write('''INSERT OR REPLACE INTO module_costs (run_id, module_label, module_type, n_events,
+                                                               total_time, mean_time, max_time, peak_rss_mb)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                        (run_id, label, module.get('module_type'), module.get('n_events'),
+                         module.get('total_time'), module.get('mean_time'), module.get('max_time'),
+                         module.get('peak_rss_mb')))
+
+    def get_module_costs(self, run_id: int) -> List[Tuple]:
+        """Return the per-module costs of a run, most expensive module first.
+        
+        Args:
+            run_id: Database ID of the run
+            
+        Returns:
+            List of (module_label, module_type, n_events, total_time, mean_time, max_time, peak_rss_mb)
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute('''SELECT module_label, module_type, n_events, total_time, mean_time, max_time, peak_rss_mb
+                          FROM module_costs WHERE run_id = ? ORDER BY total_time DESC''', (run_id,))
+        return cursor.fetchall()
+
+    def update_hist_summary(self, run_id: int, summaries: Dict[str, Dict[str, Optional[float]]]) -> None:
+        """Record the summary statistics of the histograms of a run, replacing earlier ones.
+        
+        Args:
+            run_id: Database ID of the run
+            summaries: Statistics (HIST_SUMMARY_COLUMNS) of each histogram, keyed by
+                       histogram path in the file (see summarizeHistograms)
+        """
+        sql = (f'INSERT OR REPLACE INTO hist_summary (run_id, hist_name, {", ".join(HIST_SUMMARY_COLUMNS)}) '
+               f'VALUES ({", ".join("?" * (len(HIST_SUMMARY_COLUMNS) + 2))})')
+        for name, stats in summaries.items():
+            self._write(sql, (run_id, name) + tuple(stats.get(column) for column in HIST_SUMMARY_COLUMNS))
+
+    def get_hist_summary(self, run_id: int, hist_name: Optional[str] = None) -> List[Tuple]:
+        """Return the histogram summary statistics of a run.
+        
+        Args:
+            run_id: Database ID of the run
+            hist_name: Only return this histogram (default: all)
+            
+        Returns:
+            List of (hist_name, *HIST_SUMMARY_COLUMNS), ordered by histogram name
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        query = f'SELECT hist_name, {", ".join(HIST_SUMMARY_COLUMNS)} FROM hist_summary WHERE run_id = ?'
+        params: List[Any] = [run_id]
+        if hist_name is not None:
+            query += ' AND hist_name = ?'
+            params.append(hist_name)
+        cursor.execute(query + ' ORDER BY hist_name', params)
+        return cursor.fetchall()
+
     def update_hist_filename(self, run_id: int, hist_filename: str) -> None:
         """Update the histogram filename for a run.
         
@@ -369,10 +891,18 @@ class HitTuningDB:
             run_id: Database ID of the run
             hist_filename: Path to histogram ROOT file
         """
-        cursor = self.conn.cursor()
-        cursor.execute('UPDATE runs SET hist_filename = ? WHERE id = ?', 
-                      (hist_filename, run_id))
-        self.conn.commit()
+        self._write(f'UPDATE runs SET hist_filename = ?, {_NEXT_REVISION} WHERE id = ?', 
+                    (hist_filename, run_id))
+
+    def update_dump_filename(self, run_id: int, dump_filename: str) -> None:
+        """Update the hit-truth dump filename for a run.
+        
+        Args:
+            run_id: Database ID of the run
+            dump_filename: Path to the hitTruth/ideTruth ROOT file written by galleryMC
+        """
+        self._write(f'UPDATE runs SET dump_filename = ?, {_NEXT_REVISION} WHERE id = ?',
+                    (dump_filename, run_id))
     
     def update_results(self, run_id: int, results: List[List[float]]) -> None:
         """Update the run with results from galleryMC.
@@ -383,8 +913,8 @@ class HitTuningDB:
                     Format: [[ratio_total, ...], [ratio_ele, ...], [ratio_gamma, ...], 
                             [ratio_mu, ...], [ratio_p, ...], [ratio_pi, ...]]
         """
-        cursor = self.conn.cursor()
-        cursor.execute('''UPDATE runs SET 
+        self._write(f'''UPDATE runs SET 
+                            {_NEXT_REVISION},
                             ratio_total = ?, 
                             ratio_total0 = ?,
                             ratio_total1 = ?,
@@ -417,25 +947,444 @@ class HitTuningDB:
                         float(results[4][0]), float(results[4][1]), float(results[4][2]), float(results[4][3]),
                         float(results[5][0]), float(results[5][1]), float(results[5][2]), float(results[5][3]),
                         run_id))
-        self.conn.commit()
     
+    # Processing states of a manifest entry, in order
+    MANIFEST_STATES = ['registered', 'generated', 'lar_done', 'gallery_done', 'stored']
+
+    def add_manifest_entry(self, run_id: int, tag: str, version: int, params: fclParams,
+                           options: Optional[str], fcl_filename: str, output_filename: str,
+                           hist_filename: str, dump_filename: Optional[str] = None, hits_only: bool = False,
+                           selection: Optional[str] = None,
+                           event_ids: Optional[List[Tuple[int, int, int]]] = None) -> None:
+        """Record a newly registered parameter set in the run manifest.
+        
+        Args:
+            run_id: Database ID of the run
+            tag: Tag of the output files
+            version: Version number in the output file names
+            params: FCL parameters of the run
+            options: lar options of the run
+            fcl_filename: Path of the FCL file
+            output_filename: Path of the lar output ROOT file
+            hist_filename: Path of the histogram ROOT file
+            dump_filename: Path of the hit-truth dump ROOT file (optional)
+            hits_only: Whether the run does hit finding only, on the ROI cache of its event range
+            selection: Event selection expression of the run (None for all events)
+            event_ids: (run, subrun, event) IDs selected by the expression
+        """
+        self._write('''INSERT INTO manifest (run_id, tag, version, state, params, options, fcl_filename,
+                                             output_filename, hist_filename, dump_filename, hits_only, selection,
+                                             event_ids, updated)
+                       VALUES (?, ?, ?, 'registered', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (run_id, tag, version, json.dumps(vars(params)), options, fcl_filename,
+                     output_filename, hist_filename, dump_filename, int(hits_only), selection,
+                     json.dumps(event_ids) if event_ids is not None else None, datetime.now().isoformat()))
+
+    def set_manifest_state(self, run_id: int, state: str, results: Optional[List[List[float]]] = None,
+                           error: Optional[str] = None) -> None:
+        """Move a manifest entry to a state.
+        
+        Args:
+            run_id: Database ID of the run
+            state: One of MANIFEST_STATES
+            results: Ratio results to keep until they are stored in the runs table
+            error: Error of the last failed stage, cleared otherwise
+        """
+        if state not in self.MANIFEST_STATES:
+            raise ValueError(f"Unknown manifest state '{state}'")
+        self._write('''UPDATE manifest SET state = ?, results = COALESCE(?, results), error = ?, updated = ?
+                       WHERE run_id = ?''',
+                    (state, json.dumps(results) if results is not None else None, error,
+                     datetime.now().isoformat(), run_id))
+
+    def next_manifest_version(self, tag: str) -> Optional[int]:
+        """Return the next free output file version of a tag, or None if the tag has no manifest entries."""
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT MAX(version) FROM manifest WHERE tag = ?', (tag,))
+        version = cursor.fetchone()[0]
+        return None if version is None else version + 1
+
+    def get_unfinished_manifest(self, tag: str) -> List[Dict[str, Any]]:
+        """Return the manifest entries of a tag whose results have not been stored yet.
+        
+        Args:
+            tag: Tag of the output files
+            
+        Returns:
+            One dictionary of manifest columns per entry, in version order
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT * FROM manifest WHERE tag = ? AND state != 'stored' ORDER BY version", (tag,))
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def find_cached_run(self, cache_key: str) -> Optional[Tuple[int, List[List[float]]]]:
+        """Look up a completed run with the given cache key.
+        
+        A run is complete once its histogram file has been recorded, which
+        happens after the gallery analysis has finished.
+        
+        Args:
+            cache_key: Run cache key from runCacheKey
+            
+        Returns:
+            Tuple of (run ID, results in update_results format), or None on a cache miss
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute(f'''SELECT id, {', '.join(RESULT_COLUMNS)} FROM runs
+                          WHERE cache_key = ? AND hist_filename IS NOT NULL
+                          ORDER BY id DESC LIMIT 1''', (cache_key,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        ratios = list(row[1:])
+        return row[0], [ratios[i:i + 4] for i in range(0, len(ratios), 4)]
+
+    def event_index_current(self, path: str, size: int, mtime: int) -> bool:
+        """Return whether the event pre-selection index of an input file is up to date.
+        
+        Args:
+            path: Absolute path of the input ROOT file
+            size: Current size of the file in bytes
+            mtime: Current modification time of the file in nanoseconds
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT 1 FROM event_index_files WHERE path = ? AND size = ? AND mtime = ?',
+                       (path, size, mtime))
+        return cursor.fetchone() is not None
+
+    def set_event_index(self, path: str, size: int, mtime: int, rows: List[List[float]]) -> None:
+        """Replace the event pre-selection index of an input file.
+        
+        Args:
+            path: Absolute path of the input ROOT file
+            size: Size of the indexed file in bytes
+            mtime: Modification time of the indexed file in nanoseconds
+            rows: One [run, subrun, event, total, ele, gamma, mu, p, pi] row per event,
+                  as returned by eventTruthSummary
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM event_selection WHERE path = ?', (path,))
+        cursor.executemany('''INSERT OR REPLACE INTO event_selection (path, run, subrun, event, e_total, e_ele,
+                                                                       e_gamma, e_mu, e_p, e_pi)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                           [(path, int(row[0]), int(row[1]), int(row[2])) + tuple(row[3:9]) for row in rows])
+        cursor.execute('''INSERT OR REPLACE INTO event_index_files (path, size, mtime, n_events, indexed)
+                          VALUES (?, ?, ?, ?, ?)''', (path, size, mtime, len(rows), datetime.now().isoformat()))
+        self.conn.commit()
+
+    def select_events(self, paths: List[str], where: str, params: List[Any]) -> List[Tuple[int, int, int]]:
+        """Return the events of the given input files that pass a selection.
+        
+        Args:
+            paths: Absolute paths of the indexed input ROOT files
+            where: SQL condition on the event_selection columns, from compileSelection
+            params: Parameters of the condition
+            
+        Returns:
+            Sorted list of (run, subrun, event)
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        placeholders = ', '.join('?' for _ in paths)
+        cursor.execute(f'''SELECT DISTINCT run, subrun, event FROM event_selection
+                           WHERE path IN ({placeholders}) AND ({where}) ORDER BY run, subrun, event''',
+                       list(paths) + list(params))
+        return cursor.fetchall()
+
+    def evict_outputs(self, max_age_days: Optional[float] = None, max_bytes: Optional[float] = None,
+                      dry_run: bool = False) -> int:
+        """Delete lar output ROOT files of recorded runs, keeping their database rows.
+        
+        Files older than max_age_days are removed first; then the oldest
+        remaining files are removed until their total size fits in max_bytes.
+        
+        Args:
+            max_age_days: Remove output files last modified more than this many days ago
+            max_bytes: Total disk budget for the remaining output files
+            dry_run: Only report which files would be removed
+            
+        Returns:
+            Number of files removed
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT DISTINCT output_filename FROM runs WHERE output_filename IS NOT NULL')
+        files = []
+        for (path,) in cursor.fetchall():
+            if os.path.isfile(path):
+                st = os.stat(path)
+                files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+
+        evict = []
+        if max_age_days is not None:
+            cutoff = time.time() - max_age_days * 86400
+            evict = [f for f in files if f[0] < cutoff]
+            files = [f for f in files if f[0] >= cutoff]
+        if max_bytes is not None:
+            total = sum(f[1] for f in files)
+            while files and total > max_bytes:
+                oldest = files.pop(0)
+                evict.append(oldest)
+                total -= oldest[1]
+
+        freed = 0
+        for mtime, size, path in evict:
+            print(f"{'Would evict' if dry_run else 'Evicting'} {path} ({size / 1e6:.1f} MB)")
+            if not dry_run:
+                os.remove(path)
+            freed += size
+        print(f"{'Would free' if dry_run else 'Freed'} {freed / 1e9:.2f} GB from {len(evict)} output files")
+        return len(evict)
+
+    def export_columnar(self, path: str, fmt: str = 'numpy', batch_size: int = 100000) -> int:
+        """Export completed runs to a columnar store, appending only rows not exported yet.
+        
+        The store is a directory holding a metadata file and either one raw
+        binary file per numeric column (fmt='numpy', readable with np.memmap)
+        or one Parquet file per export (fmt='parquet', needs pyarrow). Only
+        runs with a histogram file are exported; runs that finish after an
+        export are picked up by the next one. Exported runs that were updated
+        since, e.g. by recomputeRatios(store=True), are rewritten in place in
+        a NumPy store and appended again to a Parquet store, where
+        load_columnar keeps the last copy of each run.
+        INTEGER columns are stored as int64 with NULL as -1, REAL columns as
+        float64 with NULL as NaN, and TEXT columns as one line per row.
+        
+        Args:
+            path: Output directory
+            fmt: 'numpy' or 'parquet'
+            batch_size: Number of rows read from the database at a time
+            
+        Returns:
+            Number of rows exported, including rewritten ones
+        """
+        import numpy as np
+        if fmt not in ('numpy', 'parquet'):
+            raise ValueError(f"Unknown columnar format '{fmt}'")
+        if fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute("PRAGMA table_info('runs')")
+        # The revision only tracks changes and is not exported
+        schema = [(row[1], row[2].upper()) for row in cursor.fetchall() if row[1] != 'revision']
+        selectColumns = ', '.join(name for name, _ in schema)
+
+        os.makedirs(path, exist_ok=True)
+        metaPath = os.path.join(path, 'meta.json')
+        if os.path.exists(metaPath):
+            with open(metaPath) as f:
+                meta = json.load(f)
+            if meta['format'] != fmt or [c[0] for c in meta['columns']] != [c[0] for c in schema]:
+                raise ValueError(f"{path} was exported with a different format or schema, use a new directory")
+        else:
+            meta = {'format': fmt, 'columns': schema, 'nRows': 0, 'lastId': 0, 'pending': [], 'parts': []}
+        # Stores written before revisions were tracked have seen none of them
+        meta.setdefault('revision', 0)
+
+        # Drop anything appended by an export that was interrupted before its metadata was written
+        if fmt == 'numpy':
+            for name, sqlType in schema:
+                colPath = os.path.join(path, f'{name}.txt' if sqlType == 'TEXT' else f'{name}.bin')
+                if not os.path.exists(colPath):
+                    continue
+                if sqlType != 'TEXT':
+                    os.truncate(colPath, min(os.path.getsize(colPath), 8 * meta['nRows']))
+                    continue
+                with open(colPath) as f:
+                    lines = f.readlines()
+                if len(lines) > meta['nRows']:
+                    with open(colPath, 'w') as f:
+                        f.writelines(lines[:meta['nRows']])
+
+        # Runs that were still incomplete at the last export, plus everything inserted since
+        cursor.execute('SELECT MAX(id), MAX(revision) FROM runs')
+        maxId, maxRevision = cursor.fetchone()
+        maxId, maxRevision = maxId or 0, maxRevision or 0
+        pending = meta['pending']
+        cursor.execute('CREATE TEMP TABLE IF NOT EXISTS export_pending (id INTEGER PRIMARY KEY)')
+        cursor.execute('DELETE FROM export_pending')
+        cursor.executemany('INSERT INTO export_pending VALUES (?)', [(i,) for i in pending])
+
+        # Exported runs updated since the last export
+        cursor.execute(f'''SELECT {selectColumns} FROM runs WHERE revision > ? AND revision <= ?
+                          AND hist_filename IS NOT NULL AND id <= ? AND id NOT IN (SELECT id FROM export_pending)
+                          ORDER BY id''', (meta['revision'], maxRevision, meta['lastId']))
+        changed = cursor.fetchall()
+        if changed and fmt == 'numpy':
+            self._rewrite_numpy_rows(np, path, schema, meta['nRows'], changed)
+        elif changed:
+            part = f'part-{len(meta["parts"]):05d}.parquet'
+            columns = self._to_columns(np, schema, changed)
+            pq.write_table(pa.table({name: values for (name, _), values in zip(schema, columns)}),
+                           os.path.join(path, part))
+            meta['parts'].append(part)
+
+        cursor.execute(f'''SELECT {selectColumns} FROM runs WHERE hist_filename IS NOT NULL
+                          AND ((id > ? AND id <= ?) OR id IN (SELECT id FROM export_pending))
+                          ORDER BY id''', (meta['lastId'], maxId))
+
+        nExported = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            columns = self._to_columns(np, schema, rows)
+            if fmt == 'numpy':
+                for (name, sqlType), values in zip(schema, columns):
+                    if sqlType == 'TEXT':
+                        with open(os.path.join(path, f'{name}.txt'), 'a') as f:
+                            f.writelines(f'{v}\n' for v in values)
+                    else:
+                        with open(os.path.join(path, f'{name}.bin'), 'ab') as f:
+                            values.tofile(f)
+            else:
+                part = f'part-{len(meta["parts"]):05d}.parquet'
+                pq.write_table(pa.table({name: values for (name, _), values in zip(schema, columns)}),
+                               os.path.join(path, part))
+                meta['parts'].append(part)
+            nExported += len(rows)
+
+        # Remember runs that may still be completed later
+        cursor.execute('''SELECT id FROM runs WHERE hist_filename IS NULL
+                          AND ((id > ? AND id <= ?) OR id IN (SELECT id FROM export_pending))''',
+                       (meta['lastId'], maxId))
+        meta['pending'] = [row[0] for row in cursor.fetchall()]
+        cursor.execute('DROP TABLE export_pending')
+        meta['lastId'] = maxId
+        meta['revision'] = maxRevision
+        meta['nRows'] += nExported
+        with open(metaPath + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(metaPath + '.tmp', metaPath)
+
+        print(f"Exported {nExported} runs and rewrote {len(changed)} updated runs in {path} "
+              f"({meta['nRows']} total, {len(meta['pending'])} incomplete)")
+        return nExported + len(changed)
+
+    def _rewrite_numpy_rows(self, np, path: str, schema: List[Tuple[str, str]], nRows: int,
+                            rows: List[Tuple]) -> None:
+        """Overwrite already exported runs of a NumPy columnar store with their current values.
+        
+        Rewriting is idempotent, so an export interrupted before its metadata
+        was written simply rewrites the same rows again next time.
+        """
+        exportedIds = np.fromfile(os.path.join(path, 'id.bin'), dtype=np.int64, count=nRows)
+        order = np.argsort(exportedIds)
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        positions = order[np.searchsorted(exportedIds, ids, sorter=order)]
+        for (name, sqlType), values in zip(schema, self._to_columns(np, schema, rows)):
+            colPath = os.path.join(path, f'{name}.txt' if sqlType == 'TEXT' else f'{name}.bin')
+            if sqlType != 'TEXT':
+                column = np.memmap(colPath, dtype=values.dtype, mode='r+', shape=(nRows,))
+                column[positions] = values
+                column.flush()
+                del column
+                continue
+            with open(colPath) as f:
+                lines = f.readlines()
+            for position, value in zip(positions, values):
+                lines[position] = f'{value}\n'
+            with open(colPath + '.tmp', 'w') as f:
+                f.writelines(lines)
+            os.replace(colPath + '.tmp', colPath)
+
+    @staticmethod
+    def _to_columns(np, schema: List[Tuple[str, str]], rows: List[Tuple]) -> List[Any]:
+        """Transpose database rows into typed column arrays for export_columnar."""
+        columns = []
+        for i, (name, sqlType) in enumerate(schema):
+            values = [row[i] for row in rows]
+            if sqlType == 'INTEGER':
+                columns.append(np.array([-1 if v is None else v for v in values], dtype=np.int64))
+            elif sqlType == 'REAL':
+                columns.append(np.array([np.nan if v is None else v for v in values], dtype=np.float64))
+            else:
+                columns.append(np.array(['' if v is None else str(v) for v in values], dtype=object))
+        return columns
+
+    @staticmethod
+    def load_columnar(path: str, columns: Optional[List[str]] = None, mmap: bool = True) -> Dict[str, Any]:
+        """Load columns written by export_columnar without reading the others.
+        
+        Args:
+            path: Directory written by export_columnar
+            columns: Columns to load (default: all)
+            mmap: Memory-map numeric columns of a NumPy export instead of reading them
+            
+        Returns:
+            Dictionary of column name to NumPy array, e.g. for pandas.DataFrame(...)
+        """
+        import numpy as np
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        types = dict((name, sqlType) for name, sqlType in meta['columns'])
+        columns = columns or list(types)
+        unknown = [c for c in columns if c not in types]
+        if unknown:
+            raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+
+        if meta['format'] == 'parquet':
+            import pyarrow.parquet as pq
+            if not meta['parts']:
+                return {name: np.array([]) for name in columns}
+            read = columns if 'id' in columns else columns + ['id']
+            table = pq.ParquetDataset([os.path.join(path, p) for p in meta['parts']]).read(columns=read)
+            # Runs updated after their export were appended again; keep their last copy
+            ids = table.column('id').to_numpy()
+            _, lastReversed = np.unique(ids[::-1], return_index=True)
+            keep = np.sort(len(ids) - 1 - lastReversed)
+            return {name: table.column(name).to_numpy()[keep] for name in columns}
+
+        data = {}
+        for name in columns:
+            if types[name] == 'TEXT':
+                with open(os.path.join(path, f'{name}.txt')) as f:
+                    data[name] = np.array(f.read().splitlines()[:meta['nRows']], dtype=object)
+                continue
+            dtype = np.int64 if types[name] == 'INTEGER' else np.float64
+            binPath = os.path.join(path, f'{name}.bin')
+            if meta['nRows'] == 0:
+                data[name] = np.array([], dtype=dtype)
+            elif mmap:
+                data[name] = np.memmap(binPath, dtype=dtype, mode='r', shape=(meta['nRows'],))
+            else:
+                data[name] = np.fromfile(binPath, dtype=dtype, count=meta['nRows'])
+        return data
+
     def close(self) -> None:
-        """Close the database connection."""
+        """Flush pending writes and close the database connection."""
+        self.flush()
         self.conn.close()
 
-def generateFCLMC(params: fclParams, outputFile: str = "hitTuningMC.fcl", verbose: bool = False) -> None:
-    """Generate FCL configuration file for Monte Carlo data processing.
-    
-    Args:
-        params: FCL parameters to use in configuration
-        outputFile: Path to output FCL file
-        verbose: Whether to print parameters to console
-    """
-    if verbose:
-        print("Generating new FHICL file for MC with the following parameters:")
-        print(params.__str__())
-
-    fclStr=f'''
+# Per-TPC hit finder parameters overridden by the tuning, as (FCL key, template field)
+_FCL_TPCS = ['EE', 'EW', 'WE', 'WW']
+_FCL_PARAM_KEYS = [
+    ('HitFinderToolVec.CandidateHitsPlane0.RoiThreshold', 'roiThreshold0'),
+    ('HitFinderToolVec.CandidateHitsPlane1.RoiThreshold', 'roiThreshold1'),
+    ('HitFinderToolVec.CandidateHitsPlane2.RoiThreshold', 'roiThreshold2'),
+    ('HitFilterAlg.MinPulseHeight', 'minPulseHeight'),
+    ('HitFilterAlg.MinPulseSigma', 'minPulseSigma'),
+    ('LongMaxHits', 'LongMaxHits'),
+    ('LongPulseWidth', 'LongPulseWidth'),
+    ('PulseHeightCuts', 'PulseHeightCuts'),
+    ('PulseWidthCuts', 'PulseWidthCuts'),
+    ('PulseRatioCuts', 'PulseRatioCuts'),
+    ('MaxMultiHit', 'MaxMultiHit'),
+    ('Chi2NDF', 'Chi2NDF'),
+]
+
+# Static parts of the generated FCL files surrounding the parameter overrides
+_FCL_MC_HEAD = '''
 
 # This runs larcv as part of stage 1 processing for MC
 #include "wirechannelroiconverters_sbn.fcl"
@@ -445,7 +1394,7 @@ def generateFCLMC(params: fclParams, outputFile: str = "hitTuningMC.fcl", verbos
 process_name: MCstage1p2
 
 ## Add the MC module to the list of producers
-icarus_stage1_producers: {{
+icarus_stage1_producers: {
   channel2wire:                   @local::channelroitowire
 
   gaushit2dTPCWW:                 @local::gausshit_sbn
@@ -461,60 +1410,12 @@ icarus_stage1_producers: {{
   mcreco:                         @local::standard_mcreco
   mcassociationsGausCryoE:        @local::standard_mcparticlehitmatching
   mcassociationsGausCryoW:        @local::standard_mcparticlehitmatching
-}}
+}
 
 # Lower thresholds for tighter filter width
-icarus_stage1_producers.gaushit2dTPCEE.HitFinderToolVec.CandidateHitsPlane0.RoiThreshold:      {params.roiThreshold[0]}
-icarus_stage1_producers.gaushit2dTPCEE.HitFinderToolVec.CandidateHitsPlane1.RoiThreshold:      {params.roiThreshold[1]}
-icarus_stage1_producers.gaushit2dTPCEE.HitFinderToolVec.CandidateHitsPlane2.RoiThreshold:      {params.roiThreshold[2]}
-icarus_stage1_producers.gaushit2dTPCEE.HitFilterAlg.MinPulseHeight:                            {params.minPulseHeight}
-icarus_stage1_producers.gaushit2dTPCEE.HitFilterAlg.MinPulseSigma:                             {params.minPulseSigma}
-icarus_stage1_producers.gaushit2dTPCEE.LongMaxHits:                                            {params.LongMaxHits}
-icarus_stage1_producers.gaushit2dTPCEE.LongPulseWidth:                                         {params.LongPulseWidth}
-icarus_stage1_producers.gaushit2dTPCEE.PulseHeightCuts:                                        {params.PulseHeightCuts}
-icarus_stage1_producers.gaushit2dTPCEE.PulseWidthCuts:                                         {params.PulseWidthCuts}
-icarus_stage1_producers.gaushit2dTPCEE.PulseRatioCuts:                                         {params.PulseRatioCuts}
-icarus_stage1_producers.gaushit2dTPCEE.MaxMultiHit:                                            {params.MaxMultiHit}
-icarus_stage1_producers.gaushit2dTPCEE.Chi2NDF:                                                {params.Chi2NDF}
-
-icarus_stage1_producers.gaushit2dTPCEW.HitFinderToolVec.CandidateHitsPlane0.RoiThreshold:      {params.roiThreshold[0]}
-icarus_stage1_producers.gaushit2dTPCEW.HitFinderToolVec.CandidateHitsPlane1.RoiThreshold:      {params.roiThreshold[1]}
-icarus_stage1_producers.gaushit2dTPCEW.HitFinderToolVec.CandidateHitsPlane2.RoiThreshold:      {params.roiThreshold[2]}
-icarus_stage1_producers.gaushit2dTPCEW.HitFilterAlg.MinPulseHeight:                            {params.minPulseHeight}
-icarus_stage1_producers.gaushit2dTPCEW.HitFilterAlg.MinPulseSigma:                             {params.minPulseSigma}
-icarus_stage1_producers.gaushit2dTPCEW.LongMaxHits:                                            {params.LongMaxHits}
-icarus_stage1_producers.gaushit2dTPCEW.LongPulseWidth:                                         {params.LongPulseWidth}
-icarus_stage1_producers.gaushit2dTPCEW.PulseHeightCuts:                                        {params.PulseHeightCuts}
-icarus_stage1_producers.gaushit2dTPCEW.PulseWidthCuts:                                         {params.PulseWidthCuts}
-icarus_stage1_producers.gaushit2dTPCEW.PulseRatioCuts:                                         {params.PulseRatioCuts}
-icarus_stage1_producers.gaushit2dTPCEW.MaxMultiHit:                                            {params.MaxMultiHit}
-icarus_stage1_producers.gaushit2dTPCEW.Chi2NDF:                                                {params.Chi2NDF}
-
-icarus_stage1_producers.gaushit2dTPCWE.HitFinderToolVec.CandidateHitsPlane0.RoiThreshold:      {params.roiThreshold[0]}
-icarus_stage1_producers.gaushit2dTPCWE.HitFinderToolVec.CandidateHitsPlane1.RoiThreshold:      {params.roiThreshold[1]}
-icarus_stage1_producers.gaushit2dTPCWE.HitFinderToolVec.CandidateHitsPlane2.RoiThreshold:      {params.roiThreshold[2]}
-icarus_stage1_producers.gaushit2dTPCWE.HitFilterAlg.MinPulseHeight:                            {params.minPulseHeight}
-icarus_stage1_producers.gaushit2dTPCWE.HitFilterAlg.MinPulseSigma:                             {params.minPulseSigma}
-icarus_stage1_producers.gaushit2dTPCWE.LongMaxHits:                                            {params.LongMaxHits}
-icarus_stage1_producers.gaushit2dTPCWE.LongPulseWidth:                                         {params.LongPulseWidth}
-icarus_stage1_producers.gaushit2dTPCWE.PulseHeightCuts:                                        {params.PulseHeightCuts}
-icarus_stage1_producers.gaushit2dTPCWE.PulseWidthCuts:                                         {params.PulseWidthCuts}
-icarus_stage1_producers.gaushit2dTPCWE.PulseRatioCuts:                                         {params.PulseRatioCuts}
-icarus_stage1_producers.gaushit2dTPCWE.MaxMultiHit:                                            {params.MaxMultiHit}
-icarus_stage1_producers.gaushit2dTPCWE.Chi2NDF:                                                {params.Chi2NDF}
-
-icarus_stage1_producers.gaushit2dTPCWW.HitFinderToolVec.CandidateHitsPlane0.RoiThreshold:      {params.roiThreshold[0]}
-icarus_stage1_producers.gaushit2dTPCWW.HitFinderToolVec.CandidateHitsPlane1.RoiThreshold:      {params.roiThreshold[1]}
-icarus_stage1_producers.gaushit2dTPCWW.HitFinderToolVec.CandidateHitsPlane2.RoiThreshold:      {params.roiThreshold[2]}
-icarus_stage1_producers.gaushit2dTPCWW.HitFilterAlg.MinPulseHeight:                            {params.minPulseHeight}
-icarus_stage1_producers.gaushit2dTPCWW.HitFilterAlg.MinPulseSigma:                             {params.minPulseSigma}
-icarus_stage1_producers.gaushit2dTPCWW.LongMaxHits:                                            {params.LongMaxHits}
-icarus_stage1_producers.gaushit2dTPCWW.LongPulseWidth:                                         {params.LongPulseWidth}
-icarus_stage1_producers.gaushit2dTPCWW.PulseHeightCuts:                                        {params.PulseHeightCuts}
-icarus_stage1_producers.gaushit2dTPCWW.PulseWidthCuts:                                         {params.PulseWidthCuts}
-icarus_stage1_producers.gaushit2dTPCWW.PulseRatioCuts:                                         {params.PulseRatioCuts}
-icarus_stage1_producers.gaushit2dTPCWW.MaxMultiHit:                                            {params.MaxMultiHit}
-icarus_stage1_producers.gaushit2dTPCWW.Chi2NDF:                                                {params.Chi2NDF}
+'''
+
+_FCL_MC_TAIL = '''
 
 icarus_stage1_producers.gaushit2dTPCWW.CalDataModuleLabel:                                     "wire2channelroi2d:PHYSCRATEDATATPCWW"
 icarus_stage1_producers.gaushit2dTPCWE.CalDataModuleLabel:                                     "wire2channelroi2d:PHYSCRATEDATATPCWE"
@@ -544,9 +1445,9 @@ icarus_stage1_producers.cluster3DCryoE.Hit3DBuilderAlg.OutputHistograms:
 
 
 physics.producers:
-{{
+{
     @table::icarus_stage1_producers
-}}
+}
 
 physics.producers.channel2wire.WireModuleLabelVec: ["wire2channelroi2d:PHYSCRATEDATATPCEE", "wire2channelroi2d:PHYSCRATEDATATPCEW", "wire2channelroi2d:PHYSCRATEDATATPCWE", "wire2channelroi2d:PHYSCRATEDATATPCWW"]
 physics.producers.channel2wire.OutInstanceLabelVec: ["PHYSCRATEDATATPCEE", "PHYSCRATEDATATPCEW", "PHYSCRATEDATATPCWE", "PHYSCRATEDATATPCWW"]
@@ -575,10 +1476,10 @@ services.BackTrackerService.BackTracker.OverrideRealData: true
 services.ParticleInventoryService.ParticleInventory.OverrideRealData: true
 
 physics.filters:
-{{}}
+{}
 
 physics.analyzers:
-{{}}
+{}
 
 physics.reco: [
                 channel2wire,
@@ -596,117 +1497,54 @@ physics.outana:    [ ]
 
 physics.end_paths: [ outana, stream1 ]'''
 
-    with open(outputFile, 'w') as f:
-        f.write(fclStr)
+_FCL_DATA_HEAD = '''
+# This includes running larcv as part of stage 1 processing
+#include "services_common_icarus.fcl"
+#include "wirechannelroiconverters_sbn.fcl"
+#include "stage1_run2_icarus.fcl"
 
-def generateFCL(params: fclParams, outputFile: str = "hitTuning.fcl", verbose: bool = False) -> None:
-    """Generate FCL configuration file for real data processing.
-    
-    Args:
-        params: FCL parameters to use in configuration
-        outputFile: Path to output FCL file
-        verbose: Whether to print parameters to console
-    """
-    if verbose:
-        print("Generating new FHICL file with the following parameters:")
-        print(params.__str__())
-
-    fclStr=f'''
-# This includes running larcv as part of stage 1 processing
-#include "services_common_icarus.fcl"
-#include "wirechannelroiconverters_sbn.fcl"
-#include "stage1_run2_icarus.fcl"
-
-services:{{
+services:{
     @table::icarus_wirecalibration_services
-}}
+}
 
 icarus_stage1_producers:
-{{  
+{  
 ### TPC hit-finder producers
 gaushit2dTPCWW:                 @local::gausshit_sbn
 gaushit2dTPCWE:                 @local::gausshit_sbn
 gaushit2dTPCEW:                 @local::gausshit_sbn
 gaushit2dTPCEE:                 @local::gausshit_sbn
-}}
+}
 
 icarus_stage1_analyzers:
-{{}}
+{}
 
 icarus_stage1_filters:
-{{}}
+{}
 
 icarus_analysis_modules:
-{{}}
+{}
 
 # Lower thresholds for tighter filter width
-icarus_stage1_producers.gaushit2dTPCEE.HitFinderToolVec.CandidateHitsPlane0.RoiThreshold:      {params.roiThreshold[0]}
-icarus_stage1_producers.gaushit2dTPCEE.HitFinderToolVec.CandidateHitsPlane1.RoiThreshold:      {params.roiThreshold[1]}
-icarus_stage1_producers.gaushit2dTPCEE.HitFinderToolVec.CandidateHitsPlane2.RoiThreshold:      {params.roiThreshold[2]}
-icarus_stage1_producers.gaushit2dTPCEE.HitFilterAlg.MinPulseHeight:                            {params.minPulseHeight}
-icarus_stage1_producers.gaushit2dTPCEE.HitFilterAlg.MinPulseSigma:                             {params.minPulseSigma}
-icarus_stage1_producers.gaushit2dTPCEE.LongMaxHits:                                            {params.LongMaxHits}
-icarus_stage1_producers.gaushit2dTPCEE.LongPulseWidth:                                         {params.LongPulseWidth}
-icarus_stage1_producers.gaushit2dTPCEE.PulseHeightCuts:                                        {params.PulseHeightCuts}
-icarus_stage1_producers.gaushit2dTPCEE.PulseWidthCuts:                                         {params.PulseWidthCuts}
-icarus_stage1_producers.gaushit2dTPCEE.PulseRatioCuts:                                         {params.PulseRatioCuts}
-icarus_stage1_producers.gaushit2dTPCEE.MaxMultiHit:                                            {params.MaxMultiHit}
-icarus_stage1_producers.gaushit2dTPCEE.Chi2NDF:                                                {params.Chi2NDF}
-
-icarus_stage1_producers.gaushit2dTPCEW.HitFinderToolVec.CandidateHitsPlane0.RoiThreshold:      {params.roiThreshold[0]}
-icarus_stage1_producers.gaushit2dTPCEW.HitFinderToolVec.CandidateHitsPlane1.RoiThreshold:      {params.roiThreshold[1]}
-icarus_stage1_producers.gaushit2dTPCEW.HitFinderToolVec.CandidateHitsPlane2.RoiThreshold:      {params.roiThreshold[2]}
-icarus_stage1_producers.gaushit2dTPCEW.HitFilterAlg.MinPulseHeight:                            {params.minPulseHeight}
-icarus_stage1_producers.gaushit2dTPCEW.HitFilterAlg.MinPulseSigma:                             {params.minPulseSigma}
-icarus_stage1_producers.gaushit2dTPCEW.LongMaxHits:                                            {params.LongMaxHits}
-icarus_stage1_producers.gaushit2dTPCEW.LongPulseWidth:                                         {params.LongPulseWidth}
-icarus_stage1_producers.gaushit2dTPCEW.PulseHeightCuts:                                        {params.PulseHeightCuts}
-icarus_stage1_producers.gaushit2dTPCEW.PulseWidthCuts:                                         {params.PulseWidthCuts}
-icarus_stage1_producers.gaushit2dTPCEW.PulseRatioCuts:                                         {params.PulseRatioCuts}
-icarus_stage1_producers.gaushit2dTPCEW.MaxMultiHit:                                            {params.MaxMultiHit}
-icarus_stage1_producers.gaushit2dTPCEW.Chi2NDF:                                                {params.Chi2NDF}
-
-icarus_stage1_producers.gaushit2dTPCWE.HitFinderToolVec.CandidateHitsPlane0.RoiThreshold:      {params.roiThreshold[0]}
-icarus_stage1_producers.gaushit2dTPCWE.HitFinderToolVec.CandidateHitsPlane1.RoiThreshold:      {params.roiThreshold[1]}
-icarus_stage1_producers.gaushit2dTPCWE.HitFinderToolVec.CandidateHitsPlane2.RoiThreshold:      {params.roiThreshold[2]}
-icarus_stage1_producers.gaushit2dTPCWE.HitFilterAlg.MinPulseHeight:                            {params.minPulseHeight}
-icarus_stage1_producers.gaushit2dTPCWE.HitFilterAlg.MinPulseSigma:                             {params.minPulseSigma}
-icarus_stage1_producers.gaushit2dTPCWE.LongMaxHits:                                            {params.LongMaxHits}
-icarus_stage1_producers.gaushit2dTPCWE.LongPulseWidth:                                         {params.LongPulseWidth}
-icarus_stage1_producers.gaushit2dTPCWE.PulseHeightCuts:                                        {params.PulseHeightCuts}
-icarus_stage1_producers.gaushit2dTPCWE.PulseWidthCuts:                                         {params.PulseWidthCuts}
-icarus_stage1_producers.gaushit2dTPCWE.PulseRatioCuts:                                         {params.PulseRatioCuts}
-icarus_stage1_producers.gaushit2dTPCWE.MaxMultiHit:                                            {params.MaxMultiHit}
-icarus_stage1_producers.gaushit2dTPCWE.Chi2NDF:                                                {params.Chi2NDF}
-
-icarus_stage1_producers.gaushit2dTPCWW.HitFinderToolVec.CandidateHitsPlane0.RoiThreshold:      {params.roiThreshold[0]}
-icarus_stage1_producers.gaushit2dTPCWW.HitFinderToolVec.CandidateHitsPlane1.RoiThreshold:      {params.roiThreshold[1]}
-icarus_stage1_producers.gaushit2dTPCWW.HitFinderToolVec.CandidateHitsPlane2.RoiThreshold:      {params.roiThreshold[2]}
-icarus_stage1_producers.gaushit2dTPCWW.HitFilterAlg.MinPulseHeight:                            {params.minPulseHeight}
-icarus_stage1_producers.gaushit2dTPCWW.HitFilterAlg.MinPulseSigma:                             {params.minPulseSigma}
-icarus_stage1_producers.gaushit2dTPCWW.LongMaxHits:                                            {params.LongMaxHits}
-icarus_stage1_producers.gaushit2dTPCWW.LongPulseWidth:                                         {params.LongPulseWidth}
-icarus_stage1_producers.gaushit2dTPCWW.PulseHeightCuts:                                        {params.PulseHeightCuts}
-icarus_stage1_producers.gaushit2dTPCWW.PulseWidthCuts:                                         {params.PulseWidthCuts}
-icarus_stage1_producers.gaushit2dTPCWW.PulseRatioCuts:                                         {params.PulseRatioCuts}
-icarus_stage1_producers.gaushit2dTPCWW.MaxMultiHit:                                            {params.MaxMultiHit}
-icarus_stage1_producers.gaushit2dTPCWW.Chi2NDF:                                                {params.Chi2NDF}
+'''
+
+_FCL_DATA_TAIL = '''
 
 physics.producers:
-{{
-    rns: {{module_type: RandomNumberSaver }}
+{
+    rns: {module_type: RandomNumberSaver }
     @table::icarus_stage1_producers
-}}
+}
 
 physics.filters:
-{{
+{
     @table::icarus_stage1_filters
-}}
+}
 
 physics.analyzers:
-{{
+{
     @table::icarus_stage1_analyzers
-}}
+}
 
 physics.producers.channel2wire.WireModuleLabelVec: ["wire2channelroi2d:PHYSCRATEDATATPCEE", "wire2channelroi2d:PHYSCRATEDATATPCEW", "wire2channelroi2d:PHYSCRATEDATATPCWE", "wire2channelroi2d:PHYSCRATEDATATPCWW"]
 physics.producers.channel2wire.OutInstanceLabelVec: ["PHYSCRATEDATATPCEE", "PHYSCRATEDATATPCEW", "PHYSCRATEDATATPCWE", "PHYSCRATEDATATPCWW"]
@@ -728,10 +1566,283 @@ physics.outana:    [ ]
 physics.end_paths: [ outana, stream1 ]
     '''
 
+@lru_cache(maxsize=None)
+def _compileOverrideTemplate(prefix: str, suffix: str = '') -> str:
+    """Build the format string holding the parameter override lines for all TPCs.
+    
+    Args:
+        prefix: FCL table the gaushit producers live in
+        suffix: Suffix of the gaushit producer labels
+        
+    Returns:
+        Format string with one named field per tuned parameter
+    """
+    blocks = []
+    for tpc in _FCL_TPCS:
+        lines = []
+        for key, field in _FCL_PARAM_KEYS:
+            lines.append(f"{prefix}.gaushit2dTPC{tpc}{suffix}.{key}:".ljust(95) + f"{{{field}}}")
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+def renderFCLOverrides(params: fclParams, prefix: str = 'icarus_stage1_producers', suffix: str = '') -> str:
+    """Render the hit finder parameter override lines for a parameter set.
+    
+    Args:
+        params: FCL parameters to use in configuration
+        prefix: FCL table the gaushit producers live in
+        suffix: Suffix of the gaushit producer labels (for packed configurations)
+        
+    Returns:
+        Override lines for all four TPC hit finders
+    """
+    return _compileOverrideTemplate(prefix, suffix).format(
+        roiThreshold0=params.roiThreshold[0],
+        roiThreshold1=params.roiThreshold[1],
+        roiThreshold2=params.roiThreshold[2],
+        minPulseHeight=params.minPulseHeight,
+        minPulseSigma=params.minPulseSigma,
+        LongMaxHits=params.LongMaxHits,
+        LongPulseWidth=params.LongPulseWidth,
+        PulseHeightCuts=params.PulseHeightCuts,
+        PulseWidthCuts=params.PulseWidthCuts,
+        PulseRatioCuts=params.PulseRatioCuts,
+        MaxMultiHit=params.MaxMultiHit,
+        Chi2NDF=params.Chi2NDF,
+    )
+
+def generateFCLMC(params: fclParams, outputFile: str = "hitTuningMC.fcl", verbose: bool = False) -> None:
+    """Generate FCL configuration file for Monte Carlo data processing.
+    
+    Args:
+        params: FCL parameters to use in configuration
+        outputFile: Path to output FCL file
+        verbose: Whether to print parameters to console
+    """
+    if verbose:
+        print("Generating new FHICL file for MC with the following parameters:")
+        print(params.__str__())
+
+    fclStr = _FCL_MC_HEAD + renderFCLOverrides(params) + _FCL_MC_TAIL
+
     with open(outputFile, 'w') as f:
         f.write(fclStr)
 
-def run(fclFile: str, inputFile: str, outputFile: str, options: Optional[str] = None) -> None:
+def generateFCL(params: fclParams, outputFile: str = "hitTuning.fcl", verbose: bool = False) -> None:
+    """Generate FCL configuration file for real data processing.
+    
+    Args:
+        params: FCL parameters to use in configuration
+        outputFile: Path to output FCL file
+        verbose: Whether to print parameters to console
+    """
+    if verbose:
+        print("Generating new FHICL file with the following parameters:")
+        print(params.__str__())
+
+    fclStr = _FCL_DATA_HEAD + renderFCLOverrides(params) + _FCL_DATA_TAIL
+
+    with open(outputFile, 'w') as f:
+        f.write(fclStr)
+
+def packLabelSuffix(k: int) -> str:
+    """Return the module label suffix of configuration k in a packed FCL file."""
+    return f'k{k}'
+
+def generateFCLPacked(paramSets: List[fclParams], outputFile: str, verbose: bool = False) -> List[str]:
+    """Generate an MC FCL file that runs several hit finder configurations in one lar job.
+    
+    The stage1 chain up to the ROI conversion and mcreco runs once. Each
+    configuration gets copies of the gaushit2dTPC* producers and of
+    mcassociationsGausCryoE under labels with its packLabelSuffix, so
+    galleryMCPacked can analyse all of them in one event loop.
+    
+    Args:
+        paramSets: FCL parameters of each configuration
+        outputFile: Path to output FCL file
+        verbose: Whether to print parameters to console
+        
+    Returns:
+        Module label suffix of each configuration
+    """
+    suffixes = [packLabelSuffix(k) for k in range(len(paramSets))]
+    blocks = []
+    for suffix, params in zip(suffixes, paramSets):
+        if verbose:
+            print(f"Packing configuration {suffix} with the following parameters:")
+            print(params.__str__())
+        lines = [f"physics.producers.gaushit2dTPC{tpc}{suffix}:".ljust(95) + f"@local::physics.producers.gaushit2dTPC{tpc}"
+                 for tpc in _FCL_TPCS]
+        lines.append(renderFCLOverrides(params, prefix='physics.producers', suffix=suffix))
+        lines.append(f"physics.producers.mcassociationsGausCryoE{suffix}:".ljust(95)
+                     + "@local::physics.producers.mcassociationsGausCryoE")
+        hitLabels = ', '.join(f'"gaushit2dTPC{tpc}{suffix}"' for tpc in _FCL_TPCS)
+        lines.append(f"physics.producers.mcassociationsGausCryoE{suffix}.HitParticleAssociations.HitModuleLabelVec: [{hitLabels}]")
+        blocks.append('\n'.join(lines))
+
+    reco = (['channel2wire'] + [f'gaushit2dTPC{tpc}{suffix}' for suffix in suffixes for tpc in _FCL_TPCS]
+            + [f'mcassociationsGausCryoE{suffix}' for suffix in suffixes] + ['mcreco'])
+    fclStr = (_FCL_MC_HEAD + renderFCLOverrides(paramSets[0]) + _FCL_MC_TAIL
+              + '\n\n# Packed hit finder configurations\n' + '\n\n'.join(blocks)
+              + '\n\nphysics.reco: [\n                ' + ',\n                '.join(reco) + '\n            ]\n')
+
+    with open(outputFile, 'w') as f:
+        f.write(fclStr)
+    return suffixes
+
+# Modules of the MC stage1 chain that do not depend on the hit finder parameters
+_FCL_MC_ROI_CACHE_TAIL = '''
+
+# ROI cache stage: run the parameter-independent producers once and keep everything
+process_name: MCstage1roi
+
+physics.reco: [
+                channel2wire,
+                mcreco
+            ]
+'''
+
+# Hit finding only, reading the output of the ROI cache stage
+_FCL_MC_HITS_ONLY_TAIL = '''
+
+# Hit finding only: channel2wire and mcreco were run by the ROI cache stage
+physics.reco: [
+                gaushit2dTPCEW,
+                gaushit2dTPCEE,
+                gaushit2dTPCWW,
+                gaushit2dTPCWE,
+                mcassociationsGausCryoE,
+                mcassociationsGausCryoW
+            ]
+
+outputs.rootOutput.outputCommands: [ "drop *",
+                                     "keep *_gaushit2dTPC*_*_*",
+                                     "keep *_mcassociationsGaus*_*_*",
+                                     "keep *_wire2channelroi2d_*_*",
+                                     "keep *_largeant_*_*",
+                                     "keep *_merge_*_*" ]
+'''
+
+def generateROICacheFCL(outputFile: str = "hitTuningROICache.fcl") -> None:
+    """Generate the MC FCL file that writes the parameter-independent stage1 products once per input.
+    
+    Args:
+        outputFile: Path to output FCL file
+    """
+    with open(outputFile, 'w') as f:
+        f.write(_FCL_MC_HEAD + _FCL_MC_TAIL + _FCL_MC_ROI_CACHE_TAIL)
+
+def generateFCLHitsOnly(params: fclParams, outputFile: str = "hitTuningHits.fcl", verbose: bool = False) -> None:
+    """Generate an MC FCL file that only runs the hit finders and MC associations on an ROI cache file.
+    
+    Args:
+        params: FCL parameters to use in configuration
+        outputFile: Path to output FCL file
+        verbose: Whether to print parameters to console
+    """
+    if verbose:
+        print("Generating new hit finding only FHICL file for MC with the following parameters:")
+        print(params.__str__())
+
+    fclStr = _FCL_MC_HEAD + renderFCLOverrides(params) + _FCL_MC_TAIL + _FCL_MC_HITS_ONLY_TAIL
+
+    with open(outputFile, 'w') as f:
+        f.write(fclStr)
+
+def generateFCLBulk(paramGrid, outputDir: str, tag: str, mc: bool = False, verbose: bool = False,
+                    shard: Optional[Tuple[int, int]] = None) -> Tuple[int, int]:
+    """Write FCL files for many parameter sets sharing a single base file.
+    
+    The parameter-independent body is written once as an includable base file.
+    Each parameter set gets a small file that includes the base and overrides
+    the gaushit producer parameters. Parameter sets with identical overrides
+    are detected by content hash and share one file. The mapping from grid
+    index to FCL file is written to hitTuning_<tag>_index.txt, or to
+    hitTuning_<tag>_index_<i>of<N>.txt for shard i of N, so the shards of a
+    grid can be written separately and their indices concatenated.
+    
+    Args:
+        paramGrid: Iterable of (grid index, fclParams) pairs
+        outputDir: Directory to write FCL files to
+        tag: Tag used in the FCL file names
+        mc: Whether to write the MC configuration
+        verbose: Whether to print parameters to console
+        shard: (shard index, number of shards) if paramGrid is one shard of the grid
+        
+    Returns:
+        Tuple of (number of parameter sets, number of FCL files written)
+    """
+    start = time.time()
+    baseName = f'hitTuning_{tag}_base.fcl'
+    with open(os.path.join(outputDir, baseName), 'w') as f:
+        f.write(_FCL_MC_HEAD + _FCL_MC_TAIL if mc else _FCL_DATA_HEAD + _FCL_DATA_TAIL)
+    include = f'#include "{baseName}"\n\n'
+
+    written = {}
+    nParams = 0
+    indexName = f'hitTuning_{tag}_index.txt' if shard is None else f'hitTuning_{tag}_index_{shard[0]}of{shard[1]}.txt'
+    with open(os.path.join(outputDir, indexName), 'w') as index:
+        for ip, params in paramGrid:
+            if verbose:
+                print(params.__str__())
+            # physics.producers has already been expanded from icarus_stage1_producers in the base file
+            overrides = renderFCLOverrides(params, prefix='physics.producers') + '\n'
+            digest = hashlib.sha1(overrides.encode()).hexdigest()
+            fclName = written.get(digest)
+            if fclName is None:
+                fclName = f'hitTuning_{tag}_{ip}.fcl'
+                with open(os.path.join(outputDir, fclName), 'w') as f:
+                    f.write(include + overrides)
+                written[digest] = fclName
+            index.write(f'{ip} {fclName}\n')
+            nParams += 1
+            if nParams % 1000 == 0:
+                print(f"Processed {nParams} parameter sets, {len(written)} unique FCL files")
+
+    elapsed = time.time() - start
+    rate = (len(written) + 1) / elapsed if elapsed > 0 else float('inf')
+    print(f"Wrote {len(written)} FCL files (+1 base) for {nParams} parameter sets "
+          f"({nParams - len(written)} duplicates) in {elapsed:.2f} s: {rate:.1f} files/s")
+    return nParams, len(written)
+
+def parseTrackerDBs(timingDB: Optional[str] = None, memoryDB: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Summarise the per-module output of art's TimeTracker and MemoryTracker services.
+    
+    Args:
+        timingDB: SQLite file written by lar --timing-db
+        memoryDB: SQLite file written by lar --memcheck-db
+        
+    Returns:
+        Dictionary of module label to module_type, n_events, total_time, mean_time
+        and max_time (seconds) and peak_rss_mb; missing values are None
+    """
+    modules = {}
+
+    def module(label: str, moduleType: Optional[str]) -> Dict[str, Any]:
+        return modules.setdefault(label, dict(module_type=moduleType, n_events=None, total_time=None,
+                                              mean_time=None, max_time=None, peak_rss_mb=None))
+
+    if timingDB and os.path.exists(timingDB):
+        with sqlite3.connect(timingDB) as conn:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'TimeModule'").fetchone():
+                for label, moduleType, n, total, mean, peak in conn.execute(
+                        '''SELECT ModuleLabel, ModuleType, COUNT(*), SUM(Time), AVG(Time), MAX(Time)
+                           FROM TimeModule GROUP BY ModuleLabel, ModuleType'''):
+                    module(label, moduleType).update(n_events=n, total_time=total, mean_time=mean, max_time=peak)
+
+    if memoryDB and os.path.exists(memoryDB):
+        with sqlite3.connect(memoryDB) as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info('ModuleInfo')")}
+            if {'ModuleLabel', 'RSS'} <= columns:
+                moduleType = 'ModuleType' if 'ModuleType' in columns else 'NULL'
+                for label, mtype, rss in conn.execute(
+                        f'SELECT ModuleLabel, {moduleType}, MAX(RSS) FROM ModuleInfo GROUP BY ModuleLabel'):
+                    module(label, mtype)['peak_rss_mb'] = rss
+
+    return modules
+
+def run(fclFile: str, inputFile: str, outputFile: str, options: Optional[str] = None,
+        costs: Optional[Dict[str, Any]] = None) -> int:
     """Run LArSoft with specified FCL file and input.
     
     Args:
@@ -739,6 +1850,13 @@ def run(fclFile: str, inputFile: str, outputFile: str, options: Optional[str] =
         inputFile: Path to input ROOT file or file list
         outputFile: Path to output ROOT file
         options: Additional command-line options for lar command
+        costs: If given, lar also runs with art's TimeTracker and MemoryTracker and
+               this dictionary is filled with wall_time, cpu_time (seconds),
+               max_rss_mb from the rusage of the lar process, and the per-module
+               costs under 'modules'
+
+    Returns:
+        Exit status of the lar command
     """
     if not inputFile.endswith('.root'):
         cmd = f"lar -c {fclFile} --source-list {inputFile} -o {outputFile}"
@@ -750,8 +1868,1357 @@ def run(fclFile: str, inputFile: str, outputFile: str, options: Optional[str] =
     else:
         print("run on all events")
         cmd += ' -n -1'
+    if costs is not None:
+        trackerBase = os.path.splitext(outputFile)[0]
+        timingDB, memoryDB = f'{trackerBase}_timing.db', f'{trackerBase}_memory.db'
+        cmd += f' --timing-db {timingDB} --memcheck-db {memoryDB}'
     print(f"Running command: {cmd}")
-    os.system(cmd)
+    if costs is None:
+        return os.waitstatus_to_exitcode(os.system(cmd))
+
+    # Wait on lar directly, so its rusage is that of lar itself
+    start = time.perf_counter()
+    try:
+        proc = subprocess.Popen(shlex.split(cmd))
+    except OSError as e:
+        print(f"Failed to start lar: {e}")
+        return 127
+    _, waitStatus, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(waitStatus)
+    costs['wall_time'] = time.perf_counter() - start
+    costs['cpu_time'] = usage.ru_utime + usage.ru_stime
+    costs['max_rss_mb'] = usage.ru_maxrss / 1024  # kB on Linux
+    costs['modules'] = parseTrackerDBs(timingDB, memoryDB)
+    for trackerDB in (timingDB, memoryDB):
+        if os.path.exists(trackerDB):
+            os.remove(trackerDB)
+    print(f"lar took {costs['wall_time']:.1f} s wall, {costs['cpu_time']:.1f} s CPU, "
+          f"{costs['max_rss_mb']:.0f} MB peak RSS")
+    return proc.returncode
+
+# Declarations of the macro entry points, for cached libraries loaded without their source
+_MACRO_PROTOTYPES = {
+    'galleryMC': {
+        'galleryMC': 'std::vector<std::vector<float>> galleryMC(std::string const& inputFile = "nominalTest.root", '
+                     'std::string const& outputFile = "histnominalTest.root", std::string const& dumpFile = "");',
+        'galleryMCPacked': 'std::vector<std::vector<std::vector<float>>> galleryMCPacked(std::string const& inputFile, '
+                           'std::string const& outputFile, std::vector<std::string> const& labelSuffixes);',
+        'eventTruthSummary': 'std::vector<std::vector<double>> eventTruthSummary(std::string const& inputFile);',
+    },
+    'galleryMacro': {
+        'galleryMacro': 'void galleryMacro(std::string const& inputFile = "nominalTest.root", '
+                        'std::string const& outputFile = "histnominalTest.root", int channel = 15700, '
+                        'int timeLow = 0, int timeHigh = 5000);',
+    },
+}
+
+def _setupIncludePath(macroPath: Optional[str] = None) -> str:
+    """Return the ACLiC include path without the macro directory itself.
+    
+    runGrid adds the directory the job tarball was unpacked into to the include
+    path before loading the macro, while --buildMacro does not. That directory
+    differs on every worker node, so it must not enter the build key.
+    """
+    macroDir = os.path.abspath(macroPath or '.')
+    tokens = shlex.split(str(r.gSystem.GetIncludePath()))
+    kept = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == '-I' and i + 1 < len(tokens):
+            token += tokens[i + 1]
+            i += 1
+        i += 1
+        if token.startswith('-I') and os.path.abspath(token[2:]) == macroDir:
+            continue
+        kept.append(token)
+    return ' '.join(kept)
+
+def macroBuildKey(mc: bool = True, macroPath: Optional[str] = None) -> str:
+    """Return the build cache key of the gallery macro library.
+    
+    The key covers the macro source, the ROOT version and the ACLiC compiler
+    command, flags and include paths, so a cached library is only reused
+    with the software setup it was built for. The macro directory is left out
+    of the include path, so --buildMacro and runGrid compute the same key
+    wherever the job tarball is unpacked.
+    
+    Args:
+        mc: Use galleryMC.cpp if True, otherwise galleryMacro.cpp
+        macroPath: Directory containing the macro (defaults to the working directory)
+        
+    Returns:
+        Hex digest identifying the build
+    """
+    build = {
+        'source': macroVersion(mc, macroPath),
+        'root': str(r.gROOT.GetVersion()),
+        'makeSharedLib': str(r.gSystem.GetMakeSharedLib()),
+        'flags': str(r.gSystem.GetFlagsOpt()),
+        'includePath': _setupIncludePath(macroPath),
+        'rootIncludePath': os.environ.get('ROOT_INCLUDE_PATH', ''),
+    }
+    return hashlib.sha256(json.dumps(build, sort_keys=True).encode()).hexdigest()[:16]
+
+def macroCacheDir(macroPath: Optional[str] = None) -> str:
+    """Return the macro build cache directory: $HITTUNING_MACRO_CACHE, else macroCache/ next to the macro."""
+    return os.environ.get('HITTUNING_MACRO_CACHE') or os.path.join(macroPath or '.', 'macroCache')
+
+def loadMacro(mc: bool = True, macroPath: Optional[str] = None, cacheDir: Optional[str] = None) -> int:
+    """Load the gallery macro used to analyse lar output from the build cache, compiling it on a miss.
+    
+    Libraries are cached under <cacheDir>/<macroBuildKey>/. A cache that is
+    not writable (e.g. shipped read-only in a job tarball) is still used for
+    lookups, and misses are then built in ./macroCache instead.
+    
+    Args:
+        mc: Load galleryMC.cpp if True, otherwise galleryMacro.cpp
+        macroPath: Directory containing the macro (defaults to the working directory)
+        cacheDir: Build cache directory (defaults to macroCacheDir(macroPath))
+        
+    Returns:
+        0 if the macro library was loaded, non-zero otherwise
+    """
+    r.gInterpreter.ProcessLine('#include "gallery/Event.h"')
+    r.gInterpreter.ProcessLine('#include "canvas/Persistency/Common/FindManyP.h"')
+    r.gInterpreter.ProcessLine('#include "canvas/Utilities/InputTag.h"')
+    entry = 'galleryMC' if mc else 'galleryMacro'
+    macro = os.path.abspath(os.path.join(macroPath or '.', f'{entry}.cpp'))
+    libName = f'{entry}_cpp'
+    key = macroBuildKey(mc, macroPath)
+    cacheDirs = list(dict.fromkeys([os.path.abspath(cacheDir or macroCacheDir(macroPath)),
+                                    os.path.abspath('macroCache')]))
+
+    for directory in cacheDirs:
+        lib = os.path.join(directory, key, f'{libName}.{r.gSystem.GetSoExt()}')
+        if not os.path.exists(lib):
+            continue
+        start = time.time()
+        if r.gSystem.Load(lib) < 0:
+            print(f"Warning: failed to load cached macro library {lib}, recompiling")
+            break
+        for function, prototype in _MACRO_PROTOTYPES[entry].items():
+            if not r.gROOT.GetGlobalFunction(function):
+                r.gInterpreter.Declare(prototype)
+        elapsed = time.time() - start
+        try:
+            with open(os.path.join(directory, key, 'build.json')) as f:
+                compileTime = json.load(f)['compileSeconds']
+            print(f"Loaded cached {libName} ({key}) in {elapsed:.1f} s, "
+                  f"saving ~{compileTime - elapsed:.0f} s of compilation")
+        except (OSError, ValueError, KeyError):
+            print(f"Loaded cached {libName} ({key}) in {elapsed:.1f} s")
+        return 0
+
+    # Cache miss: build in a private directory and publish it atomically
+    for directory in cacheDirs:
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(directory, os.W_OK):
+            break
+    else:
+        directory = os.path.join(tempfile.gettempdir(), 'macroCache')
+        os.makedirs(directory, exist_ok=True)
+    buildDir = tempfile.mkdtemp(prefix=f'.{key}.', dir=directory)
+    print(f"Compiling {macro} into macro cache {directory} ({key})")
+    start = time.time()
+    ok = r.gSystem.CompileMacro(macro, 'kO', os.path.join(buildDir, libName), buildDir)
+    compileTime = time.time() - start
+    print(f"Compilation result: {ok} ({compileTime:.1f} s)")
+    if not ok:
+        shutil.rmtree(buildDir, ignore_errors=True)
+        return 1
+
+    with open(os.path.join(buildDir, 'build.json'), 'w') as f:
+        json.dump({'macro': macro, 'key': key, 'compileSeconds': compileTime,
+                   'root': str(r.gROOT.GetVersion()), 'built': datetime.now().isoformat()}, f)
+    try:
+        os.rename(buildDir, os.path.join(directory, key))
+    except OSError:
+        # Another process published the same build first
+        shutil.rmtree(buildDir, ignore_errors=True)
+    return 0
+
+@lru_cache(maxsize=None)
+def macroVersion(mc: bool = True, macroPath: Optional[str] = None) -> str:
+    """Return a hash of the gallery macro source used to analyse lar output.
+    
+    Args:
+        mc: Use galleryMC.cpp if True, otherwise galleryMacro.cpp
+        macroPath: Directory containing the macro (defaults to the working directory)
+        
+    Returns:
+        SHA-256 hex digest of the macro source, or 'unknown' if it cannot be read
+    """
+    macro = 'galleryMC.cpp' if mc else 'galleryMacro.cpp'
+    if macroPath is not None:
+        macro = os.path.join(macroPath, macro)
+    try:
+        with open(macro, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return 'unknown'
+
+def inputIdentity(inputFile: str) -> Dict[str, Any]:
+    """Describe an input file (or file list) well enough to detect changes.
+    
+    Local files are identified by absolute path, size and modification time;
+    file lists additionally by the hash of their contents. Remote URLs are
+    identified by the URL alone.
+    
+    Args:
+        inputFile: Path to input ROOT file, file list or remote URL
+        
+    Returns:
+        Dictionary describing the input
+    """
+    if '://' in inputFile or not os.path.exists(inputFile):
+        return {'path': inputFile}
+    st = os.stat(inputFile)
+    identity = {'path': os.path.abspath(inputFile), 'size': st.st_size, 'mtime': st.st_mtime_ns}
+    if not inputFile.endswith('.root'):
+        with open(inputFile, 'rb') as f:
+            identity['content'] = hashlib.sha256(f.read()).hexdigest()
+    return identity
+
+def runCacheKey(params: fclParams, inputFile: str, options: Optional[str], mc: bool,
+                macroPath: Optional[str] = None, selection: Optional[str] = None) -> str:
+    """Compute a stable key identifying the result of running one configuration.
+    
+    Args:
+        params: FCL parameters for the run
+        inputFile: Path to input ROOT file or file list
+        options: Additional command-line options for lar
+        mc: Whether the MC configuration and galleryMC analysis are used
+        macroPath: Directory containing the gallery macro
+        selection: Event selection expression (None for all events)
+        
+    Returns:
+        SHA-256 hex digest of the run configuration
+    """
+    key = {
+        'params': vars(params),
+        'input': inputIdentity(inputFile),
+        'options': options if options is not None else '-n -1',
+        'mc': mc,
+        'macro': macroVersion(mc, macroPath),
+    }
+    if selection is not None:
+        key['selection'] = selection
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def eventsFromOptions(options: Optional[str]) -> int:
+    """Return the event count requested by lar options ('-n N'), -1 for all events."""
+    match = re.search(r'(?:^|\s)(?:-n|--nevts)\s+(-?\d+)', options or '')
+    return int(match.group(1)) if match else -1
+
+# lar options selecting the events to process, with the number of values each takes
+_EVENT_OPTIONS = {'-n': 1, '--nevts': 1, '--nskip': 1, '-e': 1, '--estart': 1}
+
+def splitEventOptions(options: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Split lar options into the event selection and everything else.
+    
+    Args:
+        options: Additional command-line options for lar
+        
+    Returns:
+        Tuple of (event selection options, other options), None where empty
+    """
+    eventOptions, otherOptions = [], []
+    words = shlex.split(options or '')
+    i = 0
+    while i < len(words):
+        n = _EVENT_OPTIONS.get(words[i])
+        if n is None:
+            otherOptions.append(words[i])
+            i += 1
+        else:
+            eventOptions += words[i:i + 1 + n]
+            i += 1 + n
+    return (' '.join(eventOptions) or None), (' '.join(otherOptions) or None)
+
+def roiCacheDir(outputDir: str) -> str:
+    """Return the ROI cache directory: $HITTUNING_ROI_CACHE, else roiCache/ in the output directory."""
+    return os.environ.get('HITTUNING_ROI_CACHE') or os.path.join(outputDir, 'roiCache')
+
+def roiCacheKey(inputFile: str, eventOptions: Optional[str]) -> str:
+    """Compute the key of the ROI cache file of an input and event selection.
+    
+    Args:
+        inputFile: Path to input ROOT file or file list
+        eventOptions: Event selection options for lar (None for all events)
+        
+    Returns:
+        First 16 hex digits of the SHA-256 digest of the input, events and ROI cache FCL
+    """
+    key = {
+        'input': inputIdentity(inputFile),
+        'events': eventOptions if eventOptions is not None else '-n -1',
+        'fcl': hashlib.sha256((_FCL_MC_HEAD + _FCL_MC_TAIL + _FCL_MC_ROI_CACHE_TAIL).encode()).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+def ensureROICache(inputFile: str, options: Optional[str], cacheDir: str) -> str:
+    """Return the ROI cache file of an input and event selection, producing it with lar if needed.
+    
+    The file is written under a temporary name and renamed when lar succeeds,
+    so an interrupted stage never leaves a truncated cache behind.
+    
+    Args:
+        inputFile: Path to input ROOT file or file list
+        options: lar options of the tuning runs; only the event selection is used
+        cacheDir: Directory holding the ROI cache files
+        
+    Returns:
+        Path of the ROI cache file
+    """
+    eventOptions, _ = splitEventOptions(options)
+    key = roiCacheKey(inputFile, eventOptions)
+    cacheFile = os.path.join(cacheDir, f'roi_{key}.root')
+    if os.path.exists(cacheFile):
+        print(f"Reusing ROI cache {cacheFile} for {inputFile}")
+        return cacheFile
+
+    os.makedirs(cacheDir, exist_ok=True)
+    fclFile = os.path.join(cacheDir, f'roi_{key}.fcl')
+    generateROICacheFCL(fclFile)
+    partial = os.path.join(cacheDir, f'.roi_{key}.{os.getpid()}.root')
+    print(f"Writing ROI cache {cacheFile} for {inputFile}")
+    status = run(fclFile, inputFile, partial, options=eventOptions)
+    if status != 0:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise RuntimeError(f"lar exited with status {status} while writing the ROI cache for {inputFile}")
+    os.replace(partial, cacheFile)
+    return cacheFile
+
+def useROICache(tasks: List['RunTask'], inputFile: str, outputDir: str) -> Dict[Optional[str], str]:
+    """Point the hit finding only tasks that still need lar at the ROI cache of their event range.
+    
+    Each task keeps the lar options it was registered with (resumed tasks may
+    come from different halving rungs or sessions), so one ROI cache is made
+    per distinct event selection and the task runs with the remaining options.
+    
+    Args:
+        tasks: Tasks returned by registerTasks or resumeTasks; only those with hitsOnly set are changed
+        inputFile: Path to input ROOT file or file list
+        outputDir: Output directory of the tasks, holding roiCache/ by default
+        
+    Returns:
+        Path of the ROI cache file of each event selection used
+    """
+    cacheFiles = {}
+    for task in tasks:
+        if not task.hitsOnly or task.state not in ('registered', 'generated'):
+            continue
+        eventOptions, hitOptions = splitEventOptions(task.options)
+        if eventOptions not in cacheFiles:
+            cacheFiles[eventOptions] = ensureROICache(inputFile, task.options, roiCacheDir(outputDir))
+        task.larInput = cacheFiles[eventOptions]
+        task.options = hitOptions
+    return cacheFiles
+
+# Names usable in --select expressions and the event_selection columns they refer to
+SELECTION_COLUMNS = {'total': 'e_total', 'ele': 'e_ele', 'gamma': 'e_gamma', 'mu': 'e_mu', 'p': 'e_p',
+                     'pi': 'e_pi', 'run': 'run', 'subrun': 'subrun', 'event': 'event'}
+
+_SELECTION_OPERATORS = {ast.And: 'AND', ast.Or: 'OR', ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+                        ast.Eq: '=', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>='}
+
+def compileSelection(expression: str) -> Tuple[str, List[Any]]:
+    """Translate an event selection expression into a parameterised SQL condition.
+    
+    Expressions use Python syntax restricted to the names in SELECTION_COLUMNS
+    (energies in MeV), numbers, arithmetic, comparisons, and/or/not, e.g.
+    'ele > 100 and mu == 0' or 'run == 9963 and event == 28003'.
+    
+    Args:
+        expression: Selection expression
+        
+    Returns:
+        Tuple of (SQL condition, parameters)
+        
+    Raises:
+        ValueError: If the expression uses anything outside the whitelist
+    """
+    params = []
+
+    def visit(node: ast.AST) -> str:
+        if isinstance(node, ast.BoolOp):
+            return '(' + f' {_SELECTION_OPERATORS[type(node.op)]} '.join(visit(v) for v in node.values) + ')'
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.USub)):
+            return f"({'NOT ' if isinstance(node.op, ast.Not) else '-'}{visit(node.operand)})"
+        if isinstance(node, ast.BinOp) and type(node.op) in _SELECTION_OPERATORS:
+            return f'({visit(node.left)} {_SELECTION_OPERATORS[type(node.op)]} {visit(node.right)})'
+        if isinstance(node, ast.Compare) and all(type(op) in _SELECTION_OPERATORS for op in node.ops):
+            operands = [visit(node.left)] + [visit(c) for c in node.comparators]
+            return '(' + ' AND '.join(f'{a} {_SELECTION_OPERATORS[type(op)]} {b}'
+                                      for a, op, b in zip(operands, node.ops, operands[1:])) + ')'
+        if isinstance(node, ast.Name) and node.id in SELECTION_COLUMNS:
+            return SELECTION_COLUMNS[node.id]
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            params.append(node.value)
+            return '?'
+        raise ValueError(f"Unsupported element '{ast.dump(node)}' in selection '{expression}'; "
+                         f"use numbers, {', '.join(SELECTION_COLUMNS)}, arithmetic, comparisons and and/or/not")
+
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid selection '{expression}': {e}")
+    return visit(tree.body), params
+
+def indexEvents(db: 'HitTuningDB', inputFile: str) -> int:
+    """Record the truth particle content of every event of the input in the event pre-selection index.
+    
+    Files whose size and modification time are unchanged since they were
+    indexed are skipped. Needs the galleryMC macro to be loaded.
+    
+    Args:
+        db: Database holding the index
+        inputFile: Path to input ROOT file or file list
+        
+    Returns:
+        Number of files indexed
+    """
+    from eventIndex import inputFiles
+    nIndexed = 0
+    for path in inputFiles([inputFile]):
+        identity = inputIdentity(path)
+        if db.event_index_current(identity['path'], identity.get('size', -1), identity.get('mtime', -1)):
+            continue
+        start = time.time()
+        rows = [[float(v) for v in row] for row in r.eventTruthSummary(path)]
+        db.set_event_index(identity['path'], identity.get('size', -1), identity.get('mtime', -1), rows)
+        print(f"Indexed {len(rows)} events of {path} in {time.time() - start:.1f} s")
+        nIndexed += 1
+    return nIndexed
+
+def applyEventSelection(db: 'HitTuningDB', tasks: List['RunTask'], inputFile: str,
+                        expression: str) -> List[Tuple[int, int, int]]:
+    """Restrict tasks to the events of the input that pass a selection.
+    
+    The input is indexed first if needed. The selected events are passed to
+    lar through an EventIDFilter in the generated FCL files, and the selection
+    becomes part of the run cache key.
+    
+    Args:
+        db: Database holding the event index
+        tasks: Tasks from buildTasks or resumeTasks, before they are registered or run
+        inputFile: Path to input ROOT file or file list
+        expression: Selection expression, see compileSelection
+        
+    Returns:
+        Selected (run, subrun, event) IDs
+    """
+    from eventIndex import inputFiles
+    where, params = compileSelection(expression)
+    indexEvents(db, inputFile)
+    paths = [inputIdentity(path)['path'] for path in inputFiles([inputFile])]
+    eventIds = db.select_events(paths, where, params)
+    nTotal = sum(db.conn.execute('SELECT n_events FROM event_index_files WHERE path = ?', (path,)).fetchone()[0]
+                 for path in paths)
+    if not eventIds:
+        raise ValueError(f"No events of {inputFile} pass the selection '{expression}'")
+    print(f"Selection '{expression}' keeps {len(eventIds)} of {nTotal} events")
+    for task in tasks:
+        task.selection = expression
+        task.eventIds = eventIds
+    return eventIds
+
+def renderEventSelection(eventIds: List[Tuple[int, int, int]]) -> str:
+    """Render the FCL lines that run the reconstruction on, and write, only the given events.
+    
+    Args:
+        eventIds: Selected (run, subrun, event) IDs
+        
+    Returns:
+        FCL lines to append to a generated configuration
+    """
+    ids = ',\n                             '.join(f'"{run}:{subrun}:{event}"' for run, subrun, event in eventIds)
+    return f'''
+
+# Event pre-selection: rejected events stop at the filter and are not written
+physics.filters.eventSelect: {{
+    module_type: EventIDFilter
+    idsToMatch: [ {ids} ]
+}}
+physics.selectedReco: [ eventSelect, @sequence::physics.reco ]
+physics.trigger_paths: [ selectedReco ]
+outputs.rootOutput.SelectEvents: [ selectedReco ]
+'''
+
+class RunTask:
+    """Bookkeeping for one parameter set processed by the interactive loop."""
+
+    def __init__(self, index: int, params: fclParams, fclFile: str, outputFile: str,
+                 histFile: str, options: Optional[str] = None, tag: str = 'test', version: int = 0,
+                 dumpFile: Optional[str] = None) -> None:
+        self.index = index
+        self.params = params
+        self.fclFile = fclFile
+        self.outputFile = outputFile
+        self.histFile = histFile
+        self.dumpFile = dumpFile
+        self.options = options
+        self.tag = tag
+        self.version = version
+        self.runId: Optional[int] = None
+        self.cacheKey: Optional[str] = None
+        self.state: Optional[str] = None
+        self.results: Optional[List[List[float]]] = None
+        self.hitsOnly = False
+        self.larInput: Optional[str] = None
+        self.selection: Optional[str] = None
+        self.eventIds: Optional[List[Tuple[int, int, int]]] = None
+
+def writeTaskFCL(task: RunTask, mc: bool) -> None:
+    """Write the FCL file of a parameter set."""
+    if task.hitsOnly:
+        generateFCLHitsOnly(task.params, outputFile=task.fclFile)
+    elif mc:
+        generateFCLMC(task.params, outputFile=task.fclFile)
+    else:
+        generateFCL(task.params, outputFile=task.fclFile)
+    if task.eventIds is not None:
+        with open(task.fclFile, 'a') as f:
+            f.write(renderEventSelection(task.eventIds))
+
+def runLarStage(task: RunTask, inputFile: str) -> Dict[str, Any]:
+    """Run lar on the generated FCL file of a parameter set.
+    
+    Args:
+        task: Parameter set and file names to use
+        inputFile: Path to input ROOT file or file list, unless the task has its own lar input
+        
+    Returns:
+        Resource usage of the lar job, as filled in by run()
+    """
+    costs = {}
+    status = run(task.fclFile, task.larInput or inputFile, task.outputFile, options=task.options, costs=costs)
+    if status != 0:
+        raise RuntimeError(f"lar exited with status {status} for {task.fclFile}")
+    return costs
+
+def runGalleryStage(task: RunTask, mc: bool) -> Optional[List[List[float]]]:
+    """Analyse the lar output of a parameter set with the loaded gallery macro.
+    
+    Args:
+        task: Parameter set and file names to use
+        mc: Whether to use the galleryMC analysis
+        
+    Returns:
+        Ratio results from galleryMC for MC, otherwise None
+    """
+    if mc:
+        results = r.galleryMC(task.outputFile, task.histFile, task.dumpFile or "")
+        return [[float(v) for v in row] for row in results]
+    r.galleryMacro(task.outputFile, task.histFile)
+    return None
+
+def _prepareTask(db: 'HitTuningDB', task: RunTask, mc: bool) -> None:
+    """Write the FCL file of a registered task and journal it."""
+    if task.state == 'registered':
+        writeTaskFCL(task, mc)
+        task.state = 'generated'
+        db.set_manifest_state(task.runId, task.state)
+
+def _completeStage(db: 'HitTuningDB', task: RunTask, stage: str, results: Any = None) -> None:
+    """Journal a finished lar or gallery stage; lar costs and gallery results are committed right away."""
+    if stage == 'lar':
+        if results:
+            db.update_costs(task.runId, results)
+        task.state = 'lar_done'
+        db.set_manifest_state(task.runId, task.state)
+        db.flush()
+        return
+    task.state = 'gallery_done'
+    task.results = results
+    db.set_manifest_state(task.runId, task.state, results=results)
+    if results is not None:
+        print(f"results for parameter set {task.index}:", results)
+    storeTaskResults(db, task, results)
+    task.state = 'stored'
+    db.set_manifest_state(task.runId, task.state)
+    db.flush()
+
+def _initWorker(mc: bool) -> None:
+    """Load the gallery macro once in each worker process of the local pool."""
+    r.gROOT.SetBatch(True)
+    loadMacro(mc)
+
+def runParallel(tasks: List[RunTask], inputFile: str, mc: bool, db: 'HitTuningDB', jobs: int) -> None:
+    """Process parameter sets concurrently in a bounded pool of worker processes.
+    
+    The lar and gallery stages of each parameter set are submitted to the pool
+    separately, so the manifest records each finished stage. The calling process
+    writes the FCL files and is the only database writer; a failing parameter
+    set does not stop the others.
+    
+    Args:
+        tasks: Parameter sets to process, already registered in the database
+        inputFile: Path to input ROOT file or file list
+        mc: Whether to use the MC FCL and galleryMC analysis
+        db: Database to store results in
+        jobs: Maximum number of concurrent worker processes
+    """
+    # spawn rather than fork so each worker gets a clean ROOT interpreter
+    ctx = multiprocessing.get_context('spawn')
+    nDone = 0
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx,
+                             initializer=_initWorker, initargs=(mc,)) as pool:
+        stages = {}
+
+        def submitNext(task: RunTask) -> None:
+            if task.state == 'generated':
+                stages[pool.submit(runLarStage, task, inputFile)] = (task, 'lar')
+            elif task.state == 'lar_done':
+                stages[pool.submit(runGalleryStage, task, mc)] = (task, 'gallery')
+            elif task.state == 'gallery_done':
+                _completeStage(db, task, 'gallery', task.results)
+
+        for task in tasks:
+            try:
+                _prepareTask(db, task, mc)
+                submitNext(task)
+            except Exception as e:
+                print(f"Error processing parameter set {task.index}: {e}")
+                db.set_manifest_state(task.runId, task.state, error=str(e))
+                db.flush()
+
+        while stages:
+            done, _ = wait(stages, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, stage = stages.pop(future)
+                try:
+                    _completeStage(db, task, stage, future.result())
+                    submitNext(task)
+                except Exception as e:
+                    print(f"Error processing parameter set {task.index}: {e}")
+                    db.set_manifest_state(task.runId, task.state, error=str(e))
+                    db.flush()
+                    nDone += 1
+                    continue
+                if task.state == 'stored':
+                    nDone += 1
+                    print(f"Finished parameter set {task.index} ({nDone}/{len(tasks)})")
+
+def _timedStage(stage, *args) -> Tuple[float, Any]:
+    """Run a stage function and return its wall time along with its result."""
+    start = time.perf_counter()
+    result = stage(*args)
+    return time.perf_counter() - start, result
+
+def runPipeline(tasks: List[RunTask], inputFile: str, mc: bool, db: 'HitTuningDB', larJobs: int = 1,
+                galleryJobs: int = 1, maxInFlight: Optional[int] = None) -> Dict[str, float]:
+    """Process parameter sets as a pipeline of FCL, lar, gallery and database stages.
+    
+    lar runs in a thread pool (each call waits on its own lar process) and the
+    gallery macro in a pool of spawned processes, so lar for one parameter set
+    runs while gallery analyses the previous one and the calling process
+    writes FCL files and stores finished results. At most maxInFlight parameter
+    sets are between lar start and stored results at any time, which bounds
+    the number of lar output files waiting for gallery.
+    
+    Args:
+        tasks: Parameter sets to process, already registered in the database
+        inputFile: Path to input ROOT file or file list
+        mc: Whether to use the MC FCL and galleryMC analysis
+        db: Database to store results in
+        larJobs: Number of concurrent lar processes
+        galleryJobs: Number of gallery worker processes
+        maxInFlight: Maximum number of parameter sets in flight (default: larJobs + galleryJobs + 1)
+        
+    Returns:
+        Utilisation of each stage: busy time / (wall time * workers)
+    """
+    maxInFlight = maxInFlight or larJobs + galleryJobs + 1
+    workers = {'fcl': 1, 'lar': larJobs, 'gallery': galleryJobs, 'db': 1}
+    busy = {stage: 0.0 for stage in workers}
+    pending = deque(tasks)
+    stages = {}
+    inFlight = 0
+    nDone = 0
+    start = time.perf_counter()
+
+    # spawn rather than fork so each gallery worker gets a clean ROOT interpreter
+    ctx = multiprocessing.get_context('spawn')
+    with ThreadPoolExecutor(max_workers=larJobs) as larPool, \
+         ProcessPoolExecutor(max_workers=galleryJobs, mp_context=ctx,
+                             initializer=_initWorker, initargs=(mc,)) as galleryPool:
+
+        def store(task: RunTask, stage: str, results: Optional[List[List[float]]]) -> None:
+            t = time.perf_counter()
+            _completeStage(db, task, stage, results)
+            if task.state == 'stored':
+                db.flush()
+            busy['db'] += time.perf_counter() - t
+
+        def submitNext(task: RunTask) -> None:
+            if task.state == 'generated':
+                stages[larPool.submit(_timedStage, runLarStage, task, inputFile)] = (task, 'lar')
+            elif task.state == 'lar_done':
+                stages[galleryPool.submit(_timedStage, runGalleryStage, task, mc)] = (task, 'gallery')
+            elif task.state == 'gallery_done':
+                store(task, 'gallery', task.results)
+
+        def fail(task: RunTask, e: Exception) -> None:
+            print(f"Error processing parameter set {task.index}: {e}")
+            db.set_manifest_state(task.runId, task.state, error=str(e))
+            db.flush()
+
+        def admit() -> None:
+            nonlocal inFlight
+            while pending and inFlight < maxInFlight:
+                task = pending.popleft()
+                try:
+                    t = time.perf_counter()
+                    _prepareTask(db, task, mc)
+                    busy['fcl'] += time.perf_counter() - t
+                    submitNext(task)
+                except Exception as e:
+                    fail(task, e)
+                    continue
+                if task.state != 'stored':
+                    inFlight += 1
+
+        admit()
+        while stages:
+            done, _ = wait(stages, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, stage = stages.pop(future)
+                try:
+                    elapsed, results = future.result()
+                    busy[stage] += elapsed
+                    store(task, stage, results)
+                    submitNext(task)
+                except Exception as e:
+                    fail(task, e)
+                    inFlight -= 1
+                    nDone += 1
+                    continue
+                if task.state == 'stored':
+                    inFlight -= 1
+                    nDone += 1
+                    print(f"Finished parameter set {task.index} ({nDone}/{len(tasks)})")
+            admit()
+
+    wall = time.perf_counter() - start
+    utilisation = {stage: busy[stage] / (wall * workers[stage]) if wall > 0 else 0.0 for stage in workers}
+    print(f"Pipeline processed {nDone} parameter sets in {wall:.1f} s")
+    for stage in workers:
+        print(f"  {stage:8s} busy {busy[stage]:8.1f} s on {workers[stage]} worker(s): "
+              f"{100 * utilisation[stage]:5.1f}% utilised")
+    print(f"Bottleneck stage: {max(utilisation, key=utilisation.get)}")
+    return utilisation
+
+def splitPackedCosts(costs: Dict[str, Any], suffixes: List[str]) -> List[Dict[str, Any]]:
+    """Share the costs of a packed lar job between its configurations.
+    
+    The wall and CPU time are divided evenly, so they are the amortised cost
+    of one configuration; the peak RSS is that of the whole job. Each
+    configuration gets the module costs of its own modules, with the label
+    suffix removed.
+    
+    Args:
+        costs: Costs of the packed lar job, as filled in by run()
+        suffixes: Module label suffix of each configuration
+        
+    Returns:
+        Costs of each configuration, in the order of suffixes
+    """
+    if not costs:
+        return [{} for _ in suffixes]
+    shared = {key: costs[key] / len(suffixes) for key in ('wall_time', 'cpu_time')}
+    split = []
+    for suffix in suffixes:
+        modules = {label[:-len(suffix)]: module for label, module in costs.get('modules', {}).items()
+                   if label.endswith(suffix)}
+        split.append(dict(shared, max_rss_mb=costs['max_rss_mb'], modules=modules))
+    return split
+
+def runPackedLar(paramSets: List[fclParams], fclFile: str, inputFile: str, outputFile: str, histFile: str,
+                 options: Optional[str] = None, eventIds: Optional[List[Tuple[int, int, int]]] = None
+                 ) -> Tuple[List[List[List[float]]], List[Dict[str, Any]]]:
+    """Run several hit finder configurations in one lar job and analyse them in one gallery pass.
+    
+    Args:
+        paramSets: FCL parameters of each configuration
+        fclFile: Path of the packed FCL file to write
+        inputFile: Path to input ROOT file or file list
+        outputFile: Path to the lar output ROOT file
+        histFile: Path to the histogram ROOT file, with one directory per configuration
+        options: Additional command-line options for lar command
+        eventIds: Only process these (run, subrun, event) IDs (default: all events)
+        
+    Returns:
+        Tuple of (galleryMC results matrix, costs) for each configuration
+    """
+    suffixes = generateFCLPacked(paramSets, fclFile)
+    if eventIds is not None:
+        with open(fclFile, 'a') as f:
+            f.write(renderEventSelection(eventIds))
+    costs = {}
+    status = run(fclFile, inputFile, outputFile, options=options, costs=costs)
+    if status != 0:
+        raise RuntimeError(f"lar exited with status {status} for {fclFile}")
+    results = r.galleryMCPacked(outputFile, histFile, r.std.vector['std::string'](suffixes))
+    return [[[float(v) for v in row] for row in matrix] for matrix in results], splitPackedCosts(costs, suffixes)
+
+def runPacked(db: 'HitTuningDB', tasks: List[RunTask], inputFile: str, packSize: int) -> None:
+    """Process registered MC tasks in groups of packSize, each group in one packed lar job.
+    
+    Every task still gets its own FCL file and manifest entry, so an
+    interrupted group is resumed (by --resume) one configuration at a time.
+    galleryMCPacked only fills the energy histograms of each configuration
+    and writes no hit-truth dump, so the runs of a group get PACKED_NOTE.
+    
+    Args:
+        db: Database to store results in
+        tasks: Tasks returned by registerTasks
+        inputFile: Path to input ROOT file or file list
+        packSize: Number of configurations per lar job
+    """
+    for start in range(0, len(tasks), packSize):
+        pack = tasks[start:start + packSize]
+        first = pack[0]
+        outputDir = os.path.dirname(first.outputFile)
+        fclFile = os.path.join(outputDir, f'hitTuning_{first.tag}_pack{first.version}.fcl')
+        outputFile = os.path.join(outputDir, f'output_{first.tag}_pack{first.version}.root')
+        histFile = os.path.join(outputDir, f'hist_output_{first.tag}_pack{first.version}.root')
+        try:
+            for task in pack:
+                _prepareTask(db, task, True)
+            results, costs = runPackedLar([task.params for task in pack], fclFile, inputFile,
+                                          outputFile, histFile, first.options, first.eventIds)
+        except Exception as e:
+            print(f"Error processing parameter sets {pack[0].index}-{pack[-1].index}: {e}")
+            for task in pack:
+                db.set_manifest_state(task.runId, task.state, error=str(e))
+            db.flush()
+            continue
+
+        for task, taskResults, taskCosts in zip(pack, results, costs):
+            if taskCosts:
+                db.update_costs(task.runId, taskCosts)
+            db.update_notes(task.runId, '; '.join(filter(None, [task.selection, PACKED_NOTE])))
+            task.outputFile, task.histFile, task.dumpFile = outputFile, histFile, None
+            _completeStage(db, task, 'gallery', taskResults)
+        db.flush()
+        print(f"Finished {len(pack)} packed parameter sets in {fclFile} ({start + len(pack)}/{len(tasks)})")
+
+def storeTaskResults(db: 'HitTuningDB', task: RunTask, results: Optional[List[List[float]]]) -> None:
+    """Record the output files and results of a finished parameter set.
+    
+    The histogram file is recorded last, which marks the run as complete for
+    the run cache.
+    
+    Args:
+        db: Database to store results in
+        task: Finished parameter set
+        results: Ratio results from galleryMC, or None for data
+    """
+    db.update_output_filename(task.runId, task.outputFile)
+    if results is not None:
+        db.update_results(task.runId, results)
+        if task.dumpFile:
+            db.update_dump_filename(task.runId, task.dumpFile)
+    db.update_hist_filename(task.runId, task.histFile)
+
+def buildTasks(db: 'HitTuningDB', paramSets: List[fclParams], outputDir: str, tag: str,
+               options: Optional[str] = None) -> List[RunTask]:
+    """Assign unique versioned FCL/output/histogram file names to parameter sets.
+    
+    Versions continue from the run manifest of the tag. Only a tag without
+    manifest entries falls back to listing the output directory once, so
+    files written before the manifest existed are not overwritten.
+    
+    Args:
+        db: Database holding the run manifest
+        paramSets: Parameter sets to run
+        outputDir: Directory for the FCL and ROOT files
+        tag: Tag for output files
+        options: Additional lar options
+        
+    Returns:
+        One RunTask per parameter set
+    """
+    version = db.next_manifest_version(tag)
+    if version is None:
+        pattern = re.compile(rf'^hitTuning_{re.escape(tag)}_(\d+)\.fcl$')
+        versions = [int(m.group(1)) for m in map(pattern.match, os.listdir(outputDir)) if m]
+        version = max(versions) + 1 if versions else 0
+
+    tasks = []
+    for ip, params in enumerate(paramSets):
+        tasks.append(RunTask(ip, params,
+                             f'{outputDir}/hitTuning_{tag}_{version}.fcl',
+                             f'{outputDir}/output_{tag}_{version}.root',
+                             f'{outputDir}/hist_output_{tag}_{version}.root',
+                             options=options, tag=tag, version=version,
+                             dumpFile=f'{outputDir}/truth_{tag}_{version}.root'))
+        version += 1
+    return tasks
+
+def registerTasks(db: 'HitTuningDB', tasks: List[RunTask], inputFile: str, mc: bool, jobNum: int,
+                  useCache: bool = True) -> List[RunTask]:
+    """Add tasks to the database and run manifest, resolving those already run from the run cache.
+    
+    Tasks with a cached run get that run's ID and are not returned.
+    
+    Args:
+        db: Database to register the runs in
+        tasks: Tasks from buildTasks
+        inputFile: Path to input ROOT file or file list
+        mc: Whether the MC FCL and galleryMC analysis are used
+        jobNum: Job number stored with each run
+        useCache: Whether to look up identical completed runs
+        
+    Returns:
+        Tasks that still need to be processed
+    """
+    pending = []
+    for task in tasks:
+        task.cacheKey = runCacheKey(task.params, inputFile, task.options, mc, selection=task.selection)
+        cached = db.find_cached_run(task.cacheKey) if useCache else None
+        if cached is not None:
+            print(f"Parameter set {task.index} already processed as run ID {cached[0]}, results:", cached[1])
+            task.runId = cached[0]
+            continue
+        pending.append(task)
+
+    for task in pending:
+        nEvents = eventsFromOptions(task.options)
+        if task.eventIds is not None:
+            # -n still caps the events read, so at most that many selected events are processed
+            nEvents = len(task.eventIds) if nEvents < 0 else min(nEvents, len(task.eventIds))
+        task.runId = db.add_run(task.params, jobNum, task.fclFile, notes=task.selection or "",
+                                cache_key=task.cacheKey, nEvents=nEvents)
+        db.add_manifest_entry(task.runId, task.tag, task.version, task.params, task.options,
+                              task.fclFile, task.outputFile, task.histFile, task.dumpFile, task.hitsOnly,
+                              task.selection, task.eventIds)
+        task.state = 'registered'
+        print(f"Added run with ID: {task.runId}")
+    db.flush()
+    return pending
+
+def resumeTasks(db: 'HitTuningDB', tag: str) -> List[RunTask]:
+    """Rebuild the tasks of a tag that an earlier session did not finish.
+    
+    Each task restarts after its last journaled stage. Only the files that
+    stage depends on are checked; a missing one sends the task back a stage.
+    
+    Args:
+        db: Database holding the run manifest
+        tag: Tag of the output files
+        
+    Returns:
+        Tasks to pass to runTasks
+    """
+    tasks = []
+    for entry in db.get_unfinished_manifest(tag):
+        task = RunTask(len(tasks), fclParams(**json.loads(entry['params'])), entry['fcl_filename'],
+                       entry['output_filename'], entry['hist_filename'], options=entry['options'],
+                       tag=tag, version=entry['version'], dumpFile=entry['dump_filename'])
+        task.runId = entry['run_id']
+        task.state = entry['state']
+        task.hitsOnly = bool(entry['hits_only'])
+        task.selection = entry['selection']
+        if entry['event_ids'] is not None:
+            task.eventIds = [tuple(eventId) for eventId in json.loads(entry['event_ids'])]
+        if task.state == 'gallery_done' and entry['results'] is not None:
+            task.results = json.loads(entry['results'])
+        if task.state == 'lar_done' and not os.path.exists(task.outputFile):
+            task.state = 'generated'
+        if task.state == 'generated' and not os.path.exists(task.fclFile):
+            task.state = 'registered'
+        tasks.append(task)
+    print(f"Resuming {len(tasks)} unfinished parameter sets of tag {tag}: " +
+          ', '.join(f"{state} {sum(t.state == state for t in tasks)}" for state in HitTuningDB.MANIFEST_STATES[:-1]))
+    return tasks
+
+def runTasks(tasks: List[RunTask], inputFile: str, mc: bool, db: 'HitTuningDB', jobs: int = 1,
+             galleryJobs: int = 0, maxInFlight: Optional[int] = None, costDBs: Optional[List[str]] = None,
+             costMetric: str = 'wall_time') -> None:
+    """Process registered tasks, in parallel if jobs > 1, journaling every finished stage.
+    
+    Args:
+        tasks: Tasks returned by registerTasks or resumeTasks
+        inputFile: Path to input ROOT file or file list
+        mc: Whether to use the MC FCL and galleryMC analysis
+        db: Database to store results in
+        jobs: Maximum number of concurrent worker processes (lar processes in pipeline mode)
+        galleryJobs: If > 0, run the stages as a pipeline with this many gallery processes
+        maxInFlight: Maximum number of parameter sets in flight in pipeline mode
+        costDBs: If given, start the tasks longest predicted processing time first, predicted
+                 from the timed runs in these databases, and report the predicted makespan
+        costMetric: Cost column predicted with costDBs
+    """
+    if costDBs is not None and tasks:
+        scheduled, predictions, slots = scheduleTasks(tasks, jobs, costDBs, costMetric)
+        start = time.time()
+        runTasks(scheduled, inputFile, mc, db, jobs, galleryJobs, maxInFlight)
+        reportTaskMakespan(db, tasks, predictions, slots, time.time() - start, costMetric)
+        return
+    if galleryJobs > 0:
+        runPipeline(tasks, inputFile, mc, db, jobs, galleryJobs, maxInFlight)
+        return
+    if jobs > 1:
+        runParallel(tasks, inputFile, mc, db, jobs)
+        return
+    for task in tasks:
+        try:
+            _prepareTask(db, task, mc)
+            if task.state == 'generated':
+                _completeStage(db, task, 'lar', runLarStage(task, inputFile))
+            if task.state == 'lar_done':
+                _completeStage(db, task, 'gallery', runGalleryStage(task, mc))
+            elif task.state == 'gallery_done':
+                _completeStage(db, task, 'gallery', task.results)
+            
+            # Query runs
+            print(f"Total runs in database: {db.count_runs()}")
+        
+        except Exception as e:
+            print(f"Error processing parameter set {task.index}: {e}")
+            db.set_manifest_state(task.runId, task.state, error=str(e))
+            db.flush()
+            continue
+
+# lar options of the grid jobs run by runJob.sh
+GRID_OPTIONS = '-n 5'
+
+def paramFeatures(params: fclParams) -> List[float]:
+    """Return the parameters of a configuration in the column order of scheduler.PARAM_COLUMNS."""
+    return (params.roiThreshold + params.minPulseHeight + params.minPulseSigma + params.LongMaxHits +
+            params.LongPulseWidth + params.PulseHeightCuts + params.PulseWidthCuts + params.PulseRatioCuts +
+            [params.MaxMultiHit, params.Chi2NDF])
+
+def scheduleGrid(grid: 'ParamGrid', nJobs: int, costDBs: List[str], manifestPath: str,
+                 metric: str = 'wall_time') -> Dict[int, float]:
+    """Pack the grid configurations into grid jobs by predicted cost and write the job manifest.
+
+    The cost of each configuration is predicted from the recorded costs of the
+    most similar configurations in costDBs (see scheduler.CostModel), and the
+    configurations are packed longest-processing-time first into nJobs jobs.
+    runJob.sh runs the grid indices listed for its job in the manifest.
+
+    Args:
+        grid: Parameter grid from createGrid
+        nJobs: Number of grid jobs
+        costDBs: hitTuning databases with timed runs, e.g. a merged earlier grid
+        manifestPath: Path of the job manifest to write
+        metric: Cost column to predict, 'wall_time' or 'cpu_time'
+
+    Returns:
+        Predicted cost of each grid index in seconds
+    """
+    from scheduler import CostModel, loadHistory, lptPack, writeSchedule
+
+    model = CostModel(*loadHistory(costDBs, metric, nEvents=eventsFromOptions(GRID_OPTIONS)))
+    if not len(model):
+        print(f"Warning: no timed runs in {costDBs}, all configurations are assumed to cost the same")
+    costs = model.predict([paramFeatures(params) for params in grid])
+    predictions = dict(enumerate(costs))
+    slots, loads = lptPack(predictions, nJobs)
+    recordPath = writeSchedule(manifestPath, slots, loads, predictions, metric)
+
+    makespan = max(loads, default=0.0)
+    print(f"Packed {len(predictions)} configurations into {len(slots)} jobs from {len(model)} timed runs: "
+          f"predicted makespan {makespan:.0f} s, mean job {sum(loads) / max(len(loads), 1):.0f} s, "
+          f"longest configuration {max(costs, default=0.0):.0f} s")
+    print(f"Wrote job manifest {manifestPath} and predictions {recordPath}")
+    return predictions
+
+def scheduleTasks(tasks: List[RunTask], jobs: int, costDBs: List[str],
+                  metric: str = 'wall_time') -> Tuple[List[RunTask], Dict[int, float], List[List[int]]]:
+    """Order tasks longest predicted processing time first for the local executors.
+
+    Starting the most expensive parameter sets first makes the greedy worker
+    pools of runTasks follow the same LPT packing as scheduleGrid.
+
+    Args:
+        tasks: Registered tasks
+        jobs: Number of concurrent lar processes
+        costDBs: hitTuning databases with timed runs
+        metric: Cost column to predict, 'wall_time' or 'cpu_time'
+
+    Returns:
+        Tuple of (reordered tasks, predicted cost by task index, predicted task indices of each slot)
+    """
+    from scheduler import CostModel, loadHistory, lptPack
+
+    nEvents = eventsFromOptions(tasks[0].options) if tasks else None
+    model = CostModel(*loadHistory(costDBs, metric, nEvents=nEvents))
+    predictions = dict(zip((task.index for task in tasks),
+                           model.predict([paramFeatures(task.params) for task in tasks])))
+    slots, _ = lptPack(predictions, jobs)
+    tasks = sorted(tasks, key=lambda task: -predictions[task.index])
+    print(f"Ordered {len(tasks)} parameter sets by predicted {metric} from {len(model)} timed runs")
+    return tasks, predictions, slots
+
+def reportTaskMakespan(db: 'HitTuningDB', tasks: List[RunTask], predictions: Dict[int, float],
+                       slots: List[List[int]], elapsed: float, metric: str = 'wall_time') -> None:
+    """Print the predicted against the actual makespan of a local run ordered by scheduleTasks."""
+    from scheduler import reportMakespan
+
+    db.flush()
+    cursor = db.conn.cursor()
+    actual = {}
+    for task in tasks:
+        cursor.execute(f'SELECT {metric} FROM runs WHERE id = ?', (task.runId,))
+        row = cursor.fetchone()
+        if row is not None and row[0] is not None:
+            actual[task.index] = row[0]
+    reportMakespan(slots, predictions, actual, actualMakespan=elapsed)
+
+# Particle classes of the galleryMC results matrix, after the total row, with the |PDG| codes of each
+PARTICLE_CLASSES = [('ele', (11,)), ('gamma', (22,)), ('mu', (13,)), ('p', (2212,)), ('pi', (211, 111))]
+
+def computeRatios(dumpFile: str, ideFractionCut: Optional[float] = None,
+                  classes: List[Tuple[str, Tuple[int, ...]]] = PARTICLE_CLASSES) -> List[List[float]]:
+    """Compute the galleryMC ratio matrix from a hit-truth dump.
+    
+    Reproduces the galleryMC sums with array operations: an event belongs to a
+    class if any hit matched to a particle of that class deposits energy, the
+    hit energy of an event is the sum of energy * ideFraction over all its
+    matched hits, and the ratios are formed from the sums over the events of
+    each class (the total row uses events of any class).
+    
+    Args:
+        dumpFile: ROOT file with the hitTruth and ideTruth trees written by galleryMC
+        ideFractionCut: Only count hits with an ideFraction above this value in the
+                        hit energy (default: all hits, as galleryMC does)
+        classes: (name, PDG codes) of the particle classes
+        
+    Returns:
+        Ratio matrix in the format of HitTuningDB.update_results
+    """
+    import numpy as np
+    import uproot
+
+    with uproot.open(dumpFile) as f:
+        hits = f['hitTruth'].arrays(['event', 'plane', 'pdg', 'energy', 'ideFraction'], library='np')
+        ides = f['ideTruth'].arrays(['event', 'plane', 'energy'], library='np')
+
+    planes = 3
+    nEvents = int(ides['event'].max()) + 1 if len(ides['event']) else 0
+    slot = ides['event'].astype(np.int64) * planes + ides['plane']
+    ideEnergy = np.bincount(slot, weights=ides['energy'], minlength=nEvents * planes).reshape(nEvents, planes)
+
+    slot = hits['event'].astype(np.int64) * planes + hits['plane']
+    weights = hits['energy'].astype(np.float64) * hits['ideFraction']
+    if ideFractionCut is not None:
+        weights = np.where(hits['ideFraction'] > ideFractionCut, weights, 0.0)
+    hitEnergy = np.bincount(slot, weights=weights, minlength=nEvents * planes).reshape(nEvents, planes)
+
+    pdg = np.abs(hits['pdg'])
+    deposited = hits['energy'] > 0
+    flags = []
+    for _, codes in classes:
+        matched = deposited & np.isin(pdg, codes)
+        flags.append(np.bincount(hits['event'][matched], minlength=nEvents) > 0)
+    flags.insert(0, np.logical_or.reduce(flags) if flags else np.zeros(nEvents, dtype=bool))
+
+    results = []
+    for flag in flags:
+        hitSum = hitEnergy[flag].sum(axis=0)
+        ideSum = ideEnergy[flag].sum(axis=0)
+        row = [hitSum.sum() / ideSum.sum() if ideSum.sum() != 0 else 0.0]
+        row += [h / i if i != 0 else 0.0 for h, i in zip(hitSum, ideSum)]
+        results.append([float(v) for v in row])
+    return results
+
+def _recomputeWorker(job: Tuple[int, str, Optional[float]]) -> Tuple[int, Optional[List[List[float]]], Optional[str]]:
+    run_id, dumpFile, ideFractionCut = job
+    try:
+        return run_id, computeRatios(dumpFile, ideFractionCut), None
+    except Exception as e:
+        return run_id, None, str(e)
+
+def recomputeRatios(db: 'HitTuningDB', ideFractionCut: Optional[float] = None, store: bool = False,
+                    jobs: Optional[int] = None) -> Dict[int, List[List[float]]]:
+    """Recompute the ratio matrix of every run with a hit-truth dump.
+    
+    Args:
+        db: Database with the runs
+        ideFractionCut: ideFraction cut passed to computeRatios
+        store: Overwrite the stored ratios of the runs with the recomputed ones
+        jobs: Number of worker processes (default: number of CPUs)
+        
+    Returns:
+        Dictionary of run ID to recomputed ratio matrix
+    """
+    start = time.time()
+    db.flush()
+    cursor = db.conn.cursor()
+    cursor.execute('SELECT id, dump_filename FROM runs WHERE dump_filename IS NOT NULL ORDER BY id')
+    work = [(run_id, dumpFile, ideFractionCut) for run_id, dumpFile in cursor.fetchall()]
+    if not work:
+        print("No runs with a hit-truth dump in the database")
+        return {}
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(work) > 1:
+        with multiprocessing.Pool(min(jobs, len(work))) as pool:
+            computed = pool.map(_recomputeWorker, work, chunksize=max(1, len(work) // (4 * jobs)))
+    else:
+        computed = [_recomputeWorker(job) for job in work]
+
+    recomputed = {}
+    for run_id, results, error in computed:
+        if error is not None:
+            print(f"Error recomputing run {run_id}: {error}")
+            continue
+        recomputed[run_id] = results
+        if store:
+            db.update_results(run_id, results)
+        else:
+            print(f"Run {run_id}: total ratio {results[0][0]:.4f} "
+                  f"(planes {results[0][1]:.4f}, {results[0][2]:.4f}, {results[0][3]:.4f})")
+    db.flush()
+
+    elapsed = time.time() - start
+    print(f"Recomputed ratios of {len(recomputed)} runs in {elapsed:.1f} s"
+          + (f" with ideFraction > {ideFractionCut}" if ideFractionCut is not None else ""))
+    return recomputed
+
+def summarizeHistograms(histFile: str) -> Dict[str, Dict[str, Optional[float]]]:
+    """Compute summary statistics of every 1D histogram in a ROOT file with uproot.
+    
+    The mean and RMS come from the stored fill statistics, as TH1::GetMean and
+    TH1::GetRMS return them. The quantiles interpolate linearly within bins of
+    the in-range contents, as TH1::GetQuantiles does.
+    
+    Args:
+        histFile: Histogram file written by the gallery macro
+        
+    Returns:
+        Statistics (HIST_SUMMARY_COLUMNS) of each histogram, keyed by its path in
+        the file, e.g. 'h_hitFit_plane0' or 'k1/h_energyRatio_ele_plane2' for packed jobs
+    """
+    import numpy as np
+    import uproot
+
+    summaries = {}
+    with uproot.open(histFile) as f:
+        for name, className in f.classnames(cycle=False).items():
+            if not className.startswith('TH1'):
+                continue
+            hist = f[name]
+            values = np.asarray(hist.values(flow=True), dtype=np.float64)
+            edges = np.asarray(hist.axis().edges(), dtype=np.float64)
+            contents = values[1:-1]
+            sumw = float(hist.member('fTsumw'))
+            if sumw != 0:
+                mean = float(hist.member('fTsumwx')) / sumw
+                variance = float(hist.member('fTsumwx2')) / sumw - mean ** 2
+            else:
+                # Histograms filled with SetBinContent have no fill statistics
+                sumw = float(contents.sum())
+                centers = 0.5 * (edges[:-1] + edges[1:])
+                mean = variance = None
+                if sumw != 0:
+                    mean = float((contents * centers).sum()) / sumw
+                    variance = float((contents * centers ** 2).sum()) / sumw - mean ** 2
+
+            cumulative = np.cumsum(contents)
+            quantiles = [None] * len(HIST_QUANTILES)
+            if len(cumulative) and cumulative[-1] > 0:
+                targets = np.asarray(HIST_QUANTILES) * cumulative[-1]
+                bins = np.minimum(np.searchsorted(cumulative, targets), len(contents) - 1)
+                below = cumulative[bins] - contents[bins]
+                fraction = np.clip((targets - below) / np.where(contents[bins] > 0, contents[bins], 1.0), 0.0, 1.0)
+                quantiles = [float(q) for q in edges[bins] + fraction * (edges[bins + 1] - edges[bins])]
+
+            stats = dict(zip(HIST_QUANTILE_COLUMNS, quantiles))
+            stats.update(entries=float(hist.member('fEntries')), sum_weights=sumw, mean=mean,
+                         rms=math.sqrt(max(variance, 0.0)) if variance is not None else None,
+                         underflow=float(values[0]), overflow=float(values[-1]))
+            summaries[name] = stats
+    return summaries
+
+def _histSummaryWorker(histFile: str) -> Tuple[str, Optional[Dict[str, Dict[str, Optional[float]]]], Optional[str]]:
+    try:
+        return histFile, summarizeHistograms(histFile), None
+    except Exception as e:
+        return histFile, None, str(e)
+
+def ingestHistSummaries(db: 'HitTuningDB', histDir: Optional[str] = None, rescan: bool = False,
+                        jobs: Optional[int] = None) -> int:
+    """Summarise the histogram files of all runs into the hist_summary table in parallel.
+    
+    Each histogram file is read once, also when several packed runs share it.
+    
+    Args:
+        db: Database with the runs
+        histDir: Directory tree to look up histogram files that are not found at their
+                 recorded path, e.g. the outputs/ directory of a grid
+        rescan: Also summarise runs that already have histogram summaries
+        jobs: Number of worker processes (default: number of CPUs)
+        
+    Returns:
+        Number of runs summarised
+    """
+    start = time.time()
+    db.flush()
+    cursor = db.conn.cursor()
+    query = 'SELECT id, hist_filename FROM runs WHERE hist_filename IS NOT NULL'
+    if not rescan:
+        query += ' AND id NOT IN (SELECT DISTINCT run_id FROM hist_summary)'
+    cursor.execute(query + ' ORDER BY id')
+    runs = cursor.fetchall()
+
+    # Grid runs record the file name in the job's working directory
+    found = {}
+    if histDir is not None:
+        for root, _, files in os.walk(histDir):
+            for name in files:
+                found.setdefault(name, os.path.join(root, name))
+    runsByFile: Dict[str, List[int]] = {}
+    missing = 0
+    for run_id, histFile in runs:
+        path = histFile if os.path.exists(histFile) else found.get(os.path.basename(histFile))
+        if path is None:
+            missing += 1
+            continue
+        runsByFile.setdefault(path, []).append(run_id)
+    if missing:
+        print(f"Warning: histogram files of {missing} runs not found")
+    if not runsByFile:
+        print("No histogram files to summarise")
+        return 0
+
+    histFiles = list(runsByFile)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(histFiles) > 1:
+        with multiprocessing.Pool(min(jobs, len(histFiles))) as pool:
+            summarized = pool.imap_unordered(_histSummaryWorker, histFiles,
+                                             chunksize=max(1, len(histFiles) // (4 * jobs)))
+            nRuns, nHists = _storeHistSummaries(db, runsByFile, summarized)
+    else:
+        nRuns, nHists = _storeHistSummaries(db, runsByFile, map(_histSummaryWorker, histFiles))
+    db.flush()
+
+    elapsed = time.time() - start
+    print(f"Summarised {nHists} histograms of {nRuns} runs from {len(histFiles)} files in {elapsed:.1f} s "
+          f"({len(histFiles) / max(elapsed, 1e-9):.1f} files/s)")
+    return nRuns
+
+def _storeHistSummaries(db: 'HitTuningDB', runsByFile: Dict[str, List[int]], summarized) -> Tuple[int, int]:
+    """Write histogram summaries from _histSummaryWorker results as they arrive."""
+    nRuns = nHists = 0
+    for histFile, summaries, error in summarized:
+        if error is not None:
+            print(f"Error summarising {histFile}: {error}")
+            continue
+        for run_id in runsByFile[histFile]:
+            db.update_hist_summary(run_id, summaries)
+            nRuns += 1
+        nHists += len(summaries)
+    return nRuns, nHists
 
 def reduceList(inputList: List[Union[int, float]]) -> Union[List[Union[int, float]], int, float]:
     """Reduce single-element list to scalar value.
@@ -766,54 +3233,460 @@ def reduceList(inputList: List[Union[int, float]]) -> Union[List[Union[int, floa
         return inputList[0]
     return inputList
 
-def createGrid(defaultFirst: bool = True) -> List[fclParams]:
+class ParamGrid:
+    """Lazily enumerated Cartesian product of hit finding parameter values.
+    
+    Parameter sets are built on demand from their grid index, so a grid can be
+    counted, sliced, sharded and randomly accessed without materialising every
+    combination. Index order matches itertools.product over the axes, with the
+    default fclParams optionally inserted at index 0.
+    """
+
+    def __init__(self, axes: Dict[str, List[List[Union[int, float]]]], defaultFirst: bool = True) -> None:
+        """Initialize the grid.
+        
+        Args:
+            axes: Mapping of fclParams argument name to the list of values to scan
+            defaultFirst: Whether to insert default parameters at the start of grid
+        """
+        self.names: List[str] = list(axes.keys())
+        self.axes: List[List[List[Union[int, float]]]] = [axes[name] for name in self.names]
+        self.defaultFirst: bool = defaultFirst
+        self.nCombinations: int = 1
+        for axis in self.axes:
+            self.nCombinations *= len(axis)
+
+    def __len__(self) -> int:
+        return self.nCombinations + (1 if self.defaultFirst else 0)
+
+    def __iter__(self):
+        if self.defaultFirst:
+            yield fclParams()
+        for combo in product(*self.axes):
+            yield self._build(combo)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[fclParams, List[fclParams]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(f"Grid index {index} out of range for grid of size {len(self)}")
+        if self.defaultFirst:
+            if index == 0:
+                return fclParams()
+            index -= 1
+        return self._build(self.combination(index))
+
+    def combination(self, index: int) -> Tuple[List[Union[int, float]], ...]:
+        """Return the axis values for a combination index (excluding the default entry).
+        
+        Args:
+            index: Combination index in itertools.product order
+            
+        Returns:
+            Tuple with one value list per axis
+        """
+        combo = []
+        for axis in reversed(self.axes):
+            index, i = divmod(index, len(axis))
+            combo.append(axis[i])
+        return tuple(reversed(combo))
+
+    def indexOf(self, axisIndices: Tuple[int, ...]) -> int:
+        """Return the grid index of a combination given by one value index per axis.
+        
+        Args:
+            axisIndices: Index into each axis value list, in axis order
+            
+        Returns:
+            Grid index (including the default entry offset)
+        """
+        index = 0
+        for axis, i in zip(self.axes, axisIndices):
+            index = index * len(axis) + i
+        return index + (1 if self.defaultFirst else 0)
+
+    def shard(self, shardIndex: int, nShards: int):
+        """Yield (grid index, fclParams) pairs belonging to one shard of the grid.
+        
+        Shards are strided so neighbouring (similarly expensive) grid points are
+        spread over all shards.
+        
+        Args:
+            shardIndex: Shard to return, 0 <= shardIndex < nShards
+            nShards: Total number of shards
+        """
+        if nShards < 1 or not 0 <= shardIndex < nShards:
+            raise ValueError(f"Invalid shard {shardIndex}/{nShards}")
+        for index in range(shardIndex, len(self), nShards):
+            yield index, self[index]
+
+    def _build(self, combo: Tuple[List[Union[int, float]], ...]) -> fclParams:
+        return fclParams(**{name: reduceList(value) for name, value in zip(self.names, combo)})
+
+def createGrid(defaultFirst: bool = True) -> ParamGrid:
     """Create parameter grid for systematic hit tuning scan.
     
     Args:
         defaultFirst: Whether to insert default parameters at the start of grid
         
     Returns:
-        List of fclParams objects representing parameter combinations
+        ParamGrid lazily yielding fclParams objects for each parameter combination
     """
     print("Creating parameter grid for hit tuning...")
 
-    v_roiThreshold = [[6.0], [5.0], [4.0], [3.0], [2.0], [1.0]]  
-    v_minPulseHeight = [[2.0]]
-    v_minPulseSigma = [[1.0]]
-    v_LongMaxHits = [[1], [5], [10], [15]]
-    v_LongPulseWidth = [[2.0], [5.0], [8.0]]
-    v_PulseHeightCuts = [[2], [3]]
-    v_PulseWidthCuts = [[2, 1.5, 1]]  
-    v_PulseRatioCuts = [[3.5e-1, 4e-1, 2e-1]]
-    v_MaxMultiHit = [[5], [7], [10], [12]]
-    v_Chi2NDF = [[500.0], [1000.0], [1500.0], [2000.0], [2500.0]]
-
-    # Generate all combinations
-    param_grid = []
-    for combo in product(v_roiThreshold, v_minPulseHeight, v_minPulseSigma, 
-                        v_LongMaxHits, v_LongPulseWidth, v_PulseHeightCuts,
-                        v_PulseWidthCuts, v_PulseRatioCuts, v_MaxMultiHit, v_Chi2NDF):
-        
-        print(combo[0], combo[1], combo[2], combo[3], combo[4], combo[5], combo[6], combo[7], combo[8], combo[9])
-        params = fclParams(
-            roiThreshold=reduceList(combo[0]),
-            minPulseHeight=reduceList(combo[1]),
-            minPulseSigma=reduceList(combo[2]),
-            LongMaxHits=reduceList(combo[3]),
-            LongPulseWidth=reduceList(combo[4]),
-            PulseHeightCuts=reduceList(combo[5]),
-            PulseWidthCuts=reduceList(combo[6]),
-            PulseRatioCuts=reduceList(combo[7]),
-            MaxMultiHit=reduceList(combo[8]),
-            Chi2NDF=reduceList(combo[9])
-        )
-        param_grid.append(params)
+    paramGrid = ParamGrid({
+        'roiThreshold': [[6.0], [5.0], [4.0], [3.0], [2.0], [1.0]],
+        'minPulseHeight': [[2.0]],
+        'minPulseSigma': [[1.0]],
+        'LongMaxHits': [[1], [5], [10], [15]],
+        'LongPulseWidth': [[2.0], [5.0], [8.0]],
+        'PulseHeightCuts': [[2], [3]],
+        'PulseWidthCuts': [[2, 1.5, 1]],
+        'PulseRatioCuts': [[3.5e-1, 4e-1, 2e-1]],
+        'MaxMultiHit': [[5], [7], [10], [12]],
+        'Chi2NDF': [[500.0], [1000.0], [1500.0], [2000.0], [2500.0]],
+    }, defaultFirst=defaultFirst)
+
+    print(f"Created grid with {len(paramGrid)} parameter combinations")
+    return paramGrid
+
+def parseShard(shard: str) -> Tuple[int, int]:
+    """Parse a shard specification of the form 'i/N'.
+    
+    Args:
+        shard: Shard string, e.g. '3/10'
+        
+    Returns:
+        Tuple of (shard index, number of shards)
+    """
+    try:
+        i, n = (int(x) for x in shard.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must be given as i/N, got '{shard}'")
+    if n < 1 or not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"Shard index must satisfy 0 <= i < N, got '{shard}'")
+    return i, n
+
+def objectiveScore(ratio: Optional[float], target: float = 1.0) -> float:
+    """Score a galleryMC ratio result, larger is better.
     
-    if defaultFirst:
-        param_grid.insert(0, fclParams())  # Default parameters at the start
+    Args:
+        ratio: Hit to truth IDE energy ratio, negative for undefined ratios (-1, -2)
+        target: Ratio of a perfect hit finder
+        
+    Returns:
+        -|ratio - target|, or -inf for failed runs and undefined ratios
+    """
+    if ratio is None or ratio < 0:
+        return float('-inf')
+    return -abs(ratio - target)
+
+class TPEOptimizer:
+    """Tree-structured Parzen estimator over the axes of a ParamGrid.
+    
+    Observed grid points are split into the best `gamma` fraction and the rest.
+    Each axis gets a smoothed categorical density for both groups, candidates
+    are sampled from the density of the good points, and the candidates with
+    the largest good/bad density ratio are proposed. Points are tuples with
+    one value index per grid axis.
+    """
 
-    print(f"Created grid with {len(param_grid)} parameter combinations")
-    return param_grid
+    def __init__(self, grid: ParamGrid, gamma: float = 0.25, nStartup: int = 10,
+                 nCandidates: int = 64, seed: Optional[int] = None) -> None:
+        """Initialize the optimizer.
+        
+        Args:
+            grid: Search space; every axis is treated as a categorical variable
+            gamma: Fraction of observations treated as good
+            nStartup: Number of observations proposed uniformly at random first
+            nCandidates: Number of candidates sampled per proposed point
+            seed: Random seed
+        """
+        self.grid = grid
+        self.sizes: List[int] = [len(axis) for axis in grid.axes]
+        self.gamma = gamma
+        self.nStartup = nStartup
+        self.nCandidates = nCandidates
+        self.rng = random.Random(seed)
+        self.observations: Dict[Tuple[int, ...], float] = {}
+
+    def observe(self, point: Tuple[int, ...], score: float) -> None:
+        """Record the score of a grid point, keeping the best score of repeated points."""
+        self.observations[point] = max(score, self.observations.get(point, float('-inf')))
+
+    def best(self) -> Optional[Tuple[Tuple[int, ...], float]]:
+        """Return the best observed (point, score), or None before any observation."""
+        if not self.observations:
+            return None
+        return max(self.observations.items(), key=lambda item: item[1])
+
+    def params(self, point: Tuple[int, ...]) -> fclParams:
+        """Return the fclParams of a grid point."""
+        return self.grid._build(tuple(axis[i] for axis, i in zip(self.grid.axes, point)))
+
+    def suggest(self, n: int) -> List[Tuple[int, ...]]:
+        """Propose up to n distinct grid points that have not been observed yet.
+        
+        Args:
+            n: Number of points to propose
+            
+        Returns:
+            Proposed points, best first; fewer than n if the grid is exhausted
+        """
+        if len(self.observations) < self.nStartup:
+            return self._randomPoints(n, set())
+
+        ranked = sorted(self.observations.items(), key=lambda item: item[1], reverse=True)
+        nGood = max(1, int(math.ceil(self.gamma * len(ranked))))
+        good = self._densities([point for point, _ in ranked[:nGood]])
+        bad = self._densities([point for point, _ in ranked[nGood:]])
+
+        candidates = {}
+        for _ in range(self.nCandidates * n):
+            point = tuple(self.rng.choices(range(size), weights=weights)[0]
+                          for size, weights in zip(self.sizes, good))
+            if point in self.observations or point in candidates:
+                continue
+            candidates[point] = sum(math.log(l[i]) - math.log(g[i]) for l, g, i in zip(good, bad, point))
+
+        chosen = sorted(candidates, key=candidates.get, reverse=True)[:n]
+        if len(chosen) < n:
+            chosen += self._randomPoints(n - len(chosen), set(chosen))
+        return chosen
+
+    def _densities(self, points: List[Tuple[int, ...]]) -> List[List[float]]:
+        """Per-axis categorical densities of points, smoothed with a uniform prior."""
+        densities = []
+        for axis, size in enumerate(self.sizes):
+            counts = [1.0] * size
+            for point in points:
+                counts[point[axis]] += 1.0
+            total = sum(counts)
+            densities.append([c / total for c in counts])
+        return densities
+
+    def _randomPoints(self, n: int, exclude: set) -> List[Tuple[int, ...]]:
+        """Draw up to n distinct unobserved points uniformly from the grid."""
+        taken = set(self.observations) | exclude
+        points = []
+        for _ in range(100 * n):
+            if len(points) == n:
+                return points
+            point = tuple(self.rng.randrange(size) for size in self.sizes)
+            if point not in taken:
+                taken.add(point)
+                points.append(point)
+        # Nearly exhausted grid: pick from the remaining points directly
+        remaining = [point for point in product(*(range(size) for size in self.sizes)) if point not in taken]
+        return points + self.rng.sample(remaining, min(n - len(points), len(remaining)))
+
+def _axisKeys(grid: ParamGrid) -> List[Tuple[List[str], Dict[Tuple[float, ...], int]]]:
+    """Map database parameter columns of each grid axis to the axis value index."""
+    keys = []
+    for name, axis in zip(grid.names, grid.axes):
+        columns = [f'{name}_{plane}' for plane in range(3)] if isinstance(getattr(fclParams(), name), list) else [name]
+        lookup = {}
+        for i, value in enumerate(axis):
+            built = getattr(fclParams(**{name: reduceList(value)}), name)
+            lookup[tuple(float(v) for v in (built if isinstance(built, list) else [built]))] = i
+        keys.append((columns, lookup))
+    return keys
+
+def optimize(db: 'HitTuningDB', grid: ParamGrid, inputFile: str, mc: bool, outputDir: str, tag: str,
+             objective: str = 'ratio_total', target: float = 1.0, options: Optional[str] = None,
+             jobs: int = 1, batchSize: Optional[int] = None, maxEvals: int = 200, patience: int = 3,
+             tol: float = 1e-3, jobNum: int = 0, useCache: bool = True,
+             seed: Optional[int] = None) -> Optional[Tuple[fclParams, float]]:
+    """Search the grid with a TPEOptimizer instead of running every grid point.
+    
+    Completed runs of grid points already in the database with the same run
+    cache key (same input, options and macro) seed the optimizer. Proposed
+    points are run in batches through the run cache and the local executor,
+    and the search stops after maxEvals lar runs or once the best score has
+    not improved by more than tol for `patience` batches.
+    
+    Args:
+        db: Database with previous runs; new runs are stored here
+        grid: Search space
+        inputFile: Path to input ROOT file or file list
+        mc: Must be True; the objective comes from galleryMC
+        outputDir: Directory for the FCL and ROOT files
+        tag: Tag for output files
+        objective: Result column to optimise, e.g. 'ratio_ele'
+        target: Ratio of a perfect hit finder
+        options: Additional lar options
+        jobs: Maximum number of concurrent worker processes
+        batchSize: Number of points proposed per batch (default: max(jobs, 4))
+        maxEvals: Maximum number of lar runs
+        patience: Number of batches without improvement before stopping
+        tol: Minimum score improvement that resets the patience counter
+        jobNum: Job number stored with each run
+        useCache: Whether to reuse identical completed runs
+        seed: Random seed
+        
+    Returns:
+        Tuple of (best fclParams, |objective - target|), or None without successful runs
+    """
+    if not mc:
+        raise ValueError("Optimisation needs the galleryMC ratio results, run with --mc")
+    if objective not in RESULT_COLUMNS:
+        raise ValueError(f"Unknown objective '{objective}', choose from {', '.join(RESULT_COLUMNS)}")
+    batchSize = batchSize or max(jobs, 4)
+    optimizer = TPEOptimizer(grid, seed=seed)
+
+    # Seed with completed runs of grid points on the same input and options
+    axisKeys = _axisKeys(grid)
+    db.flush()
+    cursor = db.conn.cursor()
+    columns = [column for cols, _ in axisKeys for column in cols]
+    cursor.execute(f"SELECT cache_key, {objective}, {', '.join(columns)} FROM runs "
+                   "WHERE cache_key IS NOT NULL AND hist_filename IS NOT NULL")
+    for row in cursor.fetchall():
+        values = list(row[2:])
+        point = []
+        for cols, lookup in axisKeys:
+            key = tuple(float(v) if v is not None else None for v in values[:len(cols)])
+            values = values[len(cols):]
+            if key not in lookup:
+                break
+            point.append(lookup[key])
+        else:
+            point = tuple(point)
+            if runCacheKey(optimizer.params(point), inputFile, options, mc) == row[0]:
+                optimizer.observe(point, objectiveScore(row[1], target))
+    print(f"Optimising {objective} over {len(grid)} grid points, "
+          f"starting from {len(optimizer.observations)} previous runs")
+
+    bestScore = optimizer.best()[1] if optimizer.observations else float('-inf')
+    nEvals = 0
+    nStalled = 0
+    nBatch = 0
+    while nEvals < maxEvals:
+        points = optimizer.suggest(min(batchSize, maxEvals - nEvals))
+        if not points:
+            print("All grid points have been evaluated")
+            break
+        nBatch += 1
+
+        tasks = buildTasks(db, [optimizer.params(point) for point in points], outputDir, tag, options)
+        pending = registerTasks(db, tasks, inputFile, mc, jobNum, useCache=useCache)
+        runTasks(pending, inputFile, mc, db, jobs)
+        nEvals += len(pending)
+
+        ratios = dict(db.query_runs([('id', 'in', [task.runId for task in tasks])],
+                                    columns=['id', objective], create_indexes=False))
+        batchScore = float('-inf')
+        for task, point in zip(tasks, points):
+            score = objectiveScore(ratios.get(task.runId), target)
+            optimizer.observe(point, score)
+            batchScore = max(batchScore, score)
+
+        if batchScore > bestScore + tol:
+            bestScore = batchScore
+            nStalled = 0
+        else:
+            nStalled += 1
+        bestPoint, _ = optimizer.best()
+        print(f"Batch {nBatch}: {len(pending)} lar runs ({nEvals} total), best |{objective} - {target}| = "
+              f"{-bestScore:.4f} at grid index {grid.indexOf(bestPoint)}")
+        if nStalled >= patience:
+            print(f"No improvement above {tol} for {patience} batches, stopping")
+            break
+
+    best = optimizer.best()
+    if best is None or best[1] == float('-inf'):
+        print("No successful runs")
+        return None
+    bestParams = optimizer.params(best[0])
+    print(f"Best configuration (grid index {grid.indexOf(best[0])}), |{objective} - {target}| = {-best[1]:.4f}:")
+    print(bestParams)
+    return bestParams, -best[1]
+
+def halvingRungs(minEvents: int, maxEvents: int, eta: int) -> List[int]:
+    """Return the event budget of each successive-halving rung.
+    
+    Args:
+        minEvents: Events per candidate in the first rung
+        maxEvents: Events per candidate in the last rung
+        eta: Budget growth factor between rungs
+        
+    Returns:
+        Increasing event counts, minEvents * eta^k capped at maxEvents
+    """
+    if minEvents < 1 or maxEvents < minEvents or eta < 2:
+        raise ValueError("Successive halving needs 1 <= minEvents <= maxEvents and eta >= 2")
+    rungs = [minEvents]
+    while rungs[-1] < maxEvents:
+        rungs.append(min(rungs[-1] * eta, maxEvents))
+    return rungs
+
+def successiveHalving(db: 'HitTuningDB', candidates: List[Tuple[int, fclParams]], inputFile: str, mc: bool,
+                      outputDir: str, tag: str, objective: str = 'ratio_total', target: float = 1.0,
+                      minEvents: int = 2, maxEvents: int = 50, eta: int = 3, jobs: int = 1, jobNum: int = 0,
+                      useCache: bool = True) -> List[Tuple[int, fclParams, float]]:
+    """Run candidates on a few events and promote the best 1/eta to eta times more events.
+    
+    Every rung is stored as separate runs with its event count in the nEvents
+    column, and rungs that were already run are taken from the run cache.
+    
+    Args:
+        db: Database to store the runs in
+        candidates: (grid index, fclParams) pairs to compare
+        inputFile: Path to input ROOT file or file list
+        mc: Must be True; the ranking uses galleryMC results
+        outputDir: Directory for the FCL and ROOT files
+        tag: Tag for output files
+        objective: Result column ranked by |objective - target|
+        target: Ratio of a perfect hit finder
+        minEvents: Events per candidate in the first rung
+        maxEvents: Events per candidate in the last rung
+        eta: Fraction 1/eta of candidates promoted, and budget growth, per rung
+        jobs: Maximum number of concurrent worker processes
+        jobNum: Job number stored with each run
+        useCache: Whether to reuse identical completed runs
+        
+    Returns:
+        (grid index, fclParams, |objective - target|) of the final rung, best first
+    """
+    if not mc:
+        raise ValueError("Successive halving needs the galleryMC ratio results, run with --mc")
+    if objective not in RESULT_COLUMNS:
+        raise ValueError(f"Unknown objective '{objective}', choose from {', '.join(RESULT_COLUMNS)}")
+    rungs = halvingRungs(minEvents, maxEvents, eta)
+    nCandidates = len(candidates)
+    print(f"Successive halving of {len(candidates)} candidates over event budgets {rungs}")
+
+    totalEvents = 0
+    ranked = []
+    for iRung, nEvents in enumerate(rungs):
+        start = time.time()
+        tasks = buildTasks(db, [params for _, params in candidates], outputDir, tag, options=f'-n {nEvents}')
+        pending = registerTasks(db, tasks, inputFile, mc, jobNum, useCache=useCache)
+        runTasks(pending, inputFile, mc, db, jobs)
+        totalEvents += len(pending) * nEvents
+
+        ratios = dict(db.query_runs([('id', 'in', [task.runId for task in tasks])],
+                                    columns=['id', objective], create_indexes=False))
+        ranked = sorted(((objectiveScore(ratios.get(task.runId), target), index, params)
+                         for task, (index, params) in zip(tasks, candidates)),
+                        key=lambda item: item[0], reverse=True)
+        print(f"Rung {iRung}: {len(candidates)} candidates x {nEvents} events ({len(pending)} lar runs) "
+              f"in {time.time() - start:.0f} s, best |{objective} - {target}| = {-ranked[0][0]:.4f} "
+              f"(grid index {ranked[0][1]})")
+
+        if iRung < len(rungs) - 1:
+            nKeep = max(1, len(candidates) // eta)
+            candidates = [(index, params) for score, index, params in ranked[:nKeep] if score > float('-inf')]
+            if not candidates:
+                print("No candidate produced a valid ratio, stopping")
+                return []
+
+    fullEvents = nCandidates * rungs[-1]
+    print(f"Processed {totalEvents} candidate-events instead of {fullEvents} for all candidates at "
+          f"{rungs[-1]} events ({fullEvents / max(totalEvents, 1):.1f}x less)")
+    return [(index, params, -score) for score, index, params in ranked]
 
 def parse_args() -> argparse.Namespace:
     """Parse command-line arguments.
@@ -830,9 +3703,46 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
     parser.add_argument('-r', '--runGrid', action='store_true', help='Run over the entire parameter grid')
     parser.add_argument('-i', '--inputFile', type=str, default='', help='Input file to process')
-    parser.add_argument('-f', '--fclFile', type=str, default='', help='FCL file to use when running over grid')
+    parser.add_argument('-f', '--fclFile', type=str, default='', help='FCL file to use when running over grid (built from the grid index given by --runNumber if empty)')
     parser.add_argument('-n', '--runNumber', type=int, default=0, help='Run number for the job when running over grid')
     parser.add_argument('-p', '--path', type=str, default=None, help='Path to macros when running over grid')
+    parser.add_argument('--bulk', action='store_true', help='With --createGrid, write one shared base FCL plus small deduplicated override files')
+    parser.add_argument('--shard', type=parseShard, default=None, help='Only create the i-th of N strided shards of the grid, given as i/N')
+    parser.add_argument('--wal', action='store_true', help='Use WAL journaling so several local hitTuning.py processes can share one database (local disk only)')
+    parser.add_argument('--noCache', action='store_true', help='Rerun parameter sets even if an identical run is already in the database')
+    parser.add_argument('--evictAge', type=float, default=None, help='Delete lar output ROOT files of recorded runs older than this many days (results are kept)')
+    parser.add_argument('--evictBudget', type=float, default=None, help='Delete the oldest lar output ROOT files of recorded runs until they fit in this many GB (results are kept)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of parameter sets to process concurrently when running interactively')
+    parser.add_argument('--optimize', action='store_true', help='Search the createGrid parameter space with a TPE optimiser instead of running fixed parameter sets (requires --mc)')
+    parser.add_argument('--objective', type=str, default='ratio_total', help='Result column optimised by --optimize towards a ratio of 1')
+    parser.add_argument('--maxEvals', type=int, default=200, help='Maximum number of lar runs for --optimize')
+    parser.add_argument('--batchSize', type=int, default=None, help='Parameter sets proposed per --optimize batch [default: max(jobs, 4)]')
+    parser.add_argument('--patience', type=int, default=3, help='Stop --optimize after this many batches without improvement')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for --optimize and --nCandidates')
+    parser.add_argument('--halving', action='store_true', help='Rank the createGrid parameter sets by --objective with successive halving over the number of events (requires --mc)')
+    parser.add_argument('--minEvents', type=int, default=2, help='Events per parameter set in the first --halving rung')
+    parser.add_argument('--maxEvents', type=int, default=50, help='Events per parameter set in the last --halving rung')
+    parser.add_argument('--eta', type=int, default=3, help='--halving keeps the best 1/eta parameter sets and multiplies their events by eta per rung')
+    parser.add_argument('--nCandidates', type=int, default=None, help='Random subset of grid parameter sets to start --halving with [default: all]')
+    parser.add_argument('--resume', action='store_true', help='First finish the parameter sets of this tag that an earlier session left unfinished, from their last completed stage')
+    parser.add_argument('--buildMacro', action='store_true', help='Compile the gallery macro into its build cache (macroCache/ next to the macro, or --path) and exit')
+    parser.add_argument('--ingestFcls', type=str, default=None, help='Add all generated FCL files in this directory to the database as runs and exit')
+    parser.add_argument('--pack', type=int, default=1, help='Run this many hit finder configurations in each lar job, sharing the upstream stage1 modules (requires --mc)')
+    parser.add_argument('--roiCache', action='store_true', help='Run the parameter-independent stage1 producers once per input and event range into a cached file, and only hit finding per parameter set (requires --mc; not with --pack, --optimize, --halving or --runGrid)')
+    parser.add_argument('--select', type=str, default=None, help="Only process the events passing this selection on the event index, e.g. 'ele > 100 and mu == 0' (requires --mc)")
+    parser.add_argument('--indexEvents', action='store_true', help='Add the input files to the event pre-selection index and exit (requires --mc)')
+    parser.add_argument('--galleryJobs', type=int, default=0, help='Pipeline lar (--jobs processes), gallery (this many processes) and database writes across parameter sets (0: off)')
+    parser.add_argument('--maxInFlight', type=int, default=None, help='Maximum number of parameter sets between lar start and stored results in pipeline mode (default: jobs + galleryJobs + 1)')
+    parser.add_argument('--recompute', action='store_true', help='Recompute the ratios of all runs with a hit-truth dump from the dump, without gallery, and exit')
+    parser.add_argument('--ideFractionCut', type=float, default=None, help='Only count hits above this ideFraction in --recompute')
+    parser.add_argument('--storeRecomputed', action='store_true', help='Store the ratios from --recompute in the database')
+    parser.add_argument('--histSummary', action='store_true', help='Summarise every 1D histogram in the histogram files of the runs into the hist_summary table and exit')
+    parser.add_argument('--histDir', type=str, default=None, help='Directory tree searched for histogram files not found at their recorded path by --histSummary, e.g. the grid outputs/ directory')
+    parser.add_argument('--rescan', action='store_true', help='With --histSummary, also summarise runs that already have histogram summaries')
+    parser.add_argument('--schedule', type=int, default=None, help='Pack the createGrid configurations into this many grid jobs by predicted cost, write the job manifest for runJob.sh to --outputDir and exit')
+    parser.add_argument('--lpt', action='store_true', help='Start the parameter sets with the longest predicted lar time first and report the predicted against the actual makespan')
+    parser.add_argument('--costDB', type=str, nargs='+', default=None, help='Databases with timed runs used to predict costs for --schedule and --lpt (default: this tag\'s database)')
+    parser.add_argument('--costMetric', type=str, default='wall_time', choices=['wall_time', 'cpu_time'], help='Recorded cost predicted by --schedule and --lpt')
     return parser.parse_args()
 
 
@@ -843,14 +3753,44 @@ if __name__ == "__main__":
     MC = args.mc
     fileSubStr = args.tag
 
+    if args.pack > 1 and not MC:
+        print("Error: --pack requires --mc")
+        exit(1)
+    if args.roiCache and not MC:
+        print("Error: --roiCache requires --mc")
+        exit(1)
+    if args.roiCache and (args.pack > 1 or args.optimize or args.halving or args.runGrid):
+        # These modes write full-chain FCL files that read the stage0 input
+        print("Error: --roiCache cannot be combined with --pack, --optimize, --halving or --runGrid")
+        exit(1)
+    if (args.select is not None or args.indexEvents) and not MC:
+        print("Error: --select and --indexEvents require --mc")
+        exit(1)
+
+    # Populate the macro build cache, e.g. before packing the job tarball
+    if args.buildMacro:
+        exit(loadMacro(MC, args.path))
+
     #create the fcl files for a grid search
     if args.createGrid:
+        outputDir = args.outputDir
+        if not os.path.exists(outputDir):
+            os.makedirs(outputDir)
         paramGrid = createGrid()
-        for ip, params in enumerate(paramGrid):
+        if args.shard is not None:
+            gridIter = paramGrid.shard(*args.shard)
+            nToWrite = len(range(args.shard[0], len(paramGrid), args.shard[1]))
+        else:
+            gridIter = enumerate(paramGrid)
+            nToWrite = len(paramGrid)
+        if args.bulk:
+            generateFCLBulk(gridIter, outputDir, fileSubStr, mc=MC, verbose=args.verbose, shard=args.shard)
+            exit(0)
+        for iw, (ip, params) in enumerate(gridIter):
             if args.debug:
-                if ip > 1: break
-            if ip % 100 == 0:
-                print(f"Creating FCL for parameter set {ip}/{len(paramGrid)}")
+                if iw > 1: break
+            if iw % 100 == 0:
+                print(f"Creating FCL for parameter set {ip} ({iw}/{nToWrite})")
             outputFCL = f'{outputDir}/hitTuning_{fileSubStr}_{ip}.fcl'
             if MC:
                 generateFCLMC(params, outputFile=outputFCL, verbose=args.verbose)
@@ -859,7 +3799,33 @@ if __name__ == "__main__":
         exit(0)
 
     # Initialize database
-    db = HitTuningDB(f"hitTuning_{fileSubStr}.db")
+    # Writes are batched; the run loops flush after every journaled stage so --resume sees it
+    db = HitTuningDB(f"hitTuning_{fileSubStr}.db", buffered=True, wal=args.wal)
+
+    if args.ingestFcls is not None:
+        ingest_fcl_dir(db, args.ingestFcls, jobs=args.jobs if args.jobs > 1 else None)
+        db.close()
+        exit(0)
+
+    if args.histSummary:
+        ingestHistSummaries(db, args.histDir, rescan=args.rescan, jobs=args.jobs if args.jobs > 1 else None)
+        db.close()
+        exit(0)
+
+    costDBs = args.costDB or [db.db_path]
+    if args.schedule is not None:
+        if not os.path.exists(args.outputDir):
+            os.makedirs(args.outputDir)
+        scheduleGrid(createGrid(), args.schedule, costDBs,
+                     os.path.join(args.outputDir, f'hitTuning_{fileSubStr}_schedule.txt'), args.costMetric)
+        db.close()
+        exit(0)
+
+    if args.recompute:
+        recomputeRatios(db, args.ideFractionCut, store=args.storeRecomputed,
+                        jobs=args.jobs if args.jobs > 1 else None)
+        db.close()
+        exit(0)
 
     # Define input and output files
     
@@ -878,9 +3844,6 @@ if __name__ == "__main__":
         if not args.outputDir.endswith('.root'):
             print("Error: When running over the grid, outputDir must be the name of a .root file")
             exit(1)
-        if args.fclFile == '':
-            print("Error: When running over the grid, must provide FCL file via --fclFile")
-            exit(1)
         if args.runNumber is None:
             print("Error: When running over the grid, must provide run number via --runNumber")
             exit(1)
@@ -893,10 +3856,8 @@ if __name__ == "__main__":
         jobNum = args.runNumber
         macroPath = args.path
 
-        # Load the macro (interpreted)
-        abs_macro = os.path.join(macroPath, 'galleryMC.cpp')
-        if not os.path.isabs(abs_macro):
-            abs_macro = os.path.abspath(abs_macro)
+        # Load the macro, from the build cache shipped in the tarball when it matches this setup
+        abs_macro = os.path.abspath(os.path.join(macroPath, 'galleryMC.cpp'))
         print(f"Attempting to load macro from: {abs_macro}")
 
         try:
@@ -905,42 +3866,90 @@ if __name__ == "__main__":
             r.gROOT.SetMacroPath(r.gROOT.GetMacroPath() + f":{macroPath}/")
         except Exception as e:
             print(f"Warning: failed to add macro paths: {e}")
-        r.gInterpreter.ProcessLine('#include "gallery/Event.h"')
-        r.gInterpreter.ProcessLine('#include "canvas/Persistency/Common/FindManyP.h"')
-        r.gInterpreter.ProcessLine('#include "canvas/Utilities/InputTag.h"')
         if not os.path.exists(abs_macro):
             raise FileNotFoundError(
                 f"galleryMC.cpp not found at {abs_macro}. "
                 "Stage the macro with the job and pass the correct macroPath."
             )
-
-        # Explicitly load via absolute path
-        result = r.gROOT.ProcessLine(f'.L {abs_macro}+')    
-        print(f"Compilation result: {result}")
+        loadMacro(True, macroPath)
 
         # Initialize database
         db = HitTuningDB(f"hitTuning_{jobNum}.db")
 
+        # Packed job N runs grid configurations N*pack ... N*pack + pack - 1 in one lar job
+        if args.pack > 1:
+            grid = createGrid()
+            indices = range(jobNum * args.pack, min((jobNum + 1) * args.pack, len(grid)))
+            paramSets = [grid[index] for index in indices]
+            fclFile = f'hitTuning_{fileSubStr}_pack{jobNum}.fcl'
+            options = GRID_OPTIONS
+            runIds = [db.add_run(params, index, fclFile, notes=f"packed job {jobNum}; {PACKED_NOTE}",
+                                 cache_key=runCacheKey(params, inputFile, options, True, macroPath),
+                                 nEvents=eventsFromOptions(options))
+                      for index, params in zip(indices, paramSets)]
+            histFile = f'hist_output_{jobNum}.root'
+            try:
+                results, costs = runPackedLar(paramSets, fclFile, inputFile, outputFile, histFile, options)
+            except RuntimeError as e:
+                print(f"Error: {e}")
+                db.close()
+                sys.exit(1)
+            for run_id, runResults, runCosts in zip(runIds, results, costs):
+                print(f"results for run ID {run_id}:", runResults)
+                if runCosts:
+                    db.update_costs(run_id, runCosts)
+                db.update_output_filename(run_id, outputFile)
+                db.update_results(run_id, runResults)
+                db.update_hist_filename(run_id, histFile)
+            db.close()
+            sys.exit(0)
+
+        # Build only this job's configuration if no FCL file was staged
+        if fclFile == '':
+            params = createGrid()[jobNum]
+            fclFile = f'hitTuning_{fileSubStr}_{jobNum}.fcl'
+            if MC:
+                generateFCLMC(params, outputFile=fclFile, verbose=args.verbose)
+            else:
+                generateFCL(params, outputFile=fclFile, verbose=args.verbose)
+        else:
+            params = parse_fcl_to_params(fclFile)
+
+        # Every grid job starts from an empty hitTuning_<N>.db, so there is nothing to look up;
+        # the cache key is still recorded for lookups in the merged database
+        options = GRID_OPTIONS
+        cacheKey = runCacheKey(params, inputFile, options, True, macroPath)
+
         # Add to database   
-        params = parse_fcl_to_params(fclFile)
-        run_id = db.add_run(params, jobNum, fclFile, notes="")
+        run_id = db.add_run(params, jobNum, fclFile, notes="", cache_key=cacheKey,
+                            nEvents=eventsFromOptions(options))
         print(f"Added run with ID: {run_id}")
 
         # Run lar with generated FCL
-        run(fclFile, inputFile, outputFile, options='-n 5')
+        costs = {}
+        status = run(fclFile, inputFile, outputFile, options=options, costs=costs)
+        if status != 0:
+            # Leave the run without results, so the merge does not mistake it for a completed one
+            print(f"Error: lar exited with status {status} for {fclFile}")
+            db.close()
+            sys.exit(1)
+        if costs:
+            db.update_costs(run_id, costs)
         
         # Later, update with output filename
         db.update_output_filename(run_id, outputFile)
         
         # Query runs
-        all_runs = db.get_all_runs()
-        print(f"Total runs in database: {len(all_runs)}")
+        print(f"Total runs in database: {db.count_runs()}")
 
         histFile = f'hist_output_{jobNum}.root'
+        dumpFile = f'truth_{jobNum}.root'
         print(f"Processing hits with outputFile: {outputFile} and histFile: {histFile}")
-        results = r.galleryMC(outputFile, histFile)
+        results = r.galleryMC(outputFile, histFile, dumpFile)
         print("results:", results)
         db.update_results(run_id, results)
+        db.update_dump_filename(run_id, dumpFile)
+        db.update_hist_filename(run_id, histFile)
 
         db.close()
 
@@ -950,14 +3959,12 @@ if __name__ == "__main__":
     else:
 
         # Load the macro (interpreted)
-        r.gInterpreter.ProcessLine('#include "gallery/Event.h"')
-        r.gInterpreter.ProcessLine('#include "canvas/Persistency/Common/FindManyP.h"')
-        r.gInterpreter.ProcessLine('#include "canvas/Utilities/InputTag.h"')
-        if args.mc:
-            result = r.gROOT.ProcessLine('.L galleryMC.cpp+')
-        else:
-            result = r.gROOT.ProcessLine('.L galleryMacro.cpp+')
-        print(f"Compilation result: {result}")
+        loadMacro(args.mc)
+
+        if args.indexEvents:
+            indexEvents(db, inputFile)
+            db.close()
+            exit(0)
 
         # Set output directory for fcl files
         outputDir = args.outputDir
@@ -991,57 +3998,63 @@ if __name__ == "__main__":
         #         LongMaxHits=[10, 10, 10]) #turn on pulse trains
         paramGrid = [defaultParams]
 
-    for ip, params in enumerate(paramGrid):
-
-        # if ip > 5: 
-        #     break
-        try:
-            version = 0
-            outputFCL = f'{outputDir}/hitTuning_{fileSubStr}_{version}.fcl'
-            outputFile = f'{outputDir}/output_{fileSubStr}_{version}.root'
-
-            while os.path.exists(outputFCL):
-                version += 1
-                outputFCL = f'{outputDir}/hitTuning_{fileSubStr}_{version}.fcl'
-                outputFile = f'{outputDir}/output_{fileSubStr}_{version}.root'
+    if args.debug:
+        options = '-n 2'  # Process only 2 events in debug mode
+    else:
+        options = None
+
+    # Finish what an earlier session of this tag left unfinished before starting new work
+    if args.resume:
+        # Resumed tasks run as registered: with their own event selection, and on the ROI cache
+        # of their own event range if hits-only; --select only applies to the new tasks below
+        tasks = resumeTasks(db, fileSubStr)
+        useROICache(tasks, inputFile, outputDir)
+        runTasks(tasks, inputFile, MC, db, args.jobs, args.galleryJobs, args.maxInFlight,
+                 costDBs if args.lpt else None, args.costMetric)
+
+    if args.optimize:
+        optimize(db, createGrid(), inputFile, MC, outputDir, fileSubStr,
+                 objective=args.objective, options=options, jobs=args.jobs, batchSize=args.batchSize,
+                 maxEvals=args.maxEvals, patience=args.patience, jobNum=args.runNumber,
+                 useCache=not args.noCache, seed=args.seed)
+        db.close()
+        exit(0)
 
-            # Generate FCL file
-            if MC:
-                generateFCLMC(params, outputFile=outputFCL)
-            else:   
-                generateFCL(params, outputFile=outputFCL)
+    if args.halving:
+        grid = createGrid()
+        candidates = list(enumerate(grid))
+        if args.nCandidates is not None and args.nCandidates < len(candidates):
+            candidates = sorted(random.Random(args.seed).sample(candidates, args.nCandidates), key=lambda c: c[0])
+        final = successiveHalving(db, candidates, inputFile, MC, outputDir, fileSubStr, objective=args.objective,
+                                  minEvents=args.minEvents, maxEvents=args.maxEvents, eta=args.eta,
+                                  jobs=args.jobs, jobNum=args.runNumber, useCache=not args.noCache)
+        if final:
+            print(f"Best configuration (grid index {final[0][0]}), |{args.objective} - 1.0| = {final[0][2]:.4f}:")
+            print(final[0][1])
+        db.close()
+        exit(0)
 
-            # Add to database   
-            run_id = db.add_run(params, args.runNumber, outputFCL, notes="") 
-            print(f"Added run with ID: {run_id}")
+    tasks = buildTasks(db, paramGrid, outputDir, fileSubStr, options)
+    if args.select is not None:
+        applyEventSelection(db, tasks, inputFile, args.select)
 
-            if args.debug:
-                options = '-n 2'  # Process only 1 events in debug mode
-            else:
-                options = None
-            # Run lar with generated FCL
-            run(outputFCL, inputFile, outputFile, options=options)
-            
-            # Later, update with output filename
-            db.update_output_filename(run_id, outputFile)
-            
-            # Query runs
-            all_runs = db.get_all_runs()
-            print(f"Total runs in database: {len(all_runs)}")
+    if args.roiCache:
+        for task in tasks:
+            task.hitsOnly = True
 
-            histFile = f'{outputDir}/hist_output_{fileSubStr}_{version}.root'
+    # Skip parameter sets that were already run on the same input with the same options
+    tasks = registerTasks(db, tasks, inputFile, MC, args.runNumber, useCache=not args.noCache)
 
-            if args.mc:
-                results = r.galleryMC(outputFile, histFile)
-                print("results:", results)
-                db.update_results(run_id, results)
-            else:
-                r.galleryMacro(outputFile, histFile)
-        
-        except Exception as e:
-            print(f"Error processing parameter set {ip}: {e}")
-            continue
+    if args.pack > 1:
+        runPacked(db, tasks, inputFile, args.pack)
+    else:
+        # Results are keyed on the original input, so the ROI cache is only swapped in for lar
+        useROICache(tasks, inputFile, outputDir)
+        runTasks(tasks, inputFile, MC, db, args.jobs, args.galleryJobs, args.maxInFlight,
+                 costDBs if args.lpt else None, args.costMetric)
+
+    if args.evictAge is not None or args.evictBudget is not None:
+        db.evict_outputs(max_age_days=args.evictAge,
+                         max_bytes=args.evictBudget * 1e9 if args.evictBudget is not None else None)
     
     db.close()
-
-
@@ -1,93 +1,634 @@
 import os
+import sys
+import time
+import shutil
 import sqlite3
+import argparse
+import json
+import hashlib
+import tempfile
+import multiprocessing
+from datetime import datetime
+from scheduler import PARAM_COLUMNS
 
-import sqlite3
+# SQLite allows 10 attached databases per connection by default; keep one spare
+ATTACH_BATCH = 9
+
+# Column recording the source DB of every merged row
+SOURCE_COLUMN = "merge_source"
+
+# Columns identifying a run: rows with the same values are merged only once. The
+# event count and the run cache key (input identity, lar options, selection and
+# macro version) keep halving stages and reruns on other inputs or options apart
+RUN_SIGNATURE = ["jobNum"] + PARAM_COLUMNS + ["nEvents", "cache_key"]
+
+# Signature columns that older databases lack or leave NULL; NULL is compared as this value
+SIGNATURE_OPTIONAL = {"nEvents": "'unknown'", "cache_key": "'unknown'"}
+
+# Ledger of merged sources in the destination DB, used to skip unchanged sources
+LEDGER_SQL = """
+    CREATE TABLE IF NOT EXISTS merged_sources (
+        path TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        size INTEGER,
+        mtime INTEGER,
+        content_hash TEXT,
+        n_rows INTEGER,
+        merged TEXT,
+        PRIMARY KEY (path, table_name)
+    )
+"""
+
+def fast_pragmas(conn):
+    """
+    Trade crash safety for speed on a connection that writes a throwaway partial DB.
+    A partial DB interrupted with these settings is discarded with its merge.
+    """
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA locking_mode=EXCLUSIVE")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")  # 256 MB
+
+def dest_pragmas(conn):
+    """
+    Tune a connection to the persistent destination DB without giving up crash safety.
+    The rollback journal is kept (WAL needs shared memory, which the network file
+    systems holding merged DBs may lack), so readers only wait while a merge commits.
+    """
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")  # 256 MB
+
+def file_hash(path, block_size=1 << 20):
+    """Return the SHA-1 of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-def merge_sqlite_dbs(db_files, dest_db, table="runs", conflict="ignore"):
+def read_source(job):
+    """
+    Hash and validate one source DB in a worker process.
+
+    - job: (path, table)
+
+    Returns (path, [(column, type), ...] without id and merge_source, number of rows,
+    content hash, error or None).
+    """
+    path, table = job
+    try:
+        digest = file_hash(path)
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            columns = [(c[1], c[2]) for c in conn.execute(f"PRAGMA table_info('{table}')")]
+            if not columns:
+                return path, None, 0, digest, f"table '{table}' not found"
+            n_rows = conn.execute(f"SELECT COUNT(*) FROM '{table}'").fetchone()[0]
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        return path, None, 0, None, str(e)
+    return path, [c for c in columns if c[0] not in ("id", SOURCE_COLUMN)], n_rows, digest, None
+
+def read_ledger(dest_db, table):
+    """Return {path: (size, mtime, content_hash)} of the sources already merged into dest_db."""
+    if not os.path.exists(dest_db):
+        return {}
+    conn = sqlite3.connect(dest_db)
+    try:
+        if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='merged_sources'").fetchone() is None:
+            return {}
+        return {row[0]: tuple(row[1:]) for row in conn.execute(
+            "SELECT path, size, mtime, content_hash FROM merged_sources WHERE table_name = ?", (table,))}
+    finally:
+        conn.close()
+
+def signature_sql(signature, available=None):
+    """
+    Return the signature as a comma-separated list of SQL expressions.
+
+    - available: columns of the table the expressions are evaluated on; optional
+      signature columns it lacks are replaced by the value NULL is compared as
+    """
+    terms = []
+    for column in signature:
+        default = SIGNATURE_OPTIONAL.get(column)
+        if default is None:
+            terms.append(f'"{column}"')
+        elif available is not None and column not in available:
+            terms.append(default)
+        else:
+            terms.append(f'IFNULL("{column}", {default})')
+    return ",".join(terms)
+
+def run_signature(columns):
+    """Return the RUN_SIGNATURE columns present in a runs table, or None if it lacks the required ones."""
+    if not set(RUN_SIGNATURE).difference(SIGNATURE_OPTIONAL).issubset(columns):
+        return None
+    return [c for c in RUN_SIGNATURE if c in columns]
+
+def prepare_dest(conn, table, signature):
+    """
+    Add the ledger and the indexes of an incremental merge to the destination DB.
+
+    - signature: columns identifying a row, or None to allow duplicate rows
+
+    Duplicate rows already in the table (e.g. from merges before the ledger
+    existed) are removed, keeping the first, before the unique index is built.
+    A unique index built on other columns (e.g. by an older version of this
+    script) is rebuilt.
+    """
+    conn.execute(LEDGER_SQL)
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table}_{SOURCE_COLUMN}" ON "{table}" ("{SOURCE_COLUMN}")')
+    if signature:
+        index = f"idx_{table}_signature"
+        expressions = signature_sql(signature)
+        create_sql = f'CREATE UNIQUE INDEX "{index}" ON "{table}" ({expressions})'
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type='index' AND name=?", (index,)).fetchone()
+        if row is not None and row[0] != create_sql:
+            conn.execute(f'DROP INDEX "{index}"')
+            row = None
+        if row is None:
+            cursor = conn.execute(f'DELETE FROM "{table}" WHERE rowid NOT IN '
+                                  f'(SELECT MIN(rowid) FROM "{table}" GROUP BY {expressions})')
+            if cursor.rowcount:
+                print(f"  Removed {cursor.rowcount} duplicate rows from {table}")
+            conn.execute(create_sql)
+    conn.commit()
+
+def table_schema(path, table):
+    """Return the CREATE TABLE statement of a table, or None if the table does not exist."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+def ensure_table(conn, table, schema_sql, columns):
+    """
+    Create the table from schema_sql if needed and add any of columns it lacks.
+
+    - columns: [(column, type), ...] that the merged table must hold
+    """
+    if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is None:
+        conn.execute(schema_sql)
+    existing = {c[1] for c in conn.execute(f"PRAGMA table_info('{table}')")}
+    for name, sql_type in columns:
+        if name not in existing:
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{name}" {sql_type}')
+            existing.add(name)
+    conn.commit()
+
+def copy_attached(conn, k, col_names, label, table, verb, adopt=None):
+    """
+    Copy the table rows of the source attached as src<k> into conn, inside the current transaction.
+
+    - label: merge_source of the copied rows, or None to copy merge_source
+    - adopt: signature columns; rows without a merge_source (merged before the
+      ledger existed) are replaced by copied rows with the same signature
+
+    Returns the number of rows inserted.
+    """
+    col_list = ",".join(f'"{c}"' for c in col_names)
+    if adopt:
+        conn.execute(f"DELETE FROM main.'{table}' WHERE \"{SOURCE_COLUMN}\" IS NULL AND "
+                     f"({signature_sql(adopt)}) IN (SELECT {signature_sql(adopt, col_names)} FROM src{k}.'{table}')")
+    if label is None:
+        cursor = conn.execute(f"INSERT OR {verb} INTO main.'{table}' ({col_list}) "
+                              f"SELECT {col_list} FROM src{k}.'{table}'")
+    else:
+        cursor = conn.execute(f"INSERT OR {verb} INTO main.'{table}' ({col_list},\"{SOURCE_COLUMN}\") "
+                              f"SELECT {col_list}, ? FROM src{k}.'{table}'", (label,))
+    return cursor.rowcount
+
+def attach_and_copy(conn, sources, table, verb):
+    """
+    Copy the table rows of sources into a partial DB, attaching up to ATTACH_BATCH at a time.
+
+    - sources: [(path, [column, ...], label), ...]; the rows of a source with a
+      label get it as their merge_source, otherwise merge_source is copied
+
+    Each batch of attached sources is copied in one transaction.
+    Returns the number of rows inserted.
+    """
+    n_rows = 0
+    for first in range(0, len(sources), ATTACH_BATCH):
+        batch = sources[first:first + ATTACH_BATCH]
+        for k, (path, _, _) in enumerate(batch):
+            conn.execute("ATTACH DATABASE ? AS ?", (path, f"src{k}"))
+        try:
+            conn.execute("BEGIN")
+            for k, (_, col_names, label) in enumerate(batch):
+                n_rows += copy_attached(conn, k, col_names, label, table, verb)
+            conn.commit()
+        finally:
+            for k in range(len(batch)):
+                conn.execute(f"DETACH DATABASE src{k}")
+    return n_rows
+
+def commit_to_dest(conn, sources, table, verb, changed, ledger_rows, adopt=None):
+    """
+    Write one merge into the destination DB in a single transaction.
+
+    - sources: at most ATTACH_BATCH (path, [column, ...], label) to copy, see attach_and_copy
+    - changed: sources whose earlier rows are deleted before the copy
+    - ledger_rows: merged_sources rows recorded with the copied rows
+    - adopt: signature columns of legacy rows to replace, see copy_attached
+
+    A merge that fails or is interrupted leaves dest as it was before.
+    Returns (rows deleted, rows inserted).
+    """
+    for k, (path, _, _) in enumerate(sources):
+        conn.execute("ATTACH DATABASE ? AS ?", (path, f"src{k}"))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            n_deleted = 0
+            for path in changed:
+                n_deleted += conn.execute(f'DELETE FROM "{table}" WHERE "{SOURCE_COLUMN}" = ?', (path,)).rowcount
+            n_rows = 0
+            for k, (_, col_names, label) in enumerate(sources):
+                n_rows += copy_attached(conn, k, col_names, label, table, verb, adopt)
+            conn.executemany("INSERT OR REPLACE INTO merged_sources VALUES (?, ?, ?, ?, ?, ?, ?)", ledger_rows)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    finally:
+        for k in range(len(sources)):
+            conn.execute(f"DETACH DATABASE src{k}")
+    return n_deleted, n_rows
+
+def merge_chunk(job):
+    """
+    Merge a chunk of sources into a new partial DB in a worker process.
+
+    - job: (partial path, table, schema_sql, merged columns, sources, verb)
+
+    Returns (partial path, number of sources, number of rows).
+    """
+    partial, table, schema_sql, columns, sources, verb = job
+    conn = sqlite3.connect(partial, isolation_level=None)
+    try:
+        fast_pragmas(conn)
+        ensure_table(conn, table, schema_sql, columns)
+        n_rows = attach_and_copy(conn, sources, table, verb)
+    finally:
+        conn.close()
+    return partial, len(sources), n_rows
+
+def report_phase(name, start, n_items, unit, n_rows=None, log=print):
+    """Print the duration and throughput of a merge phase."""
+    elapsed = max(time.time() - start, 1e-9)
+    rows = f", {n_rows} rows ({n_rows / elapsed:.0f} rows/s)" if n_rows is not None else ""
+    log(f"  {name}: {n_items} {unit} in {elapsed:.2f} s ({n_items / elapsed:.1f} {unit}/s){rows}")
+
+def merge_sqlite_dbs(db_files, dest_db, table="runs", conflict="ignore", jobs=None, verbose=True):
     """
     Merge a list of SQLite .db files into a single destination DB.
 
     - db_files: list of source .db file paths
     - dest_db: path to the merged .db file
-    - table: table name to merge (assumes same schema in all DBs)
-    - conflict: 'ignore' or 'replace' for duplicate primary keys
+    - table: table name to merge (columns missing from dest are added)
+    - conflict: 'ignore' or 'replace' for rows violating a uniqueness constraint,
+      i.e. runs table rows with the RUN_SIGNATURE of a merged row
+    - jobs: number of worker processes (default: number of CPUs)
+    - verbose: print per-phase progress (unreadable sources are always reported)
+
+    Returns a dict with the sources 'merged' (including unchanged content and
+    sources without rows), the sources that 'failed' validation, and the number
+    of 'rows' inserted.
+
+    The merge is incremental. Dest keeps a ledger of merged sources (path,
+    size, mtime, content hash), and every merged row records its source in
+    the merge_source column. Sources with an unchanged size and mtime are
+    skipped without being opened. The rows of a source whose content changed
+    are replaced. The work of a merge is therefore proportional to the new
+    and changed sources.
+
+    New and changed sources are hashed and validated in parallel, then merged
+    as a tree reduction: workers copy chunks of sources into partial DBs, and
+    the partial DBs are copied into dest. Each copy attaches up to
+    ATTACH_BATCH databases. The partial DBs are written without journaling or
+    fsync. Dest keeps its journal and receives the deletions of changed
+    sources, the copied rows and the ledger entries in one transaction, so an
+    interrupted merge leaves it unchanged.
     """
+    summary = dict(merged=[], failed=[], rows=0)
+    log = print if verbose else (lambda *args: None)
     if not db_files:
-        print("No DB files to merge.")
-        return
-
-    # Open destination (created if it doesn't exist)
-    dest_conn = sqlite3.connect(dest_db)
-    dest_cur = dest_conn.cursor()
-
-    # Use first DB as template for schema if table missing
-    first_db = db_files[0]
-    print(first_db)
-    with sqlite3.connect(first_db) as src_conn:
-        # Make sure table exists in dest with same schema
-        dest_cur.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
-            (table,),
-        )
-        if dest_cur.fetchone() is None:
-            src_cur = src_conn.cursor()
-            src_cur.execute(
-                "SELECT sql FROM sqlite_master WHERE type='table' AND name=?",
-                (table,),
-            )
-            row = src_cur.fetchone()
-            if not row or not row[0]:
-                raise RuntimeError(f"Cannot get schema for table '{table}' from {first_db}")
-            dest_cur.execute(row[0])
-            dest_conn.commit()
-
-    # Merge all DBs
+        log("No DB files to merge.")
+        return summary
+    start_all = time.time()
+    jobs = jobs or os.cpu_count() or 1
+    verb = "IGNORE" if conflict == "ignore" else "REPLACE"
+
+    # Skip sources whose size and mtime match the ledger
+    start = time.time()
+    ledger = read_ledger(dest_db, table)
+    stats = {}
     for path in db_files:
-        print(f"Merging {path}")
-        # Attach each DB and bulk-copy rows
-        verb = "IGNORE" if conflict == "ignore" else "REPLACE"
-        dest_cur.execute(f"ATTACH DATABASE '{path}' AS src")
+        st = os.stat(path)
+        stats[os.path.abspath(path)] = (st.st_size, st.st_mtime_ns)
+    candidates = [path for path, stat in stats.items() if ledger.get(path, (None, None))[:2] != stat]
+    report_phase("check ledger", start, len(db_files), "files", log=log)
+    log(f"  {len(candidates)} new or modified files, {len(db_files) - len(candidates)} unchanged")
+    if not candidates:
+        log(f"Done. {dest_db} is up to date.")
+        return summary
+
+    # Hash and validate the candidate sources and read their columns in parallel
+    start = time.time()
+    work = [(path, table) for path in candidates]
+    if jobs > 1 and len(work) > 1:
+        with multiprocessing.Pool(min(jobs, len(work))) as pool:
+            validated = pool.map(read_source, work, chunksize=max(1, len(work) // (4 * jobs)))
+    else:
+        validated = [read_source(job) for job in work]
+    sources = []
+    changed = []
+    ledger_rows = []
+    merged_time = datetime.now().isoformat()
+    for path, columns, n_rows, digest, error in validated:
+        if error is not None:
+            print(f"  Skipping {path}: {error}")
+            summary["failed"].append(path)
+            continue
+        known = ledger.get(path)
+        ledger_rows.append((path, table) + stats[path] + (digest, n_rows, merged_time))
+        if known is not None and known[2] == digest:
+            continue  # touched but identical: only the ledger entry is refreshed
+        if known is not None:
+            changed.append(path)
+        if n_rows:
+            sources.append((path, columns, n_rows))
+    report_phase("validate", start, len(candidates), "files", sum(s[2] for s in sources), log=log)
+    log(f"  {len(sources)} files to merge, {len(changed)} of them replacing earlier merges")
+
+    # Read the schema once, from dest if it has the table, otherwise from the first source
+    schema_sql = table_schema(dest_db, table) if os.path.exists(dest_db) else None
+    if schema_sql is None and not sources:
+        log("No rows to merge.")
+        summary["merged"] = [row[0] for row in ledger_rows]
+        return summary
+    schema_sql = schema_sql or table_schema(sources[0][0], table)
+    merged_columns = {}
+    for _, columns, _ in sources:
+        for name, sql_type in columns:
+            merged_columns.setdefault(name, sql_type)
+    merged_columns = list(merged_columns.items()) + [(SOURCE_COLUMN, "TEXT")]
+    copies = [(path, [c[0] for c in columns], path) for path, columns, _ in sources]
+
+    # Leaf level: workers merge chunks of sources into partial DBs
+    start = time.time()
+    # Small merges (e.g. a few new jobs) go straight into dest
+    n_chunks = min(len(copies) // ATTACH_BATCH, 4 * jobs) if jobs > 1 else 1
+    work_dir = tempfile.mkdtemp(prefix="mergeDB_", dir=os.path.dirname(os.path.abspath(dest_db)))
+    try:
+        if n_chunks > 1:
+            chunks = [copies[i::n_chunks] for i in range(n_chunks)]
+            merge_jobs = [(os.path.join(work_dir, f"partial_{i}.db"), table, schema_sql, merged_columns, chunk, verb)
+                          for i, chunk in enumerate(chunks)]
+            partials = []
+            n_rows = 0
+            with multiprocessing.Pool(min(jobs, n_chunks)) as pool:
+                for partial, n_sources, rows in pool.imap_unordered(merge_chunk, merge_jobs):
+                    partials.append(partial)
+                    n_rows += rows
+                    log(f"  merged {len(partials)}/{n_chunks} chunks ({n_sources} files, {rows} rows)")
+            report_phase("merge chunks", start, len(copies), "files", n_rows, log=log)
+            all_columns = [c[0] for c in merged_columns]
+            copies = [(partial, all_columns, None) for partial in sorted(partials)]
+        if len(copies) > ATTACH_BATCH:
+            # Dest is written in one transaction, which can only see ATTACH_BATCH attached DBs
+            start_stage = time.time()
+            staging, _, n_staged = merge_chunk((os.path.join(work_dir, "staging.db"), table, schema_sql,
+                                                merged_columns, copies, verb))
+            report_phase("stage", start_stage, len(copies), "files", n_staged, log=log)
+            copies = [(staging, [c[0] for c in merged_columns], None)]
+
+        # Root level: replace the rows of changed sources, copy the partial DBs
+        # (or the sources) into dest, and record the sources in the ledger
+        start = time.time()
+        dest_conn = sqlite3.connect(dest_db, isolation_level=None)
         try:
-            # Explicit column list for safety
-            src_conn = sqlite3.connect(path)
-            src_cur = src_conn.cursor()
-            src_cur.execute(f"PRAGMA table_info('{table}')")
-            cols_info = src_cur.fetchall()
-            src_conn.close()
-            if not cols_info:
-                print(f"  Skipping {path}: table '{table}' not found")
-                dest_cur.execute("DETACH DATABASE src")
+            dest_pragmas(dest_conn)
+            ensure_table(dest_conn, table, schema_sql, merged_columns)
+            existing = {c[1] for c in dest_conn.execute(f"PRAGMA table_info('{table}')")}
+            signature = run_signature(existing) if table == "runs" else None
+            prepare_dest(dest_conn, table, signature)
+            unowned = dest_conn.execute(f'SELECT 1 FROM "{table}" WHERE "{SOURCE_COLUMN}" IS NULL LIMIT 1').fetchone()
+            n_deleted, n_rows = commit_to_dest(dest_conn, copies, table, verb, changed, ledger_rows,
+                                               adopt=signature if unowned else None)
+            summary["rows"] = n_rows
+            if n_deleted:
+                log(f"  Removed {n_deleted} rows of {len(changed)} changed files")
+        finally:
+            dest_conn.close()
+        report_phase("merge into dest", start, len(copies), "files", n_rows, log=log)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    elapsed = time.time() - start_all
+    log(f"Done. Merged {len(sources)} DB files into {dest_db} in {elapsed:.1f} s "
+        f"({len(sources) / max(elapsed, 1e-9):.1f} files/s)")
+    summary["merged"] = [row[0] for row in ledger_rows]
+    return summary
+
+class DirectoryCache:
+    """
+    Recursive listing of the .db files under a directory that only re-lists
+    directories whose mtime changed since the previous scan.
+
+    Adding, removing or renaming a file changes the mtime of its directory,
+    so an unchanged subdirectory is known to hold the same files. Directories
+    modified within the last few seconds are not cached, since a file added
+    within the mtime resolution of the file system (1 s on some network
+    file systems) would otherwise be missed.
+    """
+
+    def __init__(self, root, exclude=()):
+        self.root = os.path.abspath(root)
+        self.exclude = {os.path.abspath(path) for path in exclude}
+        self.entries = {}  # directory -> (mtime_ns, .db files, subdirectories)
+        self.n_listed = 0
+
+    def scan(self):
+        """Return the paths of all .db files under the root."""
+        files = []
+        seen = set()
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            seen.add(directory)
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
                 continue
+            cached = self.entries.get(directory)
+            if cached is None or cached[0] != mtime:
+                db_files, subdirs = [], []
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            # Skip the partial DBs of merges into a dest inside the tree
+                            if not entry.name.startswith("mergeDB_"):
+                                subdirs.append(entry.path)
+                        elif entry.name.endswith(".db") and entry.path not in self.exclude:
+                            db_files.append(entry.path)
+                self.n_listed += 1
+                cached = (mtime if time.time() - mtime / 1e9 > 2 else None, db_files, subdirs)
+                self.entries[directory] = cached
+            files += cached[1]
+            stack += cached[2]
+        for directory in set(self.entries) - seen:
+            del self.entries[directory]
+        return files
 
-            col_names = [c[1] for c in cols_info if c[1] != "id"]  # skip primary-key id
-            col_list = ",".join([f"'{c}'" for c in col_names])
+def best_run(dest_db, objective="ratio_total"):
+    """
+    Return (id, jobNum, objective value) of the merged run closest to a ratio of 1,
+    or None if no run has a result yet.
+    """
+    conn = sqlite3.connect(f"file:{dest_db}?mode=ro", uri=True)
+    try:
+        columns = {c[1] for c in conn.execute("PRAGMA table_info('runs')")}
+        if objective not in columns:
+            return None
+        # Ratios of runs without results are stored as -1 and -2
+        return conn.execute(f'SELECT id, jobNum, "{objective}" FROM runs WHERE "{objective}" >= 0 '
+                            f'ORDER BY ABS("{objective}" - 1.0) LIMIT 1').fetchone()
+    finally:
+        conn.close()
 
-            sql = (
-                f"INSERT INTO '{table}' ({col_list}) "
-                f"SELECT {','.join(col_names)} FROM src.'{table}'"
-            )
-            dest_cur.execute("BEGIN")
-            dest_cur.execute(sql)
-            dest_conn.commit()
-        finally:
-            dest_cur.execute("DETACH DATABASE src")
+def write_status(path, status):
+    """Atomically replace a JSON status file, so readers never see a partial file."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(status, f, indent=1)
+    os.replace(tmp, path)
 
-    dest_conn.close()
-    print(f"Done. Merged DB written to: {dest_db}")
+def watch(input_dir, dest_db, table="runs", conflict="ignore", jobs=None, interval=60.0, batch_size=50,
+          objective="ratio_total", expect=None, status_file=None):
+    """
+    Merge job databases into dest_db as they appear under input_dir.
+
+    - interval: seconds between polls of input_dir
+    - batch_size: maximum number of job databases merged at once
+    - objective: result column whose value closest to 1 is reported as the best configuration
+    - expect: stop once this many job databases are merged (default: until interrupted)
+    - status_file: JSON file rewritten after every batch with the progress and best configuration
+
+    A job database is merged once its size and mtime are unchanged between two
+    polls, so files still being copied are left for a later poll. A source that
+    fails validation is retried once its size or mtime changes.
+    """
+    dest_db = os.path.abspath(dest_db)
+    cache = DirectoryCache(input_dir, exclude=[dest_db])
+    done = {path: entry[:2] for path, entry in read_ledger(dest_db, table).items()}
+    previous = {}   # path -> (size, mtime) at the previous poll
+    failed = {}     # path -> (size, mtime) when validation failed
+    n_merged = 0
+    start_all = time.time()
+    print(f"Watching {input_dir} every {interval:g} s, {len(done)} job databases already merged into {dest_db}")
+
+    try:
+        while True:
+            stable = []
+            current = {}
+            for path in cache.scan():
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                stat = (st.st_size, st.st_mtime_ns)
+                if done.get(path) == stat or failed.get(path) == stat:
+                    continue
+                current[path] = stat
+                if previous.get(path) == stat:
+                    stable.append(path)
+            previous = current
+            stable.sort()
+
+            for first in range(0, len(stable), batch_size):
+                batch = stable[first:first + batch_size]
+                start = time.time()
+                summary = merge_sqlite_dbs(batch, dest_db, table=table, conflict=conflict, jobs=jobs, verbose=False)
+                for path in summary["failed"]:
+                    failed[path] = current[path]
+                for path in summary["merged"]:
+                    done[path] = current[path]
+                    failed.pop(path, None)
+                n_merged += len(summary["merged"])
+
+                best = best_run(dest_db, objective) if table == "runs" and os.path.exists(dest_db) else None
+                waiting = sum(path not in done and path not in failed for path in current)
+                print(f"[{datetime.now():%H:%M:%S}] {len(done)} job databases merged "
+                      f"(+{len(summary['merged'])} with {summary['rows']} rows in {time.time() - start:.1f} s), "
+                      f"{len(failed)} failed, {waiting} waiting"
+                      + (f"; best {objective} {best[2]:.4f} (jobNum {best[1]}, run {best[0]})" if best else ""))
+                if status_file:
+                    write_status(status_file, dict(
+                        updated=datetime.now().isoformat(), merged=len(done), merged_this_session=n_merged,
+                        failed=sorted(failed), waiting=waiting, objective=objective,
+                        best=dict(run_id=best[0], jobNum=best[1], value=best[2]) if best else None))
+
+            if expect is not None and len(done) >= expect:
+                print(f"All {expect} expected job databases merged")
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+    elapsed = time.time() - start_all
+    print(f"Merged {n_merged} job databases in {elapsed:.0f} s, {len(failed)} failed, "
+          f"{cache.n_listed} directory listings")
+    return n_merged
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Merge the per-job hitTuning databases of a grid search")
+    parser.add_argument('-i', '--inputDir', type=str, default='/nashome/m/micarrig/icarus/hitTuning/gridDBV2/',
+                        help='Directory searched recursively for .db files')
+    parser.add_argument('-o', '--output', type=str, default='/nashome/m/micarrig/icarus/hitTuning/hitTuning_merged_v2.db',
+                        help='Merged database (created if it does not exist)')
+    parser.add_argument('-t', '--table', type=str, default='runs', help='Table to merge')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes [default: number of CPUs]')
+    parser.add_argument('--conflict', type=str, default='ignore', choices=['ignore', 'replace'],
+                        help='Keep the merged row or replace it with the new one when a runs row has the (jobNum, parameters, nEvents, cache_key) of a merged row')
+    parser.add_argument('--watch', type=float, default=None, metavar='SECONDS',
+                        help='Keep polling inputDir at this interval and merge job databases as they are completed')
+    parser.add_argument('--batchSize', type=int, default=50, help='Maximum number of job databases merged at once in --watch mode')
+    parser.add_argument('--expect', type=int, default=None, help='Stop --watch once this many job databases are merged')
+    parser.add_argument('--objective', type=str, default='ratio_total',
+                        help='Result column whose value closest to 1 is reported as the best configuration in --watch mode')
+    parser.add_argument('--status', type=str, default=None, help='JSON file rewritten with the progress after every --watch batch')
+    return parser.parse_args()
 
 if __name__ == "__main__":
 
-    inputDir = '/nashome/m/micarrig/icarus/hitTuning/gridDBV2/'
-    dest_db = '/nashome/m/micarrig/icarus/hitTuning/hitTuning_merged_v2.db'
+    args = parse_args()
+
+    if args.watch is not None:
+        watch(args.inputDir, args.output, table=args.table, conflict=args.conflict, jobs=args.jobs,
+              interval=args.watch, batch_size=args.batchSize, objective=args.objective, expect=args.expect,
+              status_file=args.status)
+        sys.exit(0)
 
+    start = time.time()
     db_files = []
-    counter = 0
-    for dirpath, dirnames, filenames in os.walk(inputDir):
+    for dirpath, dirnames, filenames in os.walk(args.inputDir):
         for filename in filenames:
-            #if counter > 10: break
             if filename.endswith('.db'):
-                fullPath = os.path.join(dirpath, filename)
-                db_files.append(fullPath)
-                counter += 1
+                db_files.append(os.path.join(dirpath, filename))
+    db_files.sort()
+    if os.path.abspath(args.output) in map(os.path.abspath, db_files):
+        db_files.remove(next(f for f in db_files if os.path.abspath(f) == os.path.abspath(args.output)))
+    print(f"Merging {len(db_files)} DB files from {args.inputDir}")
+    report_phase("scan", start, len(db_files), "files")
 
-    merge_sqlite_dbs(db_files, dest_db, table="runs", conflict="ignore")
+    merge_sqlite_dbs(db_files, args.output, table=args.table, conflict=args.conflict, jobs=args.jobs)
+    sys.exit(0)
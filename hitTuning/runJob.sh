@@ -119,7 +119,6 @@ if [[ ! -s ${CONDOR_DIR_INPUT}/${fileList} ]]; then
 fi
 
 echo "Job number: $jobNum" 
-outputFile="output_${jobNum}.root"
 
 # Set up working directories
 echo "Printing working directory of grid node" 
@@ -233,67 +232,130 @@ fi
 # ==============================================================================
 
 inputFile="${INPUT_TAR_DIR_LOCAL}/gridSkimFiles.list"
-fclFile="${INPUT_TAR_DIR_LOCAL}/gridFcl/hitTuning_test_${jobNum}.fcl"
+fclDir="${INPUT_TAR_DIR_LOCAL}/gridFcl"
+export FHICL_FILE_PATH="${fclDir}:${FHICL_FILE_PATH}"
+
+# Grid configurations run by this job: the ones listed for it in a job manifest
+# written by hitTuning.py --schedule, otherwise the configuration (or packed
+# group of configurations) numbered by the job section
+if [[ -n "${scheduleFile}" ]]; then
+    manifest="${CONDOR_DIR_INPUT}/$(basename ${scheduleFile})"
+    if [[ ! -s "${manifest}" ]]; then
+        echo "ERROR: Job manifest ${manifest} is missing or empty" >&2
+        cleanup_and_exit 21
+    fi
+    gridIndices=$(awk -v j="${jobNum}" '$1 == j {for (i = 2; i <= NF; i++) print $i}' "${manifest}")
+    if [[ -z "${gridIndices}" ]]; then
+        echo "ERROR: Job ${jobNum} has no configurations in ${scheduleFile}" >&2
+        cleanup_and_exit 22
+    fi
+    echo "Job manifest ${scheduleFile} assigns grid configurations: $(echo ${gridIndices})"
+else
+    gridIndices=${jobNum}
+fi
+
+# Run one grid configuration (or packed group) and transfer its outputs
+runGridIndex() {
+    local gridIndex=$1
+    local outputFile="output_${gridIndex}.root"
+    local fclFile="${fclDir}/hitTuning_test_${gridIndex}.fcl"
+
+    # Bulk-generated grids (hitTuning.py -c --bulk) share one base FCL and write
+    # identical configurations only once, so look the job up in the index files (one per shard)
+    local indexFiles=$(ls "${fclDir}"/hitTuning_test_index*.txt 2>/dev/null)
+    if [[ ! -f "${fclFile}" && -n "${indexFiles}" ]]; then
+        local fclName=$(awk -v j="${gridIndex}" '$1 == j {print $2; exit}' ${indexFiles})
+        if [[ -n "${fclName}" ]]; then
+            fclFile="${fclDir}/${fclName}"
+        fi
+    fi
+
+    # Use the staged FCL if present, otherwise hitTuning.py builds this job's
+    # configuration directly from its grid index
+    local fclArgs=""
+    if [[ -z "${scheduleFile}" && "${packSize:-1}" -gt 1 ]]; then
+        # Packed jobs always build their configurations from the parameter grid
+        fclArgs="--pack ${packSize}"
+    elif [[ -f "${fclFile}" ]]; then
+        fclArgs="--fclFile ${fclFile}"
+    else
+        echo "FCL file ${fclFile} not found, building grid configuration ${gridIndex} from the parameter grid"
+    fi
 
-echo "Running job ${jobNum} with script ${macro_file}"
-echo "  Input file: ${inputFile}"
-echo "  Output file: ${outputFile}"
-echo "  FCL file: ${fclFile}"
+    echo "Running grid configuration ${gridIndex} of job ${jobNum} with script ${macro_file}"
+    echo "  Input file: ${inputFile}"
+    echo "  Output file: ${outputFile}"
+    echo "  FCL file: ${fclFile}"
 
-pushd "${work_dir}" >/dev/null
-echo "Executing: python3 ${macro_file} ${inputFile} ${work_dir}/${outputFile} ${fclFile} ${jobNum} ${INPUT_TAR_DIR_LOCAL}"
+    pushd "${work_dir}" >/dev/null
+    echo "Executing: python3 ${macro_file} --runGrid --mc -i ${inputFile} -o ${work_dir}/${outputFile} ${fclArgs} -n ${gridIndex} -p ${INPUT_TAR_DIR_LOCAL}"
 
-if ! python3 ${macro_file} ${inputFile} ${work_dir}/${outputFile} ${fclFile} ${jobNum} ${INPUT_TAR_DIR_LOCAL}; then
+    if ! python3 ${macro_file} --runGrid --mc -i ${inputFile} -o ${work_dir}/${outputFile} ${fclArgs} -n ${gridIndex} -p ${INPUT_TAR_DIR_LOCAL}; then
+        popd >/dev/null
+        echo "ERROR: Command failed for file $runFile with exit code $?" >&2
+        cleanup_and_exit 40
+    fi
     popd >/dev/null
-    echo "ERROR: Command failed for file $runFile with exit code $?" >&2
-    cleanup_and_exit 40
-fi
-popd >/dev/null
 
-# ==============================================================================
-# Validate and Transfer Output Files
-# ==============================================================================
+    # ==========================================================================
+    # Validate and Transfer Output Files
+    # ==========================================================================
 
-echo "Job completed. Checking contents of working directory:"
-ls -ltrha "${work_dir}"
+    echo "Grid configuration ${gridIndex} completed. Checking contents of working directory:"
+    ls -ltrha "${work_dir}"
 
-# Verify output file was created
-if [[ ! -f "${work_dir}/${outputFile}" ]]; then
-    echo "ERROR: Expected output ${work_dir}/${outputFile} not produced" >&2
-    cleanup_and_exit 45
-else
-    mv -f "${work_dir}/${outputFile}" "${CONDOR_DIR_INPUT}/"
-fi
+    # Verify output file was created
+    if [[ ! -f "${work_dir}/${outputFile}" ]]; then
+        echo "ERROR: Expected output ${work_dir}/${outputFile} not produced" >&2
+        cleanup_and_exit 45
+    else
+        mv -f "${work_dir}/${outputFile}" "${CONDOR_DIR_INPUT}/"
+    fi
 
-echo "Transferring output files to scratch area via ifdh"
+    echo "Transferring output files to scratch area via ifdh"
 
-# Calculate subdirectory based on jobNum (groups of 100)
-subdir=$(printf "%02d" $((jobNum / 100)))
-target_dir="${outputDir}/outputs/${subdir}"
+    # Calculate subdirectory based on the grid index (groups of 100)
+    local subdir=$(printf "%02d" $((gridIndex / 100)))
+    local target_dir="${outputDir}/outputs/${subdir}"
 
-# Check if target directory exists
-if ! ifdh ls "$target_dir" >/dev/null 2>&1; then
-    echo "ERROR: Target directory $target_dir does not exist or is not accessible" >&2
-    cleanup_and_exit 50
-fi
+    # Check if target directory exists
+    if ! ifdh ls "$target_dir" >/dev/null 2>&1; then
+        echo "ERROR: Target directory $target_dir does not exist or is not accessible" >&2
+        cleanup_and_exit 50
+    fi
 
-# Transfer output ROOT file
-if ! ifdh cp "${CONDOR_DIR_INPUT}/output_${jobNum}.root" "$target_dir/"; then
-    echo "ERROR: ifdh cp failed for output_${jobNum}.root -> $target_dir/" >&2
-    cleanup_and_exit 60
-fi
+    # Transfer output ROOT file
+    if ! ifdh cp "${CONDOR_DIR_INPUT}/output_${gridIndex}.root" "$target_dir/"; then
+        echo "ERROR: ifdh cp failed for output_${gridIndex}.root -> $target_dir/" >&2
+        cleanup_and_exit 60
+    fi
 
-# Transfer histogram ROOT file
-if ! ifdh cp "${work_dir}/hist_output_${jobNum}.root" "$target_dir/"; then
-    echo "ERROR: ifdh cp failed for hist_output_${jobNum}.root -> $target_dir/" >&2
-    cleanup_and_exit 61
-fi
+    # Transfer histogram ROOT file
+    if ! ifdh cp "${work_dir}/hist_output_${gridIndex}.root" "$target_dir/"; then
+        echo "ERROR: ifdh cp failed for hist_output_${gridIndex}.root -> $target_dir/" >&2
+        cleanup_and_exit 61
+    fi
 
-# Transfer database file
-if ! ifdh cp "${work_dir}/hitTuning_${jobNum}.db" "$target_dir/"; then
-    echo "ERROR: ifdh cp failed for hitTuning_${jobNum}.db -> $target_dir/" >&2
-    cleanup_and_exit 62
-fi
+    # Transfer hit-truth dump ROOT file (not written by packed jobs)
+    if [[ -f "${work_dir}/truth_${gridIndex}.root" ]] && ! ifdh cp "${work_dir}/truth_${gridIndex}.root" "$target_dir/"; then
+        echo "ERROR: ifdh cp failed for truth_${gridIndex}.root -> $target_dir/" >&2
+        cleanup_and_exit 63
+    fi
+
+    # Transfer database file
+    if ! ifdh cp "${work_dir}/hitTuning_${gridIndex}.db" "$target_dir/"; then
+        echo "ERROR: ifdh cp failed for hitTuning_${gridIndex}.db -> $target_dir/" >&2
+        cleanup_and_exit 62
+    fi
+
+    # Free the scratch space before the next configuration of a scheduled job
+    rm -f "${CONDOR_DIR_INPUT}/output_${gridIndex}.root" "${work_dir}/hist_output_${gridIndex}.root" \
+          "${work_dir}/truth_${gridIndex}.root"
+}
+
+for gridIndex in ${gridIndices}; do
+    runGridIndex "${gridIndex}"
+done
 
 echo "Job completed successfully"
 cleanup_and_exit 0
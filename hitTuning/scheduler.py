@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import heapq
+import sqlite3
+import argparse
+from typing import List, Optional, Dict, Any, Tuple
+
+# Parameter columns of the runs table, in the order used for the cost model features
+PARAM_COLUMNS = [f'{name}_{plane}' for name in ['roiThreshold', 'minPulseHeight', 'minPulseSigma', 'LongMaxHits',
+                                                 'LongPulseWidth', 'PulseHeightCuts', 'PulseWidthCuts',
+                                                 'PulseRatioCuts']
+                 for plane in range(3)] + ['MaxMultiHit', 'Chi2NDF']
+
+# Cost columns recorded for each lar job by hitTuning.run()
+COST_METRICS = ['wall_time', 'cpu_time']
+
+def loadHistory(dbPaths: List[str], metric: str = 'wall_time',
+                nEvents: Optional[int] = None) -> Tuple[List[List[float]], List[float]]:
+    """Read the parameters and recorded cost of every timed run from hitTuning databases.
+
+    Args:
+        dbPaths: hitTuning databases to read, e.g. a merged grid database
+        metric: Cost column to read, 'wall_time' or 'cpu_time'
+        nEvents: Only use runs that processed this many events; all timed runs
+                 are used, with a warning, if none match
+
+    Returns:
+        Tuple of (parameter vectors in PARAM_COLUMNS order, costs in seconds)
+    """
+    if metric not in COST_METRICS:
+        raise ValueError(f"Unknown cost metric {metric}, expected one of {COST_METRICS}")
+    rows = []
+    for dbPath in dbPaths:
+        if not os.path.exists(dbPath):
+            print(f"Warning: cost history database {dbPath} not found")
+            continue
+        conn = sqlite3.connect(dbPath)
+        try:
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(runs)')}
+            if metric not in columns:
+                continue
+            rows += conn.execute(f'SELECT {", ".join(PARAM_COLUMNS)}, {metric}, nEvents FROM runs '
+                                 f'WHERE {metric} IS NOT NULL AND {metric} > 0').fetchall()
+        finally:
+            conn.close()
+
+    matching = [row for row in rows if row[-1] == nEvents]
+    if nEvents is not None and matching:
+        rows = matching
+    elif nEvents is not None and rows:
+        # Costs of runs with other event counts are on a different scale, and so are the predictions
+        print(f"Warning: no timed runs with nEvents={nEvents} in the cost history, "
+              f"using all {len(rows)} timed runs; predicted costs and job lifetimes may be off")
+    rows = [row for row in rows if None not in row[:len(PARAM_COLUMNS)]]
+    return [list(row[:len(PARAM_COLUMNS)]) for row in rows], [row[len(PARAM_COLUMNS)] for row in rows]
+
+class CostModel:
+    """k-nearest-neighbour cost prediction from the recorded costs of similar configurations.
+
+    Each parameter is scaled by its range over the recorded runs, and the cost
+    of a configuration is the inverse-distance weighted mean cost of its k
+    nearest recorded configurations. Without any history every configuration
+    is predicted to cost the same.
+    """
+
+    def __init__(self, features: List[List[float]], costs: List[float], k: int = 5) -> None:
+        import numpy as np
+        self.k = k
+        self.features = np.asarray(features, dtype=float).reshape(len(costs), len(PARAM_COLUMNS))
+        self.costs = np.asarray(costs, dtype=float)
+        if len(self.costs):
+            span = self.features.max(axis=0) - self.features.min(axis=0)
+            self.scale = np.where(span > 0, span, 1.0)
+            self.default = float(np.median(self.costs))
+        else:
+            self.scale = np.ones(len(PARAM_COLUMNS))
+            self.default = 1.0
+
+    def __len__(self) -> int:
+        return len(self.costs)
+
+    def predict(self, features: List[List[float]], chunkSize: int = 4096) -> List[float]:
+        """Predict the cost of configurations given as PARAM_COLUMNS vectors.
+
+        Args:
+            features: Parameter vectors of the configurations
+            chunkSize: Configurations per distance matrix, to bound memory on large grids
+
+        Returns:
+            Predicted cost of each configuration, in the unit of the history
+        """
+        import numpy as np
+        X = np.asarray(features, dtype=float).reshape(-1, len(PARAM_COLUMNS))
+        if not len(self.costs):
+            return [self.default] * len(X)
+        k = min(self.k, len(self.costs))
+        reference = self.features / self.scale
+        predictions = []
+        for first in range(0, len(X), chunkSize):
+            chunk = X[first:first + chunkSize] / self.scale
+            distances = np.sqrt(((chunk[:, None, :] - reference[None, :, :]) ** 2).sum(axis=2))
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            nearestDistances = np.take_along_axis(distances, nearest, axis=1)
+            weights = 1.0 / (nearestDistances + 1e-9)
+            predictions += list((weights * self.costs[nearest]).sum(axis=1) / weights.sum(axis=1))
+        return [float(p) for p in predictions]
+
+def lptPack(costs: Dict[Any, float], nSlots: int) -> Tuple[List[List[Any]], List[float]]:
+    """Bin-pack items into slots, longest processing time first.
+
+    Items are assigned in order of decreasing cost, each to the currently
+    least loaded slot, which keeps the makespan within 4/3 of the optimum.
+
+    Args:
+        costs: Predicted cost of each item, keyed by item (e.g. grid index)
+        nSlots: Number of job slots
+
+    Returns:
+        Tuple of (items of each slot in assignment order, predicted load of each slot)
+    """
+    nSlots = max(1, min(nSlots, len(costs)))
+    slots: List[List[Any]] = [[] for _ in range(nSlots)]
+    loads = [0.0] * nSlots
+    heap = [(0.0, slot) for slot in range(nSlots)]
+    for item, cost in sorted(costs.items(), key=lambda kv: -kv[1]):
+        load, slot = heapq.heappop(heap)
+        slots[slot].append(item)
+        loads[slot] = load + cost
+        heapq.heappush(heap, (loads[slot], slot))
+    return slots, loads
+
+def writeSchedule(path: str, slots: List[List[int]], loads: List[float], predictions: Dict[int, float],
+                  metric: str = 'wall_time', lifetimeMargin: float = 1.5) -> str:
+    """Write the job manifest read by runJob.sh and its prediction record.
+
+    The manifest has one line per grid job, '<jobNum> <grid index> <grid index> ...',
+    and a '# expected-lifetime <N>h' header for submitJobs.sh. The predicted
+    costs are written next to it as JSON for reportMakespan.
+
+    Args:
+        path: Manifest path; the prediction record is written to the same path with a .json suffix
+        slots: Grid indices of each job from lptPack
+        loads: Predicted cost of each job in seconds
+        predictions: Predicted cost of each grid index in seconds
+        metric: Cost column the predictions were made for
+        lifetimeMargin: Factor applied to the predicted makespan for the requested job lifetime
+
+    Returns:
+        Path of the prediction record
+    """
+    makespan = max(loads) if loads else 0.0
+    lifetime = max(1, int(-(-makespan * lifetimeMargin // 3600)))
+    with open(path, 'w') as f:
+        f.write(f'# expected-lifetime {lifetime}h\n')
+        for jobNum, indices in enumerate(slots):
+            f.write(f'{jobNum} ' + ' '.join(str(index) for index in indices) + '\n')
+
+    recordPath = os.path.splitext(path)[0] + '.json'
+    with open(recordPath, 'w') as f:
+        json.dump({'metric': metric, 'makespan': makespan, 'expected_lifetime_h': lifetime,
+                   'jobs': [{'jobNum': jobNum, 'indices': indices, 'predicted': load}
+                            for jobNum, (indices, load) in enumerate(zip(slots, loads))],
+                   'predictions': {str(index): cost for index, cost in predictions.items()}}, f)
+    return recordPath
+
+def actualCosts(dbPaths: List[str], jobNums: List[int], metric: str = 'wall_time') -> Dict[int, float]:
+    """Read the recorded cost of the latest timed run of each grid index.
+
+    Args:
+        dbPaths: hitTuning databases holding the runs of the scheduled jobs
+        jobNums: Grid indices to look up (the jobNum column of grid runs)
+        metric: Cost column to read
+
+    Returns:
+        Recorded cost of each grid index that has a timed run
+    """
+    wanted = set(jobNums)
+    costs = {}
+    for dbPath in dbPaths:
+        conn = sqlite3.connect(dbPath)
+        try:
+            for jobNum, cost in conn.execute(f'SELECT jobNum, {metric} FROM runs '
+                                             f'WHERE {metric} IS NOT NULL ORDER BY id'):
+                if jobNum in wanted:
+                    costs[jobNum] = cost
+        finally:
+            conn.close()
+    return costs
+
+def reportMakespan(slots: List[List[Any]], predictions: Dict[Any, float], actual: Dict[Any, float],
+                   actualMakespan: Optional[float] = None) -> Dict[str, float]:
+    """Print the predicted against the actual makespan of a schedule.
+
+    Args:
+        slots: Items of each slot
+        predictions: Predicted cost of each item
+        actual: Measured cost of each item; items without a measurement are left out
+        actualMakespan: Measured makespan if known (e.g. local wall time), otherwise
+                        the largest sum of measured item costs over the slots
+
+    Returns:
+        Dictionary of predicted_makespan, actual_makespan, and mean_abs_error
+        (mean relative error of the per-item predictions)
+    """
+    predictedLoads = [sum(predictions[item] for item in slot) for slot in slots]
+    actualLoads = [sum(actual.get(item, 0.0) for item in slot) for slot in slots]
+    predictedMakespan = max(predictedLoads, default=0.0)
+    if actualMakespan is None:
+        actualMakespan = max(actualLoads, default=0.0)
+    measured = [item for item in actual if item in predictions and actual[item] > 0]
+    meanError = (sum(abs(predictions[item] - actual[item]) / actual[item] for item in measured) / len(measured)
+                 if measured else float('nan'))
+
+    print(f"Schedule of {sum(len(slot) for slot in slots)} configurations in {len(slots)} slots, "
+          f"{len(measured)} measured")
+    print(f"  Predicted makespan: {predictedMakespan:.1f} s")
+    print(f"  Actual makespan:    {actualMakespan:.1f} s "
+          f"({actualMakespan / predictedMakespan if predictedMakespan > 0 else float('nan'):.2f}x predicted)")
+    if actualLoads and max(actualLoads) > 0:
+        mean = sum(actualLoads) / len(actualLoads)
+        print(f"  Actual slot load: mean {mean:.1f} s, max {max(actualLoads):.1f} s "
+              f"(imbalance {max(actualLoads) / mean:.2f})")
+    print(f"  Mean per-configuration prediction error: {100 * meanError:.1f}%")
+    return dict(predicted_makespan=predictedMakespan, actual_makespan=actualMakespan, mean_abs_error=meanError)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare a grid job schedule written by hitTuning.py --schedule "
+                                                 "with the recorded costs of its runs")
+    parser.add_argument('schedule', type=str, help='Job manifest written by hitTuning.py --schedule')
+    parser.add_argument('dbFiles', type=str, nargs='+', help='hitTuning databases with the runs of the scheduled jobs')
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    recordPath = os.path.splitext(args.schedule)[0] + '.json'
+    if not os.path.exists(recordPath):
+        print(f"Error: prediction record {recordPath} not found")
+        sys.exit(1)
+    with open(recordPath) as f:
+        record = json.load(f)
+    slots = [job['indices'] for job in record['jobs']]
+    predictions = {int(index): cost for index, cost in record['predictions'].items()}
+    actual = actualCosts(args.dbFiles, list(predictions), record['metric'])
+    reportMakespan(slots, predictions, actual)
@@ -22,9 +22,27 @@ export outputDir=$sourceDir          # Output directory for results
 export nEvents=-1                    # Number of events to process (-1 = all)
 export anaFile="hitTuning.py"        # Analysis script
 export treeName=""                   # Tree name for validation (optional)
-
-# Calculate number of jobs from FCL files
-nJobs=$(ls -l ${sourceDir}/gridFcl/*.fcl | wc -l)
+export packSize=1                    # Grid configurations run in one lar job (hitTuning.py --pack)
+export scheduleFile=""               # Job manifest from hitTuning.py --schedule (optional, overrides packSize)
+expectedLifetime="18h"               # Requested job lifetime (taken from the job manifest if given)
+
+# Calculate number of grid configurations from FCL files (or the indices of a bulk-generated grid,
+# one hitTuning_test_index_<i>of<N>.txt per shard when it was written with --shard)
+indexFiles=$(ls ${sourceDir}/gridFcl/hitTuning_test_index*.txt 2>/dev/null)
+if [ -n "$indexFiles" ]; then
+    nConfigs=$(cat $indexFiles | wc -l)
+else
+    nConfigs=$(ls -l ${sourceDir}/gridFcl/*.fcl | wc -l)
+fi
+if [ -n "$scheduleFile" ]; then
+    # Scheduled jobs run the grid configurations listed for them in the manifest
+    nJobs=$(grep -vc '^#' ${scheduleFile})
+    manifestLifetime=$(awk '$1 == "#" && $2 == "expected-lifetime" {print $3}' ${scheduleFile})
+    expectedLifetime=${manifestLifetime:-$expectedLifetime}
+else
+    # Each packed job runs packSize consecutive grid configurations
+    nJobs=$(( (nConfigs + packSize - 1) / packSize ))
+fi
 
 # Recopy files to grid storage?
 recopy=false
@@ -47,8 +65,8 @@ if [ ! -f "$outputDir/outputs" ]; then
     mkdir -p "$outputDir/outputs"
 fi
 
-# Create subdirectories for outputs and logs (groups of 100 jobs)
-for ((i=0; i<$((($nJobs + 99) / 100)); i++)); do
+# Create subdirectories for outputs and logs (groups of 100 grid configurations)
+for ((i=0; i<$((($nConfigs + 99) / 100)); i++)); do
     subdir=$(printf "%02d" $i)
     if [ ! -d $outputDir/outputs/$subdir ]; then
         mkdir -p $outputDir/outputs/$subdir
@@ -86,6 +104,12 @@ if [ -n "$pythonPackages" ] && ( [ ! -f ${sourceDir}/${pythonPackages} ] || [ "$
     cp /pnfs/icarus/scratch/users/micarrig/${pythonPackages} ${sourceDir}/.
 fi
 
+# Copy job manifest if needed (always recopied, it changes with every schedule)
+if [ -n "$scheduleFile" ]; then
+    echo "Copying job manifest to scratch area"
+    cp ${scheduleFile} ${sourceDir}/.
+fi
+
 # Copy file list if needed
 if [ -n "$fileList" ] && ( [ ! -f ${sourceDir}/${fileList} ] || [ "$recopy" = true ] ); then
     echo "Copying file list to scratch area"
@@ -105,7 +129,7 @@ echo "Using executable $exe and tar file $tarFile"
 echo "Output will be stored in $outputDir"
 
 # Build jobsub_submit command with resource requirements
-jobsub_cmd="jobsub_submit -G icarus -N ${nJobs} --maxConcurrent 50 --expected-lifetime=18h --disk=25GB --memory=8000MB -e IFDH_CP_MAXRETRIES=4 -e IFDH_CP_UNLINK_ON_ERROR=2 --lines '+FERMIHTC_AutoRelease=True' --lines '+FERMIHTC_GraceMemory=4096' --lines '+FERMIHTC_GraceLifetime=3600' -l '+SingularityImage=\"/cvmfs/singularity.opensciencegrid.org/fermilab/fnal-wn-sl7\:latest\"' --append_condor_requirements='(TARGET.HAS_Singularity==true)'"
+jobsub_cmd="jobsub_submit -G icarus -N ${nJobs} --maxConcurrent 50 --expected-lifetime=${expectedLifetime} --disk=25GB --memory=8000MB -e IFDH_CP_MAXRETRIES=4 -e IFDH_CP_UNLINK_ON_ERROR=2 --lines '+FERMIHTC_AutoRelease=True' --lines '+FERMIHTC_GraceMemory=4096' --lines '+FERMIHTC_GraceLifetime=3600' -l '+SingularityImage=\"/cvmfs/singularity.opensciencegrid.org/fermilab/fnal-wn-sl7\:latest\"' --append_condor_requirements='(TARGET.HAS_Singularity==true)'"
 
 # Add tarball to command if specified
 if [ -n "$tarFile" ] && [ -f "${sourceDir}/${tarFile}" ]; then
@@ -132,13 +156,18 @@ if [ -n "$pythonPackages" ]; then
     jobsub_cmd="${jobsub_cmd} -f ${sourceDir}/${pythonPackages}"
 fi
 
+# Add job manifest to command if specified
+if [ -n "$scheduleFile" ]; then
+    jobsub_cmd="${jobsub_cmd} -e scheduleFile -f ${sourceDir}/$(basename ${scheduleFile})"
+fi
+
 # Add file list to command if specified
 if [ -n "$fileList" ]; then
     jobsub_cmd="${jobsub_cmd} -e fileList -f ${sourceDir}/${fileList}"
 fi
 
 # Add output directory and event count environment variables, plus executable
-jobsub_cmd="${jobsub_cmd} -e outputDir -e nEvents file://${exe}"
+jobsub_cmd="${jobsub_cmd} -e outputDir -e nEvents -e packSize file://${exe}"
 
 # Execute job submission
 echo "Executing jobsub command:"